@@ -0,0 +1,256 @@
+# answer_cache.py
+#
+# Caché local de respuestas del chat libre para las preguntas que se repiten
+# ("¿cuánta agua bebo?", "¿es malo cenar tarde?"). La clave es la pregunta
+# normalizada más un trozo del perfil (objetivo, estilo, restricciones), y
+# la respuesta que se guarda se genera con un prompt que solo lleva ese
+# trozo (profile_text): sin nombre, historial ni días del plan, para que
+# valga para cualquiera con el mismo trozo. Solo entran las preguntas de
+# una clase FAQ explícita (faq(): agua, café, alcohol, hambre, snacks…);
+# el resto del chat se contesta con el plan y la memoria, y no se cachea.
+# Preguntas parecidas se encuentran por trigramas de caracteres (Dice, como
+# en foods.py) dentro del mismo trozo de perfil, con umbral de confianza,
+# TTL por entrada y expulsión LRU.
+
+import os, re, time, json, hashlib, unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from nutrition import objetivo_desde_texto
+from plan_cache import restriction_terms
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Similitud mínima (Dice sobre trigramas) para servir una respuesta cacheada
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.85"))
+# Mensajes más cortos que esto ("vale", "¿y eso?") dependen del hilo: no se cachean
+ANSWER_CACHE_MIN_CHARS = int(os.getenv("ANSWER_CACHE_MIN_CHARS", "12"))
+
+_STOPWORDS = {
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del", "al", "a", "en",
+    "y", "o", "que", "me", "mi", "mis", "te", "se", "lo", "por", "para", "con", "es",
+    "hola", "oye", "porfa", "favor", "gracias", "coach",
+}
+# Empiezan refiriéndose a lo anterior: la respuesta depende de la conversación
+_FOLLOW_UP_RE = re.compile(r"^(?:y|pero|entonces|vale|ok|eso|esto|tambien|ademas|y si)\b")
+_WORD_RE = re.compile(r"[a-z0-9ñ]+")
+# Temas de las preguntas frecuentes que no dependen del plan ni del hilo
+_FAQ_RE = re.compile(
+    r"\b(?:agua|hidrat\w*|cafes?|cafeina|infusion\w*|alcohol|cervezas?|vinos?|azucar\w*|edulcorantes?"
+    r"|sal|proteinas?|creatina|suplementos?|ayuno\w*|snacks?|picar|picoteo|hambre|saltarse|entrenar|entreno"
+    r"|fruta|frutas)\b"
+)
+
+
+def _ascii(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode()
+    return " ".join(text.lower().split())
+
+
+def normalize_question(text: str) -> str:
+    words = _WORD_RE.findall(_ascii(text))
+    return " ".join(w for w in words if w not in _STOPWORDS)
+
+
+def cacheable(text: str) -> bool:
+    t = _ascii(text)
+    return len(t) >= ANSWER_CACHE_MIN_CHARS and not _FOLLOW_UP_RE.match(t) and not t.startswith("/")
+
+
+def faq(text: str) -> bool:
+    # Pregunta general de la clase FAQ: la única que se contesta sin contexto
+    # (y se cachea); quien llama descarta además las que mencionan el plan
+    return cacheable(text) and bool(_FAQ_RE.search(_ascii(text)))
+
+
+def _slice(perfil: dict) -> dict:
+    # Solo lo que cambia la respuesta a una pregunta general
+    return {
+        "objetivo": objetivo_desde_texto(_ascii(perfil.get("objetivo_detallado"))),
+        "estilo": _ascii(perfil.get("estilo_dieta")),
+        "restricciones": restriction_terms(perfil),
+    }
+
+
+def profile_slice(perfil: dict) -> str:
+    return hashlib.sha256(json.dumps(_slice(perfil), sort_keys=True).encode()).hexdigest()[:32]
+
+
+def profile_text(perfil: dict) -> str:
+    # Perfil del prompt de las respuestas cacheables: exactamente la clave
+    key = _slice(perfil)
+    return "\n".join([
+        f"Objetivo: {key['objetivo']}",
+        f"Estilo de dieta: {key['estilo'] or 'sin especificar'}",
+        f"Alergias, vetos y alimentos que no le gustan: {', '.join(key['restricciones']) or 'ninguno'}",
+    ])
+
+
+def _trigrams(key: str) -> frozenset[str]:
+    padded = f"  {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _dice(a: frozenset, b: frozenset) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 1.0
+
+
+def _words_agree(a: str, b: str) -> bool:
+    # Dos preguntas largas pueden compartir casi todos los trigramas y
+    # diferir en la palabra que importa ("pollo" / "pavo"): cada palabra de
+    # una debe estar en la otra (o con una errata, Dice ≥ 0.5) y viceversa
+    wa, wb = set(a.split()), set(b.split())
+    for left, right in ((wa - wb, wb), (wb - wa, wa)):
+        for w in left:
+            grams = _trigrams(w)
+            if not any(_dice(grams, _trigrams(x)) >= 0.5 for x in right):
+                return False
+    return True
+
+
+@dataclass
+class _Entry:
+    slice_key: str
+    question: str
+    grams: frozenset[str]
+    digits: tuple[str, ...]
+    answer: str
+    expires_at: float
+    tokens: int        # prompt + respuesta de la llamada original
+    llm_seconds: float  # lo que tardó la llamada original
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int, ttl: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._by_key: dict[tuple[str, str], int] = {}                 # (trozo, pregunta) → id
+        self._by_gram: dict[tuple[str, str], set[int]] = {}           # (trozo, trigrama) → ids
+        self._next_id = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.hits_exact = 0
+        self.expired = 0
+        self.evicted = 0
+        self.stores = 0
+        self.tokens_saved = 0
+        self.llm_seconds_saved = 0.0
+        self.lookup_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._by_key.pop((entry.slice_key, entry.question), None)
+        for g in entry.grams:
+            ids = self._by_gram.get((entry.slice_key, g))
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._by_gram[(entry.slice_key, g)]
+
+    def _match(self, question: str, slice_key: str) -> tuple[Optional[int], float]:
+        entry_id = self._by_key.get((slice_key, question))
+        if entry_id is not None:
+            return entry_id, 1.0
+        grams = _trigrams(question)
+        digits = tuple(re.findall(r"\d+", question))
+        shared: dict[int, int] = {}
+        for g in grams:
+            for i in self._by_gram.get((slice_key, g), ()):
+                shared[i] = shared.get(i, 0) + 1
+        scored = []
+        for i, common in shared.items():
+            entry = self._entries[i]
+            # "2 litros" y "3 litros" comparten casi todo: las cifras deben coincidir
+            if entry.digits != digits:
+                continue
+            score = 2 * common / (len(grams) + len(entry.grams))
+            if score >= self.threshold:
+                scored.append((score, i))
+        for score, i in sorted(scored, reverse=True):
+            if _words_agree(question, self._entries[i].question):
+                return i, score
+        return None, 0.0
+
+    def get(self, text: str, slice_key: str, now: Optional[float] = None) -> Optional[str]:
+        t0 = time.perf_counter()
+        now = now or time.monotonic()
+        self.lookups += 1
+        try:
+            question = normalize_question(text)
+            if not question:
+                return None
+            entry_id, score = self._match(question, slice_key)
+            if entry_id is None or score < self.threshold:
+                return None
+            entry = self._entries[entry_id]
+            if now > entry.expires_at:
+                self._remove(entry_id)
+                self.expired += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.hits_exact += score == 1.0
+            self.tokens_saved += entry.tokens
+            self.llm_seconds_saved += entry.llm_seconds
+            return entry.answer
+        finally:
+            self.lookup_seconds += time.perf_counter() - t0
+
+    def put(self, text: str, slice_key: str, answer: str, tokens: int = 0, llm_seconds: float = 0.0,
+            ttl: Optional[float] = None, now: Optional[float] = None):
+        question = normalize_question(text)
+        if not question or not answer:
+            return
+        old = self._by_key.get((slice_key, question))
+        if old is not None:
+            self._remove(old)
+        entry_id = self._next_id
+        self._next_id += 1
+        entry = _Entry(
+            slice_key=slice_key,
+            question=question,
+            grams=_trigrams(question),
+            digits=tuple(re.findall(r"\d+", question)),
+            answer=answer,
+            expires_at=(now or time.monotonic()) + (self.ttl if ttl is None else ttl),
+            tokens=tokens,
+            llm_seconds=llm_seconds,
+        )
+        self._entries[entry_id] = entry
+        self._by_key[(slice_key, question)] = entry_id
+        for g in entry.grams:
+            self._by_gram.setdefault((slice_key, g), set()).add(entry_id)
+        self.stores += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hits_exact": self.hits_exact,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "stores": self.stores,
+            "lookup_avg_ms": round(self.lookup_seconds / self.lookups * 1e3, 3) if self.lookups else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "llm_seconds_saved": round(self.llm_seconds_saved, 2),
+        }
+
+
+cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_THRESHOLD)
+
+
+def stats() -> dict:
+    return {"enabled": ANSWER_CACHE_ENABLED, **cache.stats()}
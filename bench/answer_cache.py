@@ -0,0 +1,104 @@
+# bench/answer_cache.py
+#
+# Tráfico sintético de chat libre contra answer_cache.AnswerCache: un
+# conjunto de preguntas frecuentes con variaciones (tildes, signos, saludo,
+# mayúsculas, palabras de relleno) y una cola de preguntas únicas, repartido
+# entre varios trozos de perfil. Cada fallo "llama al LLM" (se guarda la
+# respuesta con un coste fijo de tokens y segundos) y se informa de:
+#   hit_rate, falsos positivos (respuesta de otra pregunta), latencia de la
+#   búsqueda y tokens/segundos de LLM ahorrados.
+#
+#   python -m bench.answer_cache --messages 20000 --slices 8
+
+import argparse
+import json
+import random
+import statistics
+import time
+
+import answer_cache
+
+FAQ = [
+    "¿Puedo cambiar la cena?",
+    "¿Cuánta agua bebo al día?",
+    "¿Puedo tomar café?",
+    "¿Qué hago si tengo hambre por la noche?",
+    "¿Puedo comer fruta después de cenar?",
+    "¿Es malo saltarse el desayuno?",
+    "¿Cuántas veces a la semana puedo comer pasta?",
+    "¿Puedo beber alcohol el fin de semana?",
+    "¿Qué snack saludable me recomiendas?",
+    "¿Cómo calculo mis proteínas?",
+    "¿Puedo sustituir el pollo por pavo?",
+    "¿Qué como antes de entrenar?",
+]
+NOISE = [
+    lambda s: s,
+    lambda s: s.lower(),
+    lambda s: s.strip("¿?"),
+    lambda s: "Hola coach, " + s,
+    lambda s: s.replace("á", "a").replace("é", "e").replace("í", "i").replace("ó", "o").replace("ú", "u"),
+    lambda s: s.upper(),
+    lambda s: s + " porfa",
+]
+WORDS = "aguacate boniato quinoa tofu salmón lentejas kéfir avena nueces garbanzos espinacas brócoli".split()
+
+TOKENS_PER_CALL = 900
+LLM_SECONDS_PER_CALL = 2.5
+
+
+def synthetic_traffic(n: int, faq_share: float, seed: int) -> list[tuple[str, str]]:
+    # (mensaje, id de la respuesta correcta); el orden de los ingredientes no
+    # cambia la pregunta
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        if rng.random() < faq_share:
+            i = min(int(rng.expovariate(0.35)), len(FAQ) - 1)  # unas pocas dominan
+            out.append((rng.choice(NOISE)(FAQ[i]), f"faq-{i}"))
+        else:
+            words, minutes = rng.sample(WORDS, 3), rng.randint(5, 60)
+            out.append((f"¿Cómo preparo {words[0]} con {words[1]} y {words[2]} en {minutes} minutos?",
+                        f"unique-{'-'.join(sorted(words))}-{minutes}"))
+    return out
+
+
+def main(messages: int, slices: int, faq_share: float, threshold: float):
+    cache = answer_cache.AnswerCache(answer_cache.ANSWER_CACHE_MAX_ENTRIES, 3600, threshold)
+    rng = random.Random(7)
+    traffic = synthetic_traffic(messages, faq_share, 1)
+    lat = []
+    wrong = 0
+    for text, expected in traffic:
+        slice_key = f"slice-{rng.randrange(slices)}"
+        t0 = time.perf_counter()
+        answer = cache.get(text, slice_key)
+        lat.append((time.perf_counter() - t0) * 1e6)
+        if answer is None:
+            cache.put(text, slice_key, expected, TOKENS_PER_CALL, LLM_SECONDS_PER_CALL)
+        elif answer != expected:
+            wrong += 1
+    lat.sort()
+    stats = cache.stats()
+    print(json.dumps({"messages": messages, "slices": slices, "faq_share": faq_share, "threshold": threshold}))
+    print(json.dumps({
+        "hit_rate": stats["hit_rate"],
+        "hits": stats["hits"],
+        "hits_exact": stats["hits_exact"],
+        "wrong_answers": wrong,
+        "entries": stats["entries"],
+        "lookup_p50_us": round(statistics.median(lat), 1),
+        "lookup_p99_us": round(lat[int(len(lat) * 0.99) - 1], 1),
+        "tokens_saved": stats["tokens_saved"],
+        "llm_seconds_saved": stats["llm_seconds_saved"],
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--slices", type=int, default=8)
+    parser.add_argument("--faq-share", type=float, default=0.6)
+    parser.add_argument("--threshold", type=float, default=answer_cache.ANSWER_CACHE_THRESHOLD)
+    args = parser.parse_args()
+    main(args.messages, args.slices, args.faq_share, args.threshold)
@@ -0,0 +1,98 @@
+# bench/db_pool.py
+#
+# Carga con N chats concurrentes: cada update lee su User y lo actualiza,
+# como hace process_update(). Compara el motor síncrono (bloquea el event
+# loop) con el motor async, y mide también el retraso máximo del event loop
+# con un latido cada 10 ms.
+#
+#   DATABASE_URL=postgresql+psycopg2://... python -m bench.db_pool --chats 50 --updates 20
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+_tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp.name}")
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal, SessionLocal, User, dispose_engines, init_db
+
+CHAT_PREFIX = "bench-db-"
+
+
+def seed(chats: int):
+    with SessionLocal() as s:
+        for i in range(chats):
+            chat_id = f"{CHAT_PREFIX}{i}"
+            if not s.query(User).filter(User.chat_id == chat_id).first():
+                s.add(User(chat_id=chat_id, onboarding_step=2))
+        s.commit()
+
+
+async def sync_update(chat_id: str):
+    with SessionLocal() as s:
+        u = s.query(User).filter(User.chat_id == chat_id).first()
+        u.edad = (u.edad or 0) + 1
+        s.commit()
+
+
+async def async_update(chat_id: str):
+    async with AsyncSessionLocal() as s:
+        u = (await s.execute(select(User).where(User.chat_id == chat_id))).scalars().first()
+        u.edad = (u.edad or 0) + 1
+        await s.commit()
+
+
+async def heartbeat(stop: asyncio.Event, lag: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lag.append(time.perf_counter() - t0 - 0.01)
+
+
+async def run(label: str, op, chats: int, updates: int, io_ms: float) -> dict:
+    async def chat(i: int):
+        for _ in range(updates):
+            await op(f"{CHAT_PREFIX}{i}")
+            await asyncio.sleep(io_ms / 1000)  # envío a Telegram simulado
+
+    stop, lag = asyncio.Event(), []
+    hb = asyncio.create_task(heartbeat(stop, lag))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(chat(i) for i in range(chats)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await hb
+    return {
+        "engine": label,
+        "chats": chats,
+        "updates": chats * updates,
+        "throughput_ups": round(chats * updates / elapsed, 1),
+        "loop_lag_max_ms": round(max(lag, default=0) * 1000, 2),
+    }
+
+
+async def main(chats: int, updates: int, io_ms: float):
+    init_db()
+    seed(chats)
+    results = [
+        await run("sync", sync_update, chats, updates, io_ms),
+        await run("async", async_update, chats, updates, io_ms),
+    ]
+    await dispose_engines()
+    for r in results:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=20)
+    parser.add_argument("--io-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.updates, args.io_ms))
+    os.unlink(_tmp.name)
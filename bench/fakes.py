@@ -0,0 +1,153 @@
+# bench/fakes.py
+#
+# Sustitutos locales de la Bot API de Telegram y de la API de OpenAI para
+# los benchmarks de extremo a extremo (bench/load.py). Cada uno es una app
+# FastAPI servida por uvicorn en su propio hilo, con latencia configurable,
+# inyección de errores y contadores de llamadas. El de OpenAI entiende las
+# peticiones del bot (semana de plan, resumen de chat, respuesta de chat) y
+# contesta con contenido válido, en bloque o en streaming SSE.
+
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DAYS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+MEALS = {
+    "desayuno": [("Avena con leche y plátano", "60 g de avena, 250 ml de leche, 1 plátano"),
+                 ("Tostadas con tomate y aceite de oliva", "2 rebanadas de pan, 1 tomate, 1 cucharada de aceite de oliva"),
+                 ("Yogur natural con nueces", "1 yogur, 20 g de nueces")],
+    "comida": [("Pollo a la plancha con arroz", "150 g de pollo, 80 g de arroz"),
+               ("Lentejas estofadas", "250 g de lentejas cocidas, 1 zanahoria"),
+               ("Merluza al horno con patata", "180 g de merluza, 200 g de patata")],
+    "merienda": [("Fruta de temporada", "1 pieza de fruta"), ("Queso fresco", "100 g de queso fresco")],
+    "cena": [("Tortilla francesa con ensalada", "2 huevos, 1 lechuga"),
+             ("Salmón con brócoli", "150 g de salmón, 200 g de brócoli"),
+             ("Crema de calabaza", "300 g de calabaza, 1 patata")],
+}
+_WEEK_RE = re.compile(r"semana (\d+) de (\d+)")
+
+
+@dataclass
+class FakeConfig:
+    latency_s: float = 0.0       # Telegram: por llamada; OpenAI: hasta el primer token
+    token_delay_s: float = 0.0   # OpenAI: entre trozos del stream
+    chunk_chars: int = 16        # OpenAI: caracteres por trozo
+    error_rate: float = 0.0      # fracción de llamadas que fallan
+    error_status: int = 500      # 429 en Telegram incluye retry_after
+    retry_after: int = 1
+    seed: int = 0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+# ---------- Telegram ----------
+def make_fake_telegram(cfg: FakeConfig, calls: Counter) -> FastAPI:
+    fake = FastAPI()
+    rng = random.Random(cfg.seed)
+    message_ids = iter(range(1, 1 << 62))
+
+    @fake.post("/bot{token}/{method}")
+    async def api(token: str, method: str, request: Request):
+        calls[method] += 1
+        if cfg.latency_s:
+            await asyncio.sleep(cfg.latency_s)
+        if rng.random() < cfg.error_rate:
+            calls["errors"] += 1
+            body = {"ok": False, "error_code": cfg.error_status, "description": "injected"}
+            if cfg.error_status == 429:
+                body["parameters"] = {"retry_after": cfg.retry_after}
+            return JSONResponse(body, status_code=cfg.error_status)
+        payload = await request.json()
+        return {"ok": True, "result": {"message_id": next(message_ids), "chat": {"id": payload.get("chat_id")}}}
+
+    return fake
+
+
+# ---------- OpenAI ----------
+def week_json(semana: int, rng: random.Random) -> str:
+    dias = {d: {m: dict(zip(("comida", "cantidad"), rng.choice(opts))) for m, opts in MEALS.items()} for d in DAYS}
+    return json.dumps({"semana": semana, "dias": dias}, ensure_ascii=False)
+
+
+def reply_for(body: dict, rng: random.Random) -> str:
+    messages = body.get("messages") or []
+    last = messages[-1]["content"] if messages else ""
+    first = messages[0]["content"] if messages else ""
+    m = _WEEK_RE.search(last)
+    if m and "Genera la semana" in last:
+        return week_json(int(m.group(1)), rng)
+    if first.startswith("Resume la conversación"):
+        return "El usuario pregunta por cambios de cena y por la hidratación; se acordó beber 2 litros al día."
+    return ("¡Claro! Puedes cambiar la cena por otra opción con proteína magra y verdura, "
+            "por ejemplo merluza con ensalada. Mantén la ración parecida y bebe agua durante el día.")
+
+
+def _chunk(delta: dict, finish=None) -> str:
+    data = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def make_fake_openai(cfg: FakeConfig, calls: Counter) -> FastAPI:
+    fake = FastAPI()
+    rng = random.Random(cfg.seed)
+
+    @fake.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        calls["completions"] += 1
+        if rng.random() < cfg.error_rate:
+            calls["errors"] += 1
+            return JSONResponse({"error": {"message": "injected", "type": "server_error"}}, status_code=cfg.error_status)
+        content = reply_for(body, rng)
+        calls["completion_tokens"] += max(1, len(content) // 4)
+        calls["prompt_tokens"] += sum(len(m.get("content") or "") for m in body.get("messages") or []) // 4
+        parts = [content[i:i + cfg.chunk_chars] for i in range(0, len(content), cfg.chunk_chars)]
+        if cfg.latency_s:
+            await asyncio.sleep(cfg.latency_s)
+
+        if body.get("stream"):
+            calls["streams"] += 1
+
+            async def events():
+                yield _chunk({"role": "assistant", "content": ""})
+                for part in parts:
+                    if cfg.token_delay_s:
+                        await asyncio.sleep(cfg.token_delay_s)
+                    yield _chunk({"content": part})
+                yield _chunk({}, "stop")
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        if cfg.token_delay_s:
+            await asyncio.sleep(cfg.token_delay_s * len(parts))
+        return {
+            "id": "fake", "object": "chat.completion", "created": 0, "model": "fake",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4},
+        }
+
+    return fake
@@ -0,0 +1,100 @@
+# bench/food_lookup.py
+#
+# Búsquedas en la tabla local de alimentos (foods.FoodIndex):
+#   exact   → nombres/alias tal cual están en la tabla
+#   noisy   → plurales, tildes, métodos de cocción, erratas ("quesso fresco")
+#   nocache → noisy sin la lru de _lookup_key (coste real del índice)
+#   linear  → la misma búsqueda difusa comparando contra todas las claves
+#             (sin índice de trigramas), como referencia
+#   day     → puntuación de un día completo (parseo + búsqueda + macros)
+# Las cachés lru se vacían antes de cada caso para medir la búsqueda real.
+#
+#   python -m bench.food_lookup --lookups 20000
+
+import argparse
+import json
+import random
+import time
+
+import foods
+import nutrition
+from ingredients import normalize_name
+
+NOISE = [
+    lambda s: s + "s",
+    lambda s: s.replace("a", "á", 1),
+    lambda s: s + " a la plancha",
+    lambda s: "pechuga de " + s,
+    lambda s: s[:-1] + s[-1] * 2,
+    lambda s: s[: len(s) // 2] + s[len(s) // 2 + 1:],
+    lambda s: s.upper(),
+]
+
+DAY = {
+    "desayuno": {"comida": "Avena con leche y plátano", "cantidad": "60 g de avena, 200 ml de leche, 1 plátano"},
+    "comida": {"comida": "Pollo a la plancha con arroz", "cantidad": "150 g y 80 g"},
+    "merienda": {"comida": "Yogur griego con nueces", "cantidad": "1 unidad y un puñado"},
+    "cena": {"comida": "Merluza al horno con patata", "cantidad": "180 g de merluza, 200 g de patata"},
+}
+
+
+def linear_lookup(index: foods.FoodIndex, name: str):
+    key = normalize_name(name)[0]
+    grams = foods._trigrams(key)
+    best, best_score = None, 0.0
+    for k, fid in index._keys:
+        other = foods._trigrams(k)
+        score = 2 * len(grams & other) / (len(grams) + len(other))
+        if score > best_score:
+            best, best_score = fid, score
+    return best if best_score >= foods.FOOD_MATCH_THRESHOLD else None
+
+
+def timed(label: str, fn, queries: list) -> dict:
+    foods.FoodIndex._lookup_key.cache_clear()
+    normalize_name.cache_clear()
+    t0 = time.perf_counter()
+    hits = sum(fn(q) is not None for q in queries)
+    elapsed = time.perf_counter() - t0
+    return {
+        "case": label,
+        "lookups": len(queries),
+        "matched": hits,
+        "per_s": round(len(queries) / elapsed),
+        "us_per_lookup": round(elapsed / len(queries) * 1e6, 1),
+    }
+
+
+def main(lookups: int, seed: int):
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    index = foods.get_index()
+    print(json.dumps({"foods": len(index), "keys": len(index.exact), "load_ms": round((time.perf_counter() - t0) * 1e3, 1)}))
+
+    names = [k for k, _ in index._keys]
+    exact = [rng.choice(names) for _ in range(lookups)]
+    noisy = [rng.choice(NOISE)(rng.choice(names)) for _ in range(lookups)]
+
+    results = [
+        timed("exact", index.lookup, exact),
+        timed("noisy", index.lookup, noisy),
+        timed("nocache", lambda q: foods.FoodIndex._lookup_key.__wrapped__(index, normalize_name(q)[0]), noisy),
+        timed("linear", lambda q: linear_lookup(index, q), noisy[: max(lookups // 10, 1)]),
+    ]
+    targets = nutrition.calcular_macros(72, 2200)
+    days = max(lookups // 20, 1)
+    t0 = time.perf_counter()
+    for _ in range(days):
+        score = nutrition.score_day(1, "lunes", DAY, targets)
+    elapsed = time.perf_counter() - t0
+    results.append({"case": "day", "days": days, "per_s": round(days / elapsed), "last_score": score.puntuacion})
+    for r in results:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.lookups, args.seed)
@@ -0,0 +1,102 @@
+# bench/latest_plan.py
+#
+# "Último plan del chat" con muchas filas sintéticas en menulogs:
+#   global_scan      → la consulta antigua (sin chat_id; además devuelve el plan de otro)
+#   chat_single_idx  → filtro por chat_id solo con los índices de una columna
+#   chat_composite   → filtro por chat_id con el índice (chat_id, timestamp DESC)
+#   active_pointer   → User.menu_activo["menu_log_id"] → lectura por clave primaria
+#
+#   python -m bench.latest_plan --rows 1000000 --chats 10000
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp.name}")
+
+from sqlalchemy import insert, select
+
+from db import MenuLog, SessionLocal, engine, init_db, ix_menulogs_chat_id_timestamp
+
+
+def seed(rows: int, chats: int, batch: int = 50_000):
+    base = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for start in range(0, rows, batch):
+            conn.execute(insert(MenuLog), [
+                {
+                    "chat_id": str(random.randrange(chats)),
+                    "params": {},
+                    "menu_json": {},
+                    "timestamp": base + timedelta(seconds=random.randrange(365 * 86400)),
+                }
+                for _ in range(start, min(start + batch, rows))
+            ])
+
+
+def timed(label: str, fn, keys: list) -> dict:
+    lat = []
+    with SessionLocal() as s:
+        for k in keys:
+            t0 = time.perf_counter()
+            fn(s, k)
+            lat.append((time.perf_counter() - t0) * 1e6)
+    lat.sort()
+    return {
+        "query": label,
+        "lookups": len(keys),
+        "p50_us": round(statistics.median(lat), 1),
+        "p95_us": round(lat[int(len(lat) * 0.95) - 1], 1),
+    }
+
+
+def global_scan(s, chat_id):
+    return s.execute(select(MenuLog).order_by(MenuLog.timestamp.desc()).limit(1)).scalars().first()
+
+
+def per_chat(s, chat_id):
+    q = select(MenuLog).where(MenuLog.chat_id == chat_id).order_by(MenuLog.timestamp.desc()).limit(1)
+    return s.execute(q).scalars().first()
+
+
+def by_pointer(s, log_id):
+    return s.get(MenuLog, log_id)
+
+
+def main(rows: int, chats: int, lookups: int):
+    init_db()
+    t0 = time.perf_counter()
+    seed(rows, chats)
+    print(json.dumps({"seeded_rows": rows, "chats": chats, "seed_s": round(time.perf_counter() - t0, 1)}))
+
+    chat_keys = [str(random.randrange(chats)) for _ in range(lookups)]
+    results = [timed("global_scan", global_scan, chat_keys)]
+
+    ix_menulogs_chat_id_timestamp.drop(bind=engine)
+    results.append(timed("chat_single_idx", per_chat, chat_keys))
+    ix_menulogs_chat_id_timestamp.create(bind=engine)
+    results.append(timed("chat_composite", per_chat, chat_keys))
+
+    # Punteros: el id del último plan de cada chat consultado
+    with SessionLocal() as s:
+        pointers = [per_chat(s, k).id for k in chat_keys]
+    results.append(timed("active_pointer", by_pointer, pointers))
+
+    for r in results:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chats", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    args = parser.parse_args()
+    main(args.rows, args.chats, args.lookups)
+    os.unlink(_tmp.name)
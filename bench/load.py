@@ -0,0 +1,336 @@
+# bench/load.py
+#
+# Prueba de carga de extremo a extremo sin red externa: arranca la app
+# (main.app, con sus workers de la cola y el dispatcher de Telegram) contra
+# un Telegram y un OpenAI locales (bench/fakes.py) y una base de datos
+# temporal, y envía a /webhook mezclas sintéticas de updates a ritmo
+# controlado. Por escenario informa, en una línea JSON:
+#   latencia webhook → update procesado (p50/p95/p99/max), tiempo del handler,
+#   throughput, sentencias SQL por update y totales, llamadas salientes a
+#   Telegram (por método) y a OpenAI, y updates fallidos.
+#
+# Escenarios (en el orden dado; los de usuarios existentes comparten una
+# población sembrada directamente en la base de datos):
+#   onboarding → /start y todas las preguntas, chats nuevos
+#   generate   → «Generar dieta» (stream de la semana 1 + semanas en 2º plano)
+#   menu       → perfil, ayuda, visor del plan, lista de la compra
+#   chat       → entrar al chat libre, tres preguntas y /menu
+#   mixed      → todo lo anterior mezclado por pesos
+#
+#   python -m bench.load --scenarios onboarding,generate,menu,chat --users 20 --rate 40
+#   python -m bench.load --llm-latency-ms 800 --llm-error-rate 0.05 --out runs.jsonl
+#   DATABASE_URL=postgresql+psycopg2://... python -m bench.load
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+_tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp.name}")
+
+import httpx
+
+from bench.fakes import FakeConfig, free_port, make_fake_openai, make_fake_telegram, start_server
+
+SCENARIOS = ("onboarding", "generate", "menu", "chat", "mixed")
+MIXED_WEIGHTS = {"onboarding": 1, "generate": 1, "menu": 4, "chat": 3}
+CHAT_QUESTIONS = [
+    "¿Puedo cambiar la cena de hoy?",
+    "¿Cuánta agua bebo al día?",
+    "¿Qué desayuno mañana?",
+    "¿Puedo tomar café por la tarde?",
+    "dime la comida del jueves",
+]
+PROFILE = {
+    "sexo": "Masculino", "edad": 35, "altura_cm": 180.0, "peso_kg": 78.0, "actividad": "moderado",
+    "objetivo_detallado": "Perder grasa", "estilo_dieta": "Mediterránea", "preferencias": "Pescado y verduras",
+    "no_gustos": "Coliflor", "alergias": "Ninguna", "vetos": "Nada", "tiempo_cocina": "30",
+    "equipamiento": "Horno y sartén", "duracion_plan_semanas": 2, "pais": "España",
+}
+
+
+# ---------- updates sintéticos ----------
+class UpdateFactory:
+    def __init__(self):
+        self.next_id = 1
+
+    def _id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def text(self, chat_id: int, text: str) -> dict:
+        return {"update_id": self._id(), "message": {"chat": {"id": chat_id}, "text": text}}
+
+    def callback(self, chat_id: int, data: str) -> dict:
+        uid = self._id()
+        return {
+            "update_id": uid,
+            "callback_query": {"id": f"cb{uid}", "data": data, "message": {"chat": {"id": chat_id}, "message_id": 1}},
+        }
+
+
+def sequence(kind: str, chat_id: int, f: UpdateFactory, rng: random.Random) -> list[dict]:
+    # Updates de un chat, en orden
+    if kind == "onboarding":
+        from bench.onboarding_flow import STEPS  # importa main: solo tras configurar el entorno
+        return [f.callback(chat_id, v) if k == "callback" else f.text(chat_id, v) for k, v in STEPS]
+    if kind == "generate":
+        return [f.callback(chat_id, "menu_generate")]
+    if kind == "menu":
+        return [f.callback(chat_id, d) for d in
+                ("menu_profile", "menu_plan", "plan_1_w_0", "plan_1_2_0", "menu_shopping", "shop_all", "menu_help")]
+    if kind == "chat":
+        return ([f.callback(chat_id, "menu_chat")]
+                + [f.text(chat_id, q) for q in rng.sample(CHAT_QUESTIONS, 3)]
+                + [f.text(chat_id, "/menu")])
+    raise ValueError(kind)
+
+
+def interleave(seqs: list[list[dict]]) -> list[dict]:
+    # Round-robin entre chats: el orden dentro de cada chat se conserva
+    out, i = [], 0
+    while any(seqs):
+        for seq in seqs:
+            if len(seq) > i:
+                out.append(seq[i])
+        i += 1
+        if all(len(seq) <= i for seq in seqs):
+            break
+    return out
+
+
+def seed_users(chat_ids: list[int]):
+    from db import SessionLocal, User
+    with SessionLocal() as s:
+        for chat_id in chat_ids:
+            if s.query(User).filter(User.chat_id == str(chat_id)).first() is None:
+                s.add(User(chat_id=str(chat_id), onboarding_step=0, semana_actual=1, **PROFILE))
+        s.commit()
+
+
+# ---------- medición ----------
+class Recorder:
+    # Envuelve process_update (corre en el hilo del servidor de la app)
+    def __init__(self, handler):
+        self.handler = handler
+        self.done: dict[int, float] = {}
+        self.handler_ms: dict[int, float] = {}
+        self.queries: dict[int, int] = {}
+        self.failures = Counter()
+
+    async def __call__(self, data: dict):
+        from db import count_queries
+        uid = data.get("update_id")
+        t0 = time.perf_counter()
+        with count_queries() as q:
+            try:
+                result = await self.handler(data)
+            except Exception as e:
+                self.failures[type(e).__name__] += 1
+                raise
+        end = time.perf_counter()
+        self.done.setdefault(uid, end)
+        self.handler_ms[uid] = (end - t0) * 1e3
+        self.queries[uid] = q[0]
+        return result
+
+
+def pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))], 2)
+
+
+async def run_scenario(name: str, updates: list[dict], rate: float, base_url: str, rec: Recorder,
+                       tg_calls: Counter, llm_calls: Counter, sql: list, timeout: float) -> dict:
+    tg_before, llm_before, sql_before = Counter(tg_calls), Counter(llm_calls), sql[0]
+    sent: dict[int, float] = {}
+    webhook_ms = []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        async def post(u: dict):
+            t0 = time.perf_counter()
+            sent[u["update_id"]] = t0
+            r = await client.post("/webhook", json=u)
+            r.raise_for_status()
+            webhook_ms.append((time.perf_counter() - t0) * 1e3)
+
+        t_start = time.perf_counter()
+        tasks = []
+        for i, u in enumerate(updates):
+            delay = t_start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(u)))
+        await asyncio.gather(*tasks)
+
+    ids = [u["update_id"] for u in updates]
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and any(i not in rec.done for i in ids):
+        await asyncio.sleep(0.05)
+    elapsed = max(rec.done.get(i, 0) for i in ids) - t_start if ids else 0.0
+    # Los envíos a Telegram salen por el dispatcher: se espera a que se vacíe
+    import telegram_utils
+    while time.perf_counter() < deadline and telegram_utils.dispatcher_stats().get("queue_depth"):
+        await asyncio.sleep(0.05)
+
+    done = [i for i in ids if i in rec.done]
+    e2e = [(rec.done[i] - sent[i]) * 1e3 for i in done]
+    handler = [rec.handler_ms[i] for i in done]
+    queries = [rec.queries[i] for i in done]
+    tg = Counter(tg_calls)
+    tg.subtract(tg_before)
+    llm = Counter(llm_calls)
+    llm.subtract(llm_before)
+    return {
+        "scenario": name,
+        "updates": len(ids),
+        "processed": len(done),
+        "timed_out": len(ids) - len(done),
+        "rate_target": rate,
+        "duration_s": round(elapsed, 3),
+        "throughput_ups": round(len(done) / elapsed, 1) if elapsed > 0 else 0.0,
+        "webhook_p50_ms": pct(webhook_ms, 50),
+        "webhook_p99_ms": pct(webhook_ms, 99),
+        "e2e_p50_ms": pct(e2e, 50),
+        "e2e_p95_ms": pct(e2e, 95),
+        "e2e_p99_ms": pct(e2e, 99),
+        "e2e_max_ms": round(max(e2e), 2) if e2e else 0.0,
+        "handler_p50_ms": pct(handler, 50),
+        "handler_p99_ms": pct(handler, 99),
+        "queries_per_update_avg": round(statistics.mean(queries), 2) if queries else 0.0,
+        "queries_per_update_max": max(queries) if queries else 0,
+        "queries_total": sql[0] - sql_before,
+        "telegram_calls": {k: v for k, v in sorted(tg.items()) if v},
+        "openai_calls": {k: v for k, v in sorted(llm.items()) if v},
+    }
+
+
+# ---------- main ----------
+async def main(args) -> int:
+    tg_calls, llm_calls = Counter(), Counter()
+    tg_cfg = FakeConfig(latency_s=args.tg_latency_ms / 1e3, error_rate=args.tg_error_rate,
+                        error_status=args.tg_error_status, seed=args.seed)
+    llm_cfg = FakeConfig(latency_s=args.llm_latency_ms / 1e3, token_delay_s=args.llm_token_delay_ms / 1e3,
+                         chunk_chars=args.llm_chunk_chars, error_rate=args.llm_error_rate,
+                         error_status=args.llm_error_status, seed=args.seed)
+    tg_port, llm_port, app_port = free_port(), free_port(), free_port()
+    servers = [
+        start_server(make_fake_telegram(tg_cfg, tg_calls), tg_port),
+        start_server(make_fake_openai(llm_cfg, llm_calls), llm_port),
+    ]
+
+    # Los módulos de la app leen la configuración al importarse
+    os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{tg_port}"
+    os.environ["TELEGRAM_BOT_TOKEN"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ.pop("PUBLIC_BASE_URL", None)
+    os.environ.setdefault("QUEUE_POLL_INTERVAL", "0.2")
+
+    import main as app_main
+    import user_cache
+    from db import async_engine
+    from sqlalchemy import event
+
+    sql = [0]
+
+    def _count(*_):
+        sql[0] += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _count)
+    rec = Recorder(app_main.process_update)
+    app_main.process_update = rec  # startup_event la pasa a los workers
+    servers.append(start_server(app_main.app, app_port))
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    rng = random.Random(args.seed)
+    f = UpdateFactory()
+    population = [900_000 + i for i in range(args.users)]
+    seed_users(population)
+    next_new_chat = [100_000]
+
+    def new_chats(n: int) -> list[int]:
+        start = next_new_chat[0]
+        next_new_chat[0] += n
+        return list(range(start, start + n))
+
+    print(json.dumps({
+        "config": {
+            "database": os.environ["DATABASE_URL"].split("://", 1)[0],
+            "users": args.users, "rate": args.rate, "seed": args.seed,
+            "tg_latency_ms": args.tg_latency_ms, "tg_error_rate": args.tg_error_rate,
+            "llm_latency_ms": args.llm_latency_ms, "llm_token_delay_ms": args.llm_token_delay_ms,
+            "llm_error_rate": args.llm_error_rate,
+        }
+    }))
+    results = []
+    for name in args.scenarios:
+        if name == "onboarding":
+            seqs = [sequence("onboarding", c, f, rng) for c in new_chats(args.users)]
+        elif name == "mixed":
+            kinds = list(MIXED_WEIGHTS)
+            seqs = []
+            for chat_id in population:
+                kind = rng.choices(kinds, weights=[MIXED_WEIGHTS[k] for k in kinds])[0]
+                chat = new_chats(1)[0] if kind == "onboarding" else chat_id
+                seqs.append(sequence(kind, chat, f, rng))
+        else:
+            seqs = [sequence(name, c, f, rng) for c in population]
+        cache_before = user_cache.cache.stats()
+        result = await run_scenario(name, interleave(seqs), args.rate, base_url, rec,
+                                    tg_calls, llm_calls, sql, args.timeout)
+        cache_after = user_cache.cache.stats()
+        hits = cache_after["hits"] - cache_before["hits"]
+        lookups = hits + sum(cache_after[k] - cache_before[k] for k in ("misses", "expired"))
+        result["user_cache_hit_ratio"] = round(hits / lookups, 3) if lookups else 0.0
+        result["user_reads_avoided"] = hits
+        result["failures"] = dict(rec.failures)
+        rec.failures.clear()
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as fh:
+            for r in results:
+                fh.write(json.dumps({"run_at": time.time(), **r}, ensure_ascii=False) + "\n")
+
+    for server in reversed(servers):
+        server.should_exit = True
+    await asyncio.sleep(0.5)
+    return 1 if any(r["timed_out"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", type=lambda s: [x for x in s.split(",") if x],
+                        default=["onboarding", "generate", "menu", "chat"])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=40, help="updates/s enviados a /webhook")
+    parser.add_argument("--timeout", type=float, default=120, help="espera máxima por escenario (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tg-latency-ms", type=float, default=20)
+    parser.add_argument("--tg-error-rate", type=float, default=0.0)
+    parser.add_argument("--tg-error-status", type=int, default=429)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-token-delay-ms", type=float, default=2)
+    parser.add_argument("--llm-chunk-chars", type=int, default=16)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-status", type=int, default=500)
+    parser.add_argument("--out", default=None, help="añade los resultados (JSON lines) a este fichero")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+    code = asyncio.run(main(args))
+    if os.environ["DATABASE_URL"].endswith(_tmp.name):
+        os.unlink(_tmp.name)
+    sys.exit(code)
@@ -0,0 +1,69 @@
+# bench/nutrition_batch.py
+#
+# Objetivos de kcal/macros para N perfiles sintéticos:
+#   per_row → mifflin_st_jeor → tdee → objetivo_kcal → calcular_macros por fila
+#   batch   → nutrition.calcular_lote sobre columnas (NumPy)
+# Comprueba además que ambos caminos dan exactamente lo mismo.
+#
+#   python -m bench.nutrition_batch --rows 200000
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import nutrition as n
+
+SEXOS = ["Masculino", "Femenino", "No decir"]
+ACTIVIDADES = ["sedentario", "ligero", "moderado", "alto", "muy_alto"]
+OBJETIVOS = ["perder grasa", "ganar masa muscular", "mantener mi peso", "definir"]
+
+
+def columns(rows: int, seed: int):
+    rng = random.Random(seed)
+    return (
+        [rng.choice(SEXOS) for _ in range(rows)],
+        [round(rng.uniform(45, 130), 1) for _ in range(rows)],
+        [rng.randint(145, 205) for _ in range(rows)],
+        [rng.randint(16, 85) for _ in range(rows)],
+        [rng.choice(ACTIVIDADES) for _ in range(rows)],
+        [rng.choice(OBJETIVOS) for _ in range(rows)],
+    )
+
+
+def per_row(sexo, peso, altura, edad, actividad, objetivo) -> list[dict]:
+    out = []
+    for s, kg, cm, e, a, o in zip(sexo, peso, altura, edad, actividad, objetivo):
+        bmr = n.mifflin_st_jeor(s, kg, cm, e)
+        out.append(n.calcular_macros(kg, n.objetivo_kcal(n.tdee(bmr, a), n.objetivo_desde_texto(o))))
+    return out
+
+
+def main(rows: int, seed: int):
+    cols = columns(rows, seed)
+
+    t0 = time.perf_counter()
+    expected = per_row(*cols)
+    t_row = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    got = n.calcular_lote(*cols)
+    t_batch = time.perf_counter() - t0
+
+    same = all(
+        np.array_equal(np.asarray([r[k] for r in expected], dtype=float), got[k])
+        for k in ("kcal", "prote_g", "grasa_g", "carbo_g")
+    )
+    for label, t in (("per_row", t_row), ("batch", t_batch)):
+        print(json.dumps({"case": label, "rows": rows, "s": round(t, 3), "rows_per_s": round(rows / t)}))
+    print(json.dumps({"identical": same, "speedup": round(t_row / t_batch, 1)}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.rows, args.seed)
@@ -0,0 +1,92 @@
+# bench/onboarding_flow.py
+#
+# Recorre el onboarding completo llamando a process_update() sobre SQLite
+# y cuenta, por update, las sentencias SQL y los mensajes enviados a Telegram.
+# Cada transición del onboarding debe producir exactamente un sendMessage.
+#
+#   python -m bench.onboarding_flow [--max-queries 2] [--max-sends 1]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp.name}")
+
+import httpx
+
+import telegram_utils
+from db import count_queries
+from main import process_update
+
+CHAT_ID = 4242
+
+STEPS = [
+    ("text", "/start"),
+    ("callback", "sexo_M"),
+    ("text", "muchos"),          # inválido: solo el mensaje de error
+    ("text", "35"),
+    ("text", "180"),
+    ("text", "75.5"),
+    ("callback", "act_moderado"),
+    ("text", "Perder grasa"),
+    ("text", "Mediterránea"),
+    ("text", "Pescado y verduras"),
+    ("text", "Coliflor"),
+    ("text", "Ninguna"),
+    ("text", "Nada"),
+    ("text", "30"),
+    ("text", "Horno y air fryer"),
+    ("text", "4"),
+    ("text", "España"),
+]
+
+
+def make_update(update_id: int, kind: str, value: str) -> dict:
+    chat = {"id": CHAT_ID}
+    if kind == "callback":
+        return {
+            "update_id": update_id,
+            "callback_query": {"id": f"cb{update_id}", "data": value, "message": {"chat": chat}},
+        }
+    return {"update_id": update_id, "message": {"chat": chat, "text": value}}
+
+
+async def main(max_queries: int | None, max_sends: int | None) -> int:
+    sent = []
+
+    def fake_telegram(request: httpx.Request) -> httpx.Response:
+        sent.append(request.url.path.rsplit("/", 1)[-1])
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": 1}})
+
+    telegram_utils._client = httpx.AsyncClient(transport=httpx.MockTransport(fake_telegram))
+
+    worst_q = worst_s = 0
+    for i, (kind, value) in enumerate(STEPS, start=1):
+        sent.clear()
+        with count_queries() as queries:
+            await process_update(make_update(i, kind, value))
+        sends = sent.count("sendMessage")
+        worst_q, worst_s = max(worst_q, queries[0]), max(worst_s, sends)
+        print(json.dumps({"update": i, "input": value, "queries": queries[0], "sendMessage": sends}, ensure_ascii=False))
+
+    await telegram_utils.close_client()
+    print(json.dumps({"max_queries": worst_q, "max_sendMessage": worst_s}))
+    if max_queries is not None and worst_q > max_queries:
+        return 1
+    if max_sends is not None and worst_s > max_sends:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-queries", type=int, default=None)
+    parser.add_argument("--max-sends", type=int, default=None)
+    args = parser.parse_args()
+    code = asyncio.run(main(args.max_queries, args.max_sends))
+    os.unlink(_tmp.name)
+    sys.exit(code)
@@ -0,0 +1,189 @@
+# bench/plan_parser.py
+#
+# Fuzz + benchmark del parser de planes sobre un corpus sintético de salidas
+# del LLM rotas (truncadas, con prosa, vallas ```json, comas colgantes,
+# llaves dentro de strings, tipos equivocados, basura patológica):
+#   legacy → re.search(r"\{.*\}", ..., re.DOTALL) + json.loads, {} si falla
+#   parser → plan_parser.parse_plan (escaneo balanceado + esquema + reparación)
+#
+# En modo fuzz comprueba invariantes: parse_plan nunca lanza, y todo plan
+# devuelto cumple el esquema (días con comidas {comida: str, cantidad: str}).
+#
+#   python -m bench.plan_parser --docs 5000 --seed 1
+
+import argparse
+import json
+import random
+import re
+import statistics
+import time
+
+from plan_parser import PlanParseError, parse_plan, parse_week
+
+DAYS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+MEALS = ["desayuno", "media_mañana", "comida", "merienda", "cena"]
+FOODS = ["Avena con leche", "Pollo {a la plancha}", 'Ensalada "césar"', "Lentejas\\nestofadas",
+         "Salmón al horno", "Tortilla de patatas", "Yogur natural", "Arroz integral"]
+
+
+def valid_week(rng: random.Random, semana: int) -> dict:
+    return {
+        "semana": semana,
+        "dias": {
+            d: {m: {"comida": rng.choice(FOODS), "cantidad": f"{rng.randint(50, 300)} g"} for m in MEALS}
+            for d in DAYS
+        },
+    }
+
+
+def valid_doc(rng: random.Random) -> str:
+    if rng.random() < 0.3:
+        weeks = [valid_week(rng, k) for k in range(1, rng.randint(2, 4))]
+        return json.dumps({"duracion_semanas": len(weeks), "semanas": weeks}, ensure_ascii=False)
+    return json.dumps(valid_week(rng, rng.randint(1, 12)), ensure_ascii=False, indent=rng.choice([None, 2]))
+
+
+def truncate(rng, doc):
+    return doc[: rng.randint(1, len(doc) - 1)]
+
+
+def prose(rng, doc):
+    return f"¡Claro! Aquí tienes tu plan {{personalizado}}:\n{doc}\nEspero que te guste {{:)}}"
+
+
+def fence(rng, doc):
+    return f"```json\n{doc}\n```"
+
+
+def trailing_commas(rng, doc):
+    return re.sub(r"([}\]])", r",\1", doc, count=rng.randint(1, 20)).replace("{,", "{").replace("[,", "[")
+
+
+def wrong_types(rng, doc):
+    return doc.replace('"cantidad": "', '"cantidad": ', 1).replace(' g"', "", 1)
+
+
+def string_meals(rng, doc):
+    return re.sub(r'\{"comida": ("[^"]*"), "cantidad": "[^"]*"\}', r"\1", doc)
+
+
+def pathological(rng, doc):
+    return rng.choice(["{" * 5_000, "[" * 5_000 + doc, ("{\"a\": " * 2_000) + "1", "}" * 5_000 + doc])
+
+
+def garbage(rng, doc):
+    return "".join(rng.choice('{}[]",:ab \\') for _ in range(rng.randint(0, 2_000)))
+
+
+MUTATIONS = [truncate, prose, fence, trailing_commas, wrong_types, string_meals, pathological, garbage]
+
+
+def corpus(n: int, seed: int) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(n):
+        doc = valid_doc(rng)
+        chain = rng.sample(MUTATIONS, rng.choice([0, 1, 1, 2]))
+        for mutate in chain:
+            doc = mutate(rng, doc)
+        docs.append(("+".join(m.__name__ for m in chain) or "valid", doc))
+    return docs
+
+
+def legacy(raw_text: str):
+    try:
+        match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+        return json.loads(match.group(0)) if match else {}
+    except Exception:
+        return {}
+
+
+def count_days(obj) -> int:
+    if not isinstance(obj, dict):
+        return 0
+    weeks = obj.get("semanas") if isinstance(obj.get("semanas"), list) else [obj]
+    return sum(len(w.get("dias") or {}) for w in weeks if isinstance(w, dict) and isinstance(w.get("dias"), dict))
+
+
+def check_invariants(kind: str, doc: str) -> list[str]:
+    errors = []
+    try:
+        result = parse_plan(doc)
+    except Exception as e:
+        return [f"{kind}: parse_plan lanzó {type(e).__name__}: {e}"]
+    try:
+        parse_week(doc, 1)
+    except PlanParseError:
+        pass
+    except Exception as e:
+        errors.append(f"{kind}: parse_week lanzó {type(e).__name__}: {e}")
+    if result.plan is None:
+        return errors
+    for w in result.plan.semanas:
+        if not w.dias:
+            errors.append(f"{kind}: semana {w.semana} sin días")
+        for d in w.dias:
+            if not d.comidas:
+                errors.append(f"{kind}: día {d.nombre} sin comidas")
+            for m in d.comidas.values():
+                if not isinstance(m.comida, str) or not m.comida or not isinstance(m.cantidad, str):
+                    errors.append(f"{kind}: comida inválida en {d.nombre}: {m}")
+        json.dumps(result.plan.to_dict())
+    if kind == "valid" and result.repaired:
+        errors.append("valid: se marcó como reparado")
+    return errors
+
+
+def bench(label: str, fn, docs: list[tuple[str, str]], days_of) -> tuple[dict, list[int]]:
+    lat, days = [], []
+    for _, doc in docs:
+        t0 = time.perf_counter()
+        out = fn(doc)
+        lat.append((time.perf_counter() - t0) * 1e6)
+        days.append(days_of(out))
+    lat.sort()
+    return {
+        "parser": label,
+        "docs": len(docs),
+        "usable": sum(n > 0 for n in days),
+        "days_salvaged": sum(days),
+        "p50_us": round(statistics.median(lat), 1),
+        "p99_us": round(lat[int(len(lat) * 0.99) - 1], 1),
+        "max_us": round(lat[-1], 1),
+        "total_s": round(sum(lat) / 1e6, 3),
+    }, days
+
+
+def plan_days(result) -> int:
+    return sum(len(w.dias) for w in result.plan.semanas) if result.plan else 0
+
+
+def main(docs: int, seed: int):
+    data = corpus(docs, seed)
+    errors = [e for kind, doc in data for e in check_invariants(kind, doc)]
+    print(json.dumps({"fuzz_docs": len(data), "invariant_errors": len(errors)}))
+    for e in errors[:20]:
+        print("  ", e)
+
+    old_stats, old_days = bench("legacy", legacy, data, count_days)
+    new_stats, new_days = bench("parser", parse_plan, data, plan_days)
+    print(json.dumps(old_stats))
+    print(json.dumps(new_stats))
+
+    by_kind: dict[str, list[int]] = {}
+    for (kind, _), old, new in zip(data, old_days, new_days):
+        stats = by_kind.setdefault(kind.split("+")[0], [0, 0, 0])
+        stats[0] += 1
+        stats[1] += old > 0
+        stats[2] += new > 0
+    for kind, (n, old, new) in sorted(by_kind.items()):
+        print(json.dumps({"mutation": kind, "docs": n, "legacy_usable": old, "parser_usable": new}))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    raise SystemExit(main(args.docs, args.seed))
@@ -0,0 +1,69 @@
+# bench/recipe_exclusion.py
+#
+# Comprobación de regresión de las restricciones del plan de respaldo
+# (catálogo de recetas, sin LLM). Las respuestas del onboarding son texto
+# libre: cada frase debe excluir al menos las mismas recetas que su término
+# suelto, y ninguna semana montada para ese perfil puede contener una
+# receta excluida ni un alérgeno declarado.
+#
+#   python -m bench.recipe_exclusion
+
+import json
+import sys
+
+from nutrition import plan_semana_catalogo, profile_from_perfil
+from recipes import ALLERGEN_ALIASES, get_catalog
+
+# (respuesta en texto libre, término suelto equivalente)
+PHRASINGS = [
+    ("Intolerancia a la lactosa", "lactosa"),
+    ("Soy celíaca", "gluten"),
+    ("Soy celiaco", "gluten"),
+    ("no me gusta el pescado", "pescado"),
+    ("Alergia a los frutos secos", "frutos secos"),
+    ("alérgico al marisco", "marisco"),
+    ("No tomo leche", "leche"),
+    ("no me gustan los champiñones", "champiñones"),
+    ("Sin huevo, por favor", "huevo"),
+]
+
+PERFIL = {
+    "sexo": "Femenino", "edad": 34, "altura_cm": 165, "peso_kg": 62, "actividad": "moderada",
+    "objetivo_detallado": "perder grasa",
+    "alergias": "Intolerancia a la lactosa y soy celíaca",
+    "vetos": "no me gusta el pescado",
+    "no_gustos": "ninguno",
+}
+
+
+def main() -> int:
+    catalog = get_catalog()
+    failures = []
+    for phrase, bare in PHRASINGS:
+        got, want = catalog.excluded([phrase]), catalog.excluded([bare])
+        ok = bool(want) and want <= got
+        print(json.dumps({"phrase": phrase, "excluded": len(got), "bare": bare, "bare_excluded": len(want),
+                          "ok": ok}, ensure_ascii=False))
+        if not ok:
+            failures.append(phrase)
+
+    profile = profile_from_perfil(PERFIL)
+    banned = catalog.excluded(profile.restricciones())
+    allergens = {ALLERGEN_ALIASES[a] for a in ("lactosa", "gluten", "pescado")}
+    by_id = {r.id: (i, r) for i, r in enumerate(catalog.recipes)}
+    served = []
+    for semana in range(1, 5):
+        for meals in plan_semana_catalogo(profile, semana)["dias"].values():
+            for meal in meals.values():
+                idx, recipe = by_id[meal["receta_id"]]
+                if idx in banned or recipe.alergenos & allergens:
+                    served.append(recipe.nombre)
+    print(json.dumps({"profile_restrictions": profile.restricciones(), "excluded": len(banned),
+                      "unsafe_meals_served": sorted(set(served))}, ensure_ascii=False))
+    if served:
+        failures.append("plan_semana_catalogo")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# bench/router.py
+#
+# Coste de enrutar un update: decodificar el JSON de Telegram en un Update y
+# resolver la ruta con las tablas de main.routes, frente a la cadena de
+# comprobaciones de prefijo que había antes en _dispatch (reproducida aquí,
+# solo la parte de CPU; antes además se abría una Session y se cargaba el
+# User para todos los updates). Mezcla sintética de comandos, callbacks del
+# menú, navegación del plan/compra, onboarding y texto libre.
+#
+#   python -m bench.router --updates 20000 --repeat 50
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+_tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp.name}")
+
+import router
+from main import routes
+
+MIX = [
+    (30, "text", "¿Puedo cambiar la cena de hoy por algo más ligero?"),
+    (8, "text", "/start"),
+    (6, "text", "/menu"),
+    (6, "callback", "menu_plan"),
+    (4, "callback", "menu_shopping"),
+    (3, "callback", "menu_generate"),
+    (3, "callback", "menu_profile"),
+    (3, "callback", "menu_chat"),
+    (3, "callback", "menu_help"),
+    (12, "callback", "plan_1_3_0"),
+    (6, "callback", "shop_w_2_0"),
+    (5, "callback", "sexo_F"),
+    (5, "callback", "act_moderado"),
+    (2, "callback", "reset_yes"),
+    (4, "callback", "algo_desconocido"),
+]
+
+
+def synthetic_updates(n: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    weights = [w for w, _, _ in MIX]
+    out = []
+    for i in range(n):
+        _, kind, text = rng.choices(MIX, weights=weights)[0]
+        chat = {"id": 1000 + rng.randrange(500)}
+        if kind == "text":
+            out.append({"update_id": i, "message": {"message_id": i, "chat": chat, "text": text}})
+        else:
+            out.append({"update_id": i, "callback_query": {
+                "id": f"cb{i}", "data": text, "message": {"message_id": 7, "chat": chat}}})
+    return out
+
+
+def legacy_route(data: dict) -> str:
+    # La decodificación y la cadena de if de _dispatch antes de las tablas
+    message = data.get("message", {})
+    callback = data.get("callback_query", {})
+    if message:
+        text = message.get("text", "").strip()
+        is_callback = False
+    elif callback:
+        text = callback.get("data", "")
+        is_callback = True
+    else:
+        return "none"
+    if text and text.startswith("/start"):
+        return "start"
+    if is_callback and text in ("reset_yes", "reset_no"):
+        return "reset"
+    if text and text.startswith("/menu"):
+        return "menu"
+    if is_callback and text.startswith(("sexo_", "act_")):
+        return "onboarding"
+    if is_callback and text.startswith("menu_"):
+        for name in ("menu_generate", "menu_shopping", "menu_plan", "menu_profile", "menu_chat", "menu_help"):
+            if text == name:
+                return name
+    if is_callback and text.startswith("shop_"):
+        return "shop_nav"
+    if is_callback and text.startswith("plan_"):
+        return "plan_nav"
+    return "callback_other" if is_callback else "text"
+
+
+def table_route(data: dict) -> str:
+    update = router.decode(data)
+    return routes.resolve(update).name if update is not None else "none"
+
+
+def table_resolve_only(update: router.Update) -> str:
+    return routes.resolve(update).name
+
+
+def measure(variants: dict, repeat: int) -> dict[str, tuple[float, list[float]]]:
+    # ns/update del mejor pase y ns por update individual (para percentiles).
+    # Los pases se alternan entre variantes para que el ruido de la máquina
+    # no favorezca a ninguna
+    best = {label: float("inf") for label in variants}
+    for _ in range(repeat):
+        for label, (fn, inputs) in variants.items():
+            t0 = time.perf_counter_ns()
+            for u in inputs:
+                fn(u)
+            best[label] = min(best[label], (time.perf_counter_ns() - t0) / len(inputs))
+    out = {}
+    for label, (fn, inputs) in variants.items():
+        per = []
+        for u in inputs[:20000]:
+            t0 = time.perf_counter_ns()
+            fn(u)
+            per.append(time.perf_counter_ns() - t0)
+        out[label] = best[label], sorted(per)
+    return out
+
+
+def main(n: int, repeat: int, seed: int):
+    updates = synthetic_updates(n, seed)
+    names = Counter(table_route(u) for u in updates)
+    needs = Counter(routes.resolve(router.decode(u)).needs for u in updates)
+    print(json.dumps({"updates": n, "repeat": repeat, "routes": dict(names.most_common())}, ensure_ascii=False))
+    decoded = [router.decode(u) for u in updates]
+    results = measure({
+        "legacy_chain": (legacy_route, updates),
+        "tables_decode_and_resolve": (table_route, updates),
+        "tables_decode_only": (router.decode, updates),
+        "tables_resolve_only": (table_resolve_only, decoded),
+    }, repeat)
+    for label, (avg, per) in results.items():
+        print(json.dumps({
+            "router": label,
+            "ns_per_update": round(avg, 1),
+            "p50_ns": per[len(per) // 2],
+            "p99_ns": per[int(len(per) * 0.99) - 1],
+            "mean_ns": round(statistics.mean(per), 1),
+        }))
+    # Resultado principal: JSON del update → ruta, de punta a punta en ambos
+    legacy, tables = results["legacy_chain"][0], results["tables_decode_and_resolve"][0]
+    print(json.dumps({
+        "end_to_end_legacy_ns": round(legacy, 1),
+        "end_to_end_tables_ns": round(tables, 1),
+        "end_to_end_saved_ns": round(legacy - tables, 1),
+        "db_free_updates": round(needs[router.NOTHING] / n, 3),
+        "session_per_update_before": 1.0,
+        "session_per_update_after": round(1 - needs[router.NOTHING] / n, 3),
+    }))
+    if os.environ["DATABASE_URL"].endswith(_tmp.name):
+        os.unlink(_tmp.name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.updates, args.repeat, args.seed)
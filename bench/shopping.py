@@ -0,0 +1,91 @@
+# bench/shopping.py
+#
+# Lista de la compra sobre un plan sintético de 52 semanas:
+#   cold   → primera agregación (tablas de parseo vacías)
+#   warm   → agregación con parse_meal ya memoizado (otro plan, mismos platos)
+#   cached → shopping_list repetida para la misma versión del plan
+#   week   → una sola semana, sin caché de resultado
+#
+#   python -m bench.shopping --weeks 52 --repeat 50
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import ingredients
+import shopping
+
+DAYS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+MEALS = {
+    "desayuno": [("Avena con leche y plátano", "60 g de avena, 200 ml de leche, 1 plátano"),
+                 ("Tostadas con AOVE y tomate", "2 rebanadas + 1 cucharada de AOVE + 1 tomate"),
+                 ("Yogur natural con nueces", "1 unidad y un puñado")],
+    "comida": [("Pollo a la plancha con arroz", "150 g y 80 g"),
+               ("Lentejas estofadas", "250 g"),
+               ("Merluza al horno con patata", "180 g de merluza, 200 g de patata")],
+    "merienda": [("Fruta de temporada", "1 pieza"), ("Queso fresco", "100 g")],
+    "cena": [("Tortilla francesa con ensalada", "2 huevos, al gusto"),
+             ("Salmón con brócoli", "150 g y 200 g"),
+             ("Crema de calabaza", "1 taza")],
+}
+
+
+def synthetic_plan(weeks: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    return {
+        "duracion_semanas": weeks,
+        "version": 1,
+        "semanas": [
+            {
+                "semana": k,
+                "dias": {
+                    d: {m: dict(zip(("comida", "cantidad"), rng.choice(opts))) for m, opts in MEALS.items()}
+                    for d in DAYS
+                },
+            }
+            for k in range(1, weeks + 1)
+        ],
+    }
+
+
+def timed(label: str, fn, repeat: int) -> dict:
+    lat = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        lat.append((time.perf_counter() - t0) * 1e3)
+    return {"case": label, "runs": repeat, "p50_ms": round(statistics.median(lat), 3), "max_ms": round(max(lat), 3)}
+
+
+def main(weeks: int, repeat: int):
+    plan = synthetic_plan(weeks, 1)
+    log = SimpleNamespace(id=1, menu_json=plan, timestamp=datetime(2024, 1, 1))
+
+    def cold():
+        ingredients.parse_meal.cache_clear()
+        ingredients.normalize_name.cache_clear()
+        shopping.category.cache_clear()
+        shopping.aggregate(plan)
+
+    results = [
+        timed("cold", cold, repeat),
+        timed("warm", lambda: shopping.aggregate(plan), repeat),
+        timed("cached", lambda: shopping.shopping_list(log), repeat),
+        timed("week", lambda: shopping.aggregate(plan, [weeks // 2]), repeat),
+    ]
+    meals = weeks * len(DAYS) * len(MEALS)
+    print(json.dumps({"weeks": weeks, "meals": meals, "items": len(shopping.aggregate(plan))}))
+    for r in results:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weeks", type=int, default=52)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    main(args.weeks, args.repeat)
@@ -0,0 +1,107 @@
+# bench/telegram_client.py
+#
+# Compara el cliente HTTP por llamada (comportamiento antiguo de tg()) con el
+# cliente compartido de telegram_utils contra un "Telegram" local.
+#
+#   python -m bench.telegram_client --calls 500 --concurrency 20
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+
+# ---------- Telegram local ----------
+def make_fake_telegram() -> FastAPI:
+    fake = FastAPI()
+
+    @fake.post("/bot{token}/{method}")
+    async def api(token: str, method: str):
+        return {"ok": True, "result": {"message_id": 1, "method": method}}
+
+    return fake
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+# ---------- escenarios ----------
+async def per_call_client(url: str, payload: dict):
+    # Lo que hacía tg() antes: un AsyncClient nuevo por llamada
+    async with httpx.AsyncClient(timeout=10) as client:
+        r = await client.post(url, json=payload)
+        r.raise_for_status()
+        return r.json()
+
+
+async def run(label: str, call, calls: int, concurrency: int) -> dict:
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            t0 = time.perf_counter()
+            await call({"chat_id": i, "text": "hola"})
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "scenario": label,
+        "calls": calls,
+        "concurrency": concurrency,
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "throughput_rps": round(calls / elapsed, 1),
+    }
+
+
+async def main(calls: int, concurrency: int, http2: bool):
+    port = _free_port()
+    server = start_server(make_fake_telegram(), port)
+
+    # telegram_utils lee la URL base al importarse
+    os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+    import telegram_utils
+
+    url = f"{telegram_utils.TG_API}/sendMessage"
+    results = [await run("per_call_client", lambda p: per_call_client(url, p), calls, concurrency)]
+
+    telegram_utils._client = telegram_utils.build_client(http2=http2)
+    results.append(await run("shared_client", lambda p: telegram_utils.tg("sendMessage", p), calls, concurrency))
+    await telegram_utils.close_client()
+
+    server.should_exit = True
+    for r in results:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--http2", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.concurrency, args.http2))
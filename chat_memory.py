@@ -0,0 +1,284 @@
+# chat_memory.py
+#
+# Memoria del chat libre por usuario: los últimos turnos en un buffer
+# circular (tabla chat_turns, CHAT_MEMORY_MAX_TURNS posiciones por chat) y un
+# resumen de lo anterior (chat_memory). Cuando los turnos sin resumir pasan
+# del presupuesto de tokens, los más antiguos se resumen con el LLM en
+# segundo plano. Del plan solo entran los días a los que se refiere el
+# mensaje ("la comida de hoy", "el jueves", "la semana que viene"), así que
+# el prompt no crece con la conversación ni con la duración del plan.
+
+import os, re, math, asyncio, unicodedata
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import select, update
+
+import logs
+import metrics
+from db import AsyncSessionLocal, ChatMemory, ChatTurn
+from llm import chat_completion
+from plan_view import days_by_index
+
+CHAT_MEMORY_MAX_TURNS = int(os.getenv("CHAT_MEMORY_MAX_TURNS", "24"))
+# Tokens de turnos sin resumir que se envían; por encima se compacta
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200"))
+# Turnos recientes que nunca se resumen (el hilo inmediato va literal)
+CHAT_KEEP_RECENT_TURNS = int(os.getenv("CHAT_KEEP_RECENT_TURNS", "6"))
+CHAT_PLAN_CONTEXT_TOKENS = int(os.getenv("CHAT_PLAN_CONTEXT_TOKENS", "600"))
+# Aproximación sin tokenizador: ~4 caracteres por token en español
+CHARS_PER_TOKEN = 4
+
+COACH_PROMPT = (
+    "Eres un coach nutricional cercano, simpático y natural. "
+    "Responde de forma conversacional, breve si procede, como si chatearas en Telegram. "
+    "Ten siempre en cuenta el perfil, las restricciones y la dieta del usuario."
+)
+SUMMARY_PROMPT = (
+    "Resume la conversación entre un usuario y su coach nutricional en español, "
+    "en 5-8 frases. Conserva datos personales, preferencias, dudas abiertas, "
+    "acuerdos y cambios pedidos al plan. Sin saludos ni relleno."
+)
+
+# Comida del plan → cómo se suele nombrar en un mensaje (sustantivo o verbo)
+MEAL_SLOTS = {
+    "desayuno": r"desayun\w*",
+    "almuerzo": r"almuerz\w*|almorz\w*",
+    # Ni "como" (también "¿cómo…?") ni "comer" sueltos: "¿puedo comer…?" es una pregunta general
+    "comida": r"comidas?|(?:al |a )?mediodia|(?:para|a) comer",
+    "merienda": r"merien\w*|merendar",
+    "cena": r"cen[aoe]\w*",
+}
+WEEKDAY_NAMES = ("lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo")
+DAY_TITLES = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo")
+
+_OFFSETS = (
+    (re.compile(r"\bpasado manana\b"), 2),
+    (re.compile(r"(?<!la )(?<!pasado )\bmanana\b"), 1),
+    (re.compile(r"\bayer\b"), -1),
+    (re.compile(r"\b(?:hoy|esta noche)\b"), 0),
+)
+_NEXT_WEEK_RE = re.compile(r"\b(?:semana que viene|proxima semana|siguiente semana)\b")
+_WEEK_N_RE = re.compile(r"\bsemana (\d{1,2})\b")
+_THIS_WEEK_RE = re.compile(r"\b(?:esta semana|la semana|toda la semana|semana)\b")
+
+
+def _ascii(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode()
+    return " ".join(text.lower().split())
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text or "") / CHARS_PER_TOKEN))
+
+
+# ---------- estado ----------
+async def get_memory(s, chat_id: int | str, create: bool = False) -> Optional[ChatMemory]:
+    mem = (await s.execute(select(ChatMemory).where(ChatMemory.chat_id == str(chat_id)))).scalars().first()
+    if mem is None and create:
+        mem = ChatMemory(chat_id=str(chat_id), active=False, seq=0, summary_upto=-1)
+        s.add(mem)
+    return mem
+
+
+async def set_active(s, chat_id: int | str, active: bool):
+    mem = await get_memory(s, chat_id, create=active)
+    if mem is not None:
+        mem.active = active
+        mem.updated_at = datetime.utcnow()
+        await s.commit()
+
+
+async def active_memory(s, chat_id: int | str) -> Optional[ChatMemory]:
+    mem = await get_memory(s, chat_id)
+    return mem if mem is not None and mem.active else None
+
+
+async def history(s, mem: ChatMemory) -> list[ChatTurn]:
+    # Turnos aún sin resumir, del más antiguo al más reciente
+    return list((await s.execute(
+        select(ChatTurn)
+        .where(ChatTurn.chat_id == mem.chat_id, ChatTurn.seq > mem.summary_upto)
+        .order_by(ChatTurn.seq)
+    )).scalars().all())
+
+
+async def append(s, mem: ChatMemory, role: str, content: str) -> ChatTurn:
+    # Ocupa la posición del turno más antiguo cuando el buffer está lleno
+    slot = mem.seq % CHAT_MEMORY_MAX_TURNS
+    turn = (await s.execute(
+        select(ChatTurn).where(ChatTurn.chat_id == mem.chat_id, ChatTurn.slot == slot)
+    )).scalars().first()
+    if turn is None:
+        turn = ChatTurn(chat_id=mem.chat_id, slot=slot)
+        s.add(turn)
+    turn.seq = mem.seq
+    turn.role = role
+    turn.content = content
+    turn.tokens = estimate_tokens(content)
+    turn.created_at = datetime.utcnow()
+    mem.seq += 1
+    mem.updated_at = turn.created_at
+    return turn
+
+
+def needs_compaction(turns: list[ChatTurn]) -> bool:
+    if len(turns) <= CHAT_KEEP_RECENT_TURNS:
+        return False
+    # También antes de que el buffer circular pise turnos sin resumir
+    return (sum(t.tokens for t in turns) > CHAT_HISTORY_TOKEN_BUDGET
+            or len(turns) >= CHAT_MEMORY_MAX_TURNS - 2)
+
+
+# ---------- días del plan relevantes ----------
+def referenced_days(text: str, semana_actual: int, today: date) -> tuple[list[tuple[int, int]], list[int], tuple[str, ...]]:
+    # (días sueltos (semana, 0-6), semanas completas, comidas mencionadas)
+    t = _ascii(text)
+    slots = tuple(m for m, pattern in MEAL_SLOTS.items() if re.search(rf"\b(?:{pattern})\b", t))
+    days, weeks = [], []
+    for pattern, offset in _OFFSETS:
+        if pattern.search(t):
+            idx = today.weekday() + offset
+            days.append((semana_actual + idx // 7, idx % 7))
+    for i, name in enumerate(WEEKDAY_NAMES):
+        if re.search(rf"\b{name}\b", t):
+            days.append((semana_actual, i))
+    if _NEXT_WEEK_RE.search(t):
+        weeks.append(semana_actual + 1)
+    weeks.extend(int(n) for n in _WEEK_N_RE.findall(t))
+    if not days and not weeks and _THIS_WEEK_RE.search(t):
+        weeks.append(semana_actual)
+    if not days and not weeks:
+        days.append((semana_actual, today.weekday()))  # por defecto, hoy
+    return list(dict.fromkeys(days)), list(dict.fromkeys(weeks)), slots
+
+
+def mentions_plan(text: str) -> bool:
+    # El mensaje nombra un día, una semana o una comida del plan
+    t = _ascii(text)
+    return bool(
+        any(re.search(rf"\b(?:{p})\b", t) for p in MEAL_SLOTS.values())
+        or any(p.search(t) for p, _ in _OFFSETS)
+        or any(re.search(rf"\b{name}\b", t) for name in WEEKDAY_NAMES)
+        or _NEXT_WEEK_RE.search(t) or _THIS_WEEK_RE.search(t)
+    )
+
+
+def _meal_text(meal) -> str:
+    if not isinstance(meal, dict):
+        return str(meal)
+    return f"{meal.get('comida') or '—'} ({meal['cantidad']})" if meal.get("cantidad") else str(meal.get("comida") or "—")
+
+
+def plan_context(weeks: dict[int, dict], text: str, semana_actual: int, today: Optional[date] = None) -> str:
+    # weeks: {semana: {"semana", "dias"}} (plan_view indexa el plan así)
+    days, whole_weeks, slots = referenced_days(text, semana_actual, today or date.today())
+    lines = []
+    for semana, dia in days:
+        week = weeks.get(semana)
+        meals = days_by_index(week).get(dia) if week else None
+        if not meals:
+            lines.append(f"Semana {semana}, {DAY_TITLES[dia]}: sin plan todavía.")
+            continue
+        chosen = {k: v for k, v in meals.items() if not slots or _ascii(k) in slots} or meals
+        parts = "; ".join(f"{k}: {_meal_text(v)}" for k, v in chosen.items())
+        lines.append(f"Semana {semana}, {DAY_TITLES[dia]}: {parts}")
+    for semana in whole_weeks:
+        week = weeks.get(semana)
+        if not week:
+            lines.append(f"Semana {semana}: sin plan todavía.")
+            continue
+        for dia, meals in sorted(days_by_index(week).items()):
+            chosen = {k: v for k, v in meals.items() if not slots or _ascii(k) in slots} or meals
+            names = ", ".join(f"{k}: {v.get('comida') if isinstance(v, dict) else v}" for k, v in chosen.items())
+            lines.append(f"Semana {semana}, {DAY_TITLES[dia]}: {names}")
+
+    # Tope de tokens: se corta por líneas completas
+    out, used = [], 0
+    for line in lines:
+        used += estimate_tokens(line)
+        if used > CHAT_PLAN_CONTEXT_TOKENS:
+            break
+        out.append(line)
+    return "\n".join(out)
+
+
+# ---------- prompt ----------
+def build_messages(perfil: str, dieta: str, mem: Optional[ChatMemory], turns: list[ChatTurn], text: str) -> list[dict]:
+    # mem=None y sin turnos: pregunta suelta, sin nada de la conversación
+    system = [COACH_PROMPT, "", "Perfil del usuario:", perfil.strip()]
+    if dieta:
+        system += ["", "Días del plan relevantes para este mensaje:", dieta]
+    if mem is not None and mem.summary:
+        system += ["", "Resumen de la conversación anterior:", mem.summary]
+
+    # Turnos más recientes que quepan en el presupuesto (aunque la
+    # compactación vaya con retraso, el prompt queda acotado)
+    recent, used = [], 0
+    for turn in reversed(turns):
+        used += turn.tokens
+        if used > CHAT_HISTORY_TOKEN_BUDGET and recent:
+            break
+        recent.append({"role": turn.role, "content": turn.content})
+    recent.reverse()
+    return [{"role": "system", "content": "\n".join(system)}, *recent, {"role": "user", "content": text}]
+
+
+# ---------- compactación ----------
+async def compact(chat_id: int | str) -> bool:
+    # Resume los turnos sin resumir salvo los CHAT_KEEP_RECENT_TURNS últimos
+    async with AsyncSessionLocal() as s:
+        mem = await get_memory(s, chat_id)
+        if mem is None:
+            return False
+        turns = await history(s, mem)
+        old = turns[:-CHAT_KEEP_RECENT_TURNS] if CHAT_KEEP_RECENT_TURNS else turns
+        if not old:
+            return False
+        transcript = "\n".join(f"{'Usuario' if t.role == 'user' else 'Coach'}: {t.content}" for t in old)
+        previous = f"Resumen previo:\n{mem.summary}\n\n" if mem.summary else ""
+        summary = await chat_completion([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"{previous}Conversación:\n{transcript}"},
+        ], temperature=0)
+        # UPDATE dirigido: no pisa el seq que haya avanzado otro update
+        await s.execute(
+            update(ChatMemory)
+            .where(ChatMemory.id == mem.id)
+            .values(summary=summary.strip(), summary_upto=old[-1].seq)
+            .execution_options(synchronize_session=False)
+        )
+        await s.commit()
+    return True
+
+
+_background: set[asyncio.Task] = set()
+_compacting: set[str] = set()
+CHAT_COMPACTIONS_PENDING = metrics.gauge("chat_compactions_pending", "Compactaciones de memoria de chat en curso")
+CHAT_COMPACTIONS_PENDING.set_function(lambda: len(_compacting))
+
+
+async def _compact_logged(chat_id: str):
+    try:
+        await compact(chat_id)
+    except Exception as e:
+        logs.warn("chat_compaction_failed", e, chat_id=chat_id)
+    finally:
+        _compacting.discard(chat_id)
+
+
+def schedule_compaction(chat_id: int | str):
+    # En segundo plano: la respuesta al usuario no espera al resumen
+    chat_id = str(chat_id)
+    if chat_id in _compacting:
+        return
+    _compacting.add(chat_id)
+    task = asyncio.create_task(_compact_logged(chat_id))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def shutdown():
+    for task in list(_background):
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
@@ -0,0 +1,66 @@
+# dedup.py
+#
+# Idempotencia por update_id: Telegram reenvía un update si no recibe el 200
+# a tiempo. Se recuerda cada update_id durante DEDUP_TTL_SECONDS, primero en
+# memoria (LRU acotado) y, si no está ahí, en la tabla processed_updates.
+
+import os, time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete
+
+from db import AsyncSessionLocal, ProcessedUpdate
+
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", str(24 * 3600)))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "50000"))
+DEDUP_PRUNE_INTERVAL = float(os.getenv("DEDUP_PRUNE_INTERVAL", "600"))
+
+
+class RecentUpdates:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen: OrderedDict[int, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def contains(self, update_id: int, now: Optional[float] = None) -> bool:
+        ts = self._seen.get(update_id)
+        if ts is None:
+            return False
+        if (now or time.monotonic()) - ts > self.ttl:
+            del self._seen[update_id]
+            return False
+        return True
+
+    def add(self, update_id: int, now: Optional[float] = None):
+        now = now or time.monotonic()
+        self._seen[update_id] = now
+        self._seen.move_to_end(update_id)
+        # Las más antiguas van primero: basta con recortar por la cabeza
+        while self._seen:
+            oldest_id, oldest_ts = next(iter(self._seen.items()))
+            if len(self._seen) <= self.max_entries and now - oldest_ts <= self.ttl:
+                break
+            del self._seen[oldest_id]
+
+
+recent = RecentUpdates(DEDUP_TTL_SECONDS, DEDUP_MAX_ENTRIES)
+_last_prune = 0.0
+
+
+async def prune_db(force: bool = False) -> int:
+    # Borra update_id fuera de la ventana; se llama desde los workers en reposo
+    global _last_prune
+    now = time.monotonic()
+    if not force and now - _last_prune < DEDUP_PRUNE_INTERVAL:
+        return 0
+    _last_prune = now
+    cutoff = datetime.utcnow() - timedelta(seconds=DEDUP_TTL_SECONDS)
+    async with AsyncSessionLocal() as s:
+        result = await s.execute(delete(ProcessedUpdate).where(ProcessedUpdate.received_at < cutoff))
+        await s.commit()
+    return result.rowcount
@@ -0,0 +1,208 @@
+# foods.py
+#
+# Tabla local de composición de alimentos (data/alimentos.csv: kcal y macros
+# por 100 g) en un índice compacto en memoria: arrays por columna, un dict de
+# nombres normalizados (nombre + alias), un índice por primera palabra para
+# nombres contenidos en el texto ("pechuga de pollo a la plancha" → pollo) y
+# un índice de trigramas para nombres mal escritos o con variaciones.
+
+import csv, os
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from ingredients import normalize_name, parse_meal
+
+FOODS_CSV = os.getenv("FOODS_CSV", os.path.join(os.path.dirname(__file__), "data", "alimentos.csv"))
+# Similitud mínima (Dice sobre trigramas) para aceptar una coincidencia difusa
+FOOD_MATCH_THRESHOLD = float(os.getenv("FOOD_MATCH_THRESHOLD", "0.5"))
+
+# Por encima de esto, un cereal/legumbre con variante "cocido" en la tabla se
+# interpreta como peso ya cocinado (80 g de arroz → seco; 250 g → cocido)
+COOKED_MIN_GRAMS = float(os.getenv("FOODS_COOKED_MIN_GRAMS", "150"))
+
+# Gramos por unidad contada cuando el alimento no tiene g_unidad propio
+UNIT_GRAMS = {
+    "ud": 100, "rebanada": 30, "loncha": 20, "puñado": 30, "lata": 80,
+    "filete": 120, "diente": 5, "ración": 150, "pizca": 0.5,
+}
+
+
+@dataclass(frozen=True)
+class FoodMatch:
+    food_id: int
+    nombre: str
+    score: float  # 1.0 exacta; < 1.0 difusa
+
+
+@dataclass
+class Nutrients:
+    kcal: float = 0.0
+    prote_g: float = 0.0
+    grasa_g: float = 0.0
+    carbo_g: float = 0.0
+
+    def add(self, other: "Nutrients"):
+        self.kcal += other.kcal
+        self.prote_g += other.prote_g
+        self.grasa_g += other.grasa_g
+        self.carbo_g += other.carbo_g
+
+
+def _trigrams(key: str) -> set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodIndex:
+    def __init__(self, rows: list[dict]):
+        self.names: list[str] = []
+        self.kcal = array("f")
+        self.prote = array("f")
+        self.grasa = array("f")
+        self.carbo = array("f")
+        self.g_unidad = array("f")  # 0 = sin peso por unidad propio
+
+        self.exact: dict[str, int] = {}
+        self._keys: list[tuple[str, int]] = []            # (clave, food_id)
+        self._by_first_word: dict[str, list[int]] = {}   # palabra → índices en _keys
+        self._by_trigram: dict[str, list[int]] = {}      # trigrama → índices en _keys
+        self._key_sizes = array("H")
+        self.cooked: dict[int, int] = {}                  # food_id crudo → food_id cocido
+
+        for row in rows:
+            food_id = len(self.names)
+            self.names.append(row["nombre"])
+            self.kcal.append(float(row["kcal"]))
+            self.prote.append(float(row["prote_g"]))
+            self.grasa.append(float(row["grasa_g"]))
+            self.carbo.append(float(row["carbo_g"]))
+            self.g_unidad.append(float(row.get("g_unidad") or 0))
+            aliases = [a for a in (row.get("alias") or "").split("|") if a.strip()]
+            for name in [row["nombre"], *aliases]:
+                self._add_key(normalize_name(name)[0], food_id)
+
+        # normalize_name quita "cocido": las variantes cocidas se enlazan aparte
+        for food_id, name in enumerate(self.names):
+            base, sep, suffix = name.rpartition(" ")
+            if sep and suffix in ("cocido", "cocida"):
+                raw_id = self.exact.get(normalize_name(base)[0])
+                if raw_id is not None and raw_id != food_id:
+                    self.cooked[raw_id] = food_id
+
+    def __len__(self):
+        return len(self.names)
+
+    def _add_key(self, key: str, food_id: int):
+        if not key or key in self.exact:
+            return
+        self.exact[key] = food_id
+        idx = len(self._keys)
+        self._keys.append((key, food_id))
+        self._by_first_word.setdefault(key.split()[0], []).append(idx)
+        grams = _trigrams(key)
+        self._key_sizes.append(len(grams))
+        for g in grams:
+            self._by_trigram.setdefault(g, []).append(idx)
+
+    def lookup(self, name: str) -> Optional[FoodMatch]:
+        return self._lookup_key(normalize_name(name)[0])
+
+    @lru_cache(maxsize=8192)
+    def _lookup_key(self, key: str) -> Optional[FoodMatch]:
+        if not key:
+            return None
+        food_id = self.exact.get(key)
+        if food_id is not None:
+            return FoodMatch(food_id, self.names[food_id], 1.0)
+
+        # Nombre conocido contenido en el texto: el de más palabras
+        words = key.split()
+        word_set = set(words)
+        best = None
+        for w in word_set:
+            for idx in self._by_first_word.get(w, ()):
+                k, fid = self._keys[idx]
+                kw = k.split()
+                if all(x in word_set for x in kw) and (best is None or len(kw) > best[0]):
+                    best = (len(kw), fid)
+        if best is not None:
+            return FoodMatch(best[1], self.names[best[1]], round(0.7 + 0.3 * best[0] / len(words), 3))
+
+        # Trigramas: cuenta de trigramas compartidos por candidato → Dice
+        grams = _trigrams(key)
+        shared: dict[int, int] = {}
+        for g in grams:
+            for idx in self._by_trigram.get(g, ()):
+                shared[idx] = shared.get(idx, 0) + 1
+        if not shared:
+            return None
+        idx, common = max(shared.items(), key=lambda kv: 2 * kv[1] / (len(grams) + self._key_sizes[kv[0]]))
+        score = 2 * common / (len(grams) + self._key_sizes[idx])
+        if score < FOOD_MATCH_THRESHOLD:
+            return None
+        fid = self._keys[idx][1]
+        return FoodMatch(fid, self.names[fid], round(score, 3))
+
+    def grams(self, food_id: int, dim: str, qty: float) -> float:
+        if dim == "g":
+            return qty
+        if dim == "ml":
+            return qty  # densidad ≈ 1: suficiente para verificar un plan
+        per_unit = self.g_unidad[food_id] if dim == "ud" else 0
+        return qty * (per_unit or UNIT_GRAMS.get(dim, 100))
+
+    def nutrients(self, food_id: int, grams: float) -> Nutrients:
+        f = grams / 100
+        return Nutrients(
+            kcal=self.kcal[food_id] * f,
+            prote_g=self.prote[food_id] * f,
+            grasa_g=self.grasa[food_id] * f,
+            carbo_g=self.carbo[food_id] * f,
+        )
+
+
+def load_index(path: str = FOODS_CSV) -> FoodIndex:
+    with open(path, encoding="utf-8", newline="") as fh:
+        return FoodIndex(list(csv.DictReader(fh, delimiter=";")))
+
+
+_index: Optional[FoodIndex] = None
+
+
+def get_index() -> FoodIndex:
+    global _index
+    if _index is None:
+        _index = load_index()
+    return _index
+
+
+@dataclass
+class MealEstimate:
+    nutrients: Nutrients
+    matched: int
+    unmatched: list[str]
+
+
+def estimate_meal(comida: str, cantidad: str) -> MealEstimate:
+    # Ingredientes del plato (mismo parseo que la lista de la compra) → macros
+    index = get_index()
+    total = Nutrients()
+    matched = 0
+    unmatched = []
+    for key, display, dim, qty in parse_meal(comida, cantidad):
+        match = index._lookup_key(key)
+        if match is None:
+            unmatched.append(display)
+            continue
+        if dim is None:
+            # "al gusto": cantidad despreciable para el cómputo del día
+            continue
+        food_id = match.food_id
+        grams = index.grams(food_id, dim, qty)
+        if grams >= COOKED_MIN_GRAMS and food_id in index.cooked:
+            food_id = index.cooked[food_id]
+        total.add(index.nutrients(food_id, grams))
+        matched += 1
+    return MealEstimate(total, matched, unmatched)
@@ -0,0 +1,160 @@
+# ingredients.py
+#
+# Texto de las comidas del plan → ingredientes: separa componentes y
+# cantidades, normaliza nombres ("pechuga de pollo a la plancha" → pollo
+# (pechuga)) y unidades (g, kg, ml, cucharadas, unidades…) con tablas
+# precompiladas. Sin dependencias del bot: lo usan la lista de la compra, la
+# tabla de alimentos y el catálogo de recetas.
+
+import re, unicodedata
+from functools import lru_cache
+from typing import Optional
+
+# alias → (magnitud, factor a la unidad base de esa magnitud)
+# g y ml son las bases de masa y volumen; el resto de magnitudes se cuentan
+_UNITS = {
+    "g": ("g", 1), "gr": ("g", 1), "grs": ("g", 1), "gramo": ("g", 1), "gramos": ("g", 1),
+    "kg": ("g", 1000), "kilo": ("g", 1000), "kilos": ("g", 1000), "kilogramo": ("g", 1000), "kilogramos": ("g", 1000),
+    "ml": ("ml", 1), "mililitro": ("ml", 1), "mililitros": ("ml", 1), "cl": ("ml", 10), "dl": ("ml", 100),
+    "l": ("ml", 1000), "litro": ("ml", 1000), "litros": ("ml", 1000),
+    "cucharada": ("ml", 15), "cucharadas": ("ml", 15), "cda": ("ml", 15), "cdas": ("ml", 15),
+    "cucharadita": ("ml", 5), "cucharaditas": ("ml", 5), "cdta": ("ml", 5), "cdtas": ("ml", 5),
+    "cdita": ("ml", 5), "cditas": ("ml", 5),
+    "taza": ("ml", 240), "tazas": ("ml", 240), "vaso": ("ml", 200), "vasos": ("ml", 200),
+    "unidad": ("ud", 1), "unidades": ("ud", 1), "ud": ("ud", 1), "uds": ("ud", 1), "u": ("ud", 1),
+    "pieza": ("ud", 1), "piezas": ("ud", 1),
+    "rebanada": ("rebanada", 1), "rebanadas": ("rebanada", 1),
+    "loncha": ("loncha", 1), "lonchas": ("loncha", 1),
+    "puñado": ("puñado", 1), "puñados": ("puñado", 1),
+    "lata": ("lata", 1), "latas": ("lata", 1),
+    "filete": ("filete", 1), "filetes": ("filete", 1),
+    "diente": ("diente", 1), "dientes": ("diente", 1),
+    "racion": ("ración", 1), "raciones": ("ración", 1), "ración": ("ración", 1),
+    "pizca": ("pizca", 1), "pizcas": ("pizca", 1),
+}
+_WORD_NUMBERS = {"un": 1, "una": 1, "uno": 1, "medio": 0.5, "media": 0.5, "dos": 2, "tres": 3, "cuatro": 4}
+
+_ALIASES = {
+    "aove": "aceite de oliva",
+    "aceite de oliva virgen extra": "aceite de oliva",
+    "aceite de oliva virgen": "aceite de oliva",
+    "aceite oliva": "aceite de oliva",
+    "huevo cocido": "huevo",
+    "huevo duro": "huevo",
+    "pechuga de pollo": "pollo (pechuga)",
+    "leche desnatada": "leche desnatada",
+    "copos de avena": "avena",
+    "tostada": "pan",
+    "tostada integral": "pan integral",
+}
+
+_UNIT_ALT = "|".join(sorted(map(re.escape, _UNITS), key=len, reverse=True))
+_QTY = r"(?P<qty>\d+(?:[.,]\d+)?(?:\s*/\s*\d+)?|" + "|".join(_WORD_NUMBERS) + r")"
+_ITEM_RE = re.compile(rf"^{_QTY}\s*(?:(?P<unit>{_UNIT_ALT})\b\.?)?\s*(?:de\s+|del\s+)?(?P<name>.*)$")
+_SPLIT_RE = re.compile(r"\s*(?:,|;|\+|\by\b|\bcon\b)\s*")
+_PAREN_RE = re.compile(r"\([^)]*\)")
+_COOKING_RE = re.compile(
+    r"\b(?:a la plancha|al horno|al vapor|a la parrilla|salteado|salteada|salteados|salteadas|"
+    r"cocido|cocida|cocidos|cocidas|hervido|hervida|hervidos|hervidas|asado|asada|asados|asadas|"
+    r"estofado|estofada|estofados|estofadas|troceado|troceada|picado|picada|rallado|rallada|en rodajas|al gusto|para untar)\b"
+)
+_LEADING_RE = re.compile(r"^(?:de|del|la|el|los|las|unos|unas)\s+")
+
+
+def _ascii(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3:
+        return word
+    if word.endswith("ces"):
+        return word[:-3] + "z"
+    if word.endswith("es") and word[-3] in "lrndj":
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _key(text: str) -> str:
+    return " ".join(_singular(w) for w in _ascii(text).split())
+
+
+_ALIASES = {_key(k): v for k, v in _ALIASES.items()}
+
+
+@lru_cache(maxsize=4096)
+def normalize_name(raw: str) -> tuple[str, str]:
+    # (clave para agrupar, nombre a mostrar)
+    text = _PAREN_RE.sub(" ", raw.lower())
+    text = _COOKING_RE.sub(" ", text)
+    text = " ".join(text.replace(".", " ").split())
+    text = _LEADING_RE.sub("", text)
+    if not text:
+        return "", ""
+    key = _key(text)
+    alias = _ALIASES.get(key)
+    if alias:
+        return _key(alias), alias
+    return key, text
+
+
+def _qty(raw: str) -> float:
+    raw = raw.replace(",", ".").replace(" ", "")
+    if raw in _WORD_NUMBERS:
+        return _WORD_NUMBERS[raw]
+    if "/" in raw:
+        num, den = raw.split("/", 1)
+        return float(num) / float(den) if float(den) else 0.0
+    return float(raw)
+
+
+def _components(comida: str) -> list[str]:
+    return [p for p in _SPLIT_RE.split(_PAREN_RE.sub(" ", comida)) if p.strip()]
+
+
+# (clave, nombre, magnitud o None, cantidad en unidad base)
+Ingredient = tuple[str, str, Optional[str], float]
+
+
+@lru_cache(maxsize=8192)
+def parse_meal(comida: str, cantidad: str) -> tuple[Ingredient, ...]:
+    # Los planes repiten muchísimo los mismos platos: memoizado por texto
+    items = []
+    unnamed = []
+    for part in _SPLIT_RE.split(cantidad.lower().strip()):
+        m = _ITEM_RE.match(part.strip())
+        if not m:
+            continue
+        try:
+            qty = _qty(m.group("qty"))
+        except ValueError:
+            continue
+        unit = m.group("unit")
+        dim, factor = _UNITS.get(unit, ("ud", 1)) if unit else ("ud", 1)
+        name = m.group("name").strip()
+        if name:
+            items.append((name, dim, qty * factor))
+        else:
+            unnamed.append((dim, qty * factor))
+
+    if unnamed:
+        # Cantidades sin nombre: se reparten entre los componentes del plato
+        # que no tengan ya su propia cantidad ("Pollo con arroz" / "150 g y 80 g")
+        named = {normalize_name(n)[0] for n, _, _ in items}
+        parts = [p for p in _components(comida) if normalize_name(p)[0] not in named]
+        if len(parts) == len(unnamed) and (len(parts) > 1 or named):
+            items += [(p, dim, q) for p, (dim, q) in zip(parts, unnamed)]
+        else:
+            items += [(comida, dim, q) for dim, q in unnamed]
+    if not items:
+        # Sin cantidad utilizable ("al gusto"): se listan los componentes
+        items = [(p, None, 0.0) for p in _components(comida)]
+
+    out = []
+    for name, dim, qty in items:
+        key, display = normalize_name(name)
+        if key:
+            out.append((key, display, dim, qty))
+    return tuple(out)
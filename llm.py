@@ -0,0 +1,159 @@
+# llm.py
+
+import os, time, asyncio
+from contextlib import asynccontextmanager
+
+import openai
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.3"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+
+# Máximo de peticiones a OpenAI en vuelo y cuánto puede esperar una en cola
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30"))
+
+# kind: chat (respuesta completa) | stream
+OPENAI_REQUEST_SECONDS = metrics.histogram(
+    "openai_request_seconds", "Duración de las llamadas a OpenAI (sin la espera del limitador)",
+    ("kind", "outcome"), metrics.SLOW_BUCKETS)
+OPENAI_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "openai_first_token_seconds", "Tiempo hasta el primer trozo de texto en streaming", buckets=metrics.SLOW_BUCKETS)
+OPENAI_QUEUE_SECONDS = metrics.histogram(
+    "openai_queue_seconds", "Espera por un hueco del limitador de concurrencia")
+OPENAI_TOKENS = metrics.counter("openai_tokens_total", "Tokens consumidos según OpenAI", ("kind", "type"))
+OPENAI_FAILURES = metrics.counter("openai_failures_total", "Llamadas a OpenAI fallidas", ("kind", "error"))
+OPENAI_IN_FLIGHT = metrics.gauge("openai_in_flight", "Llamadas a OpenAI en curso")
+OPENAI_WAITING = metrics.gauge("openai_waiting", "Llamadas esperando hueco en el limitador")
+
+
+class LLMBusyError(Exception):
+    """No hubo hueco libre en el limitador dentro de OPENAI_QUEUE_TIMEOUT."""
+
+
+# ---------- limitador de concurrencia ----------
+class ConcurrencyLimiter:
+    def __init__(self, max_in_flight: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._sem = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMBusyError(f"cola de OpenAI llena ({self.in_flight} en vuelo)")
+        finally:
+            self.waiting -= 1
+            OPENAI_QUEUE_SECONDS.observe(time.perf_counter() - t0)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+
+limiter = ConcurrencyLimiter(OPENAI_MAX_CONCURRENCY, OPENAI_QUEUE_TIMEOUT)
+OPENAI_IN_FLIGHT.set_function(lambda: limiter.in_flight)
+OPENAI_WAITING.set_function(lambda: limiter.waiting)
+
+# ---------- cliente compartido ----------
+_client: openai.AsyncOpenAI | None = None
+
+
+def get_client() -> openai.AsyncOpenAI:
+    global _client
+    if _client is None:
+        _client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+    return _client
+
+
+async def init_client() -> openai.AsyncOpenAI:
+    return get_client()
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+# ---------- métricas ----------
+def _count_usage(kind: str, usage):
+    if usage is not None:
+        OPENAI_TOKENS.labels(kind, "prompt").inc(usage.prompt_tokens or 0)
+        OPENAI_TOKENS.labels(kind, "completion").inc(usage.completion_tokens or 0)
+
+
+def _count_failure(kind: str, error: Exception):
+    OPENAI_FAILURES.labels(kind, type(error).__name__).inc()
+
+
+# ---------- llamadas ----------
+async def chat_completion(messages: list[dict], model: str = None, temperature: float = None) -> str:
+    try:
+        async with limiter.slot():
+            t0 = time.perf_counter()
+            try:
+                completion = await get_client().chat.completions.create(
+                    model=model or OPENAI_MODEL,
+                    temperature=OPENAI_TEMPERATURE if temperature is None else temperature,
+                    messages=messages,
+                )
+            except Exception:
+                OPENAI_REQUEST_SECONDS.labels("chat", "error").observe(time.perf_counter() - t0)
+                raise
+            OPENAI_REQUEST_SECONDS.labels("chat", "ok").observe(time.perf_counter() - t0)
+    except Exception as e:
+        _count_failure("chat", e)
+        raise
+    _count_usage("chat", completion.usage)
+    return completion.choices[0].message.content or ""
+
+
+async def stream_chat_completion(messages: list[dict], model: str = None, temperature: float = None):
+    # Igual que chat_completion pero va devolviendo los trozos de texto según
+    # llegan; el hueco del limitador se mantiene hasta agotar el stream.
+    # include_usage: el último trozo (sin choices) trae el consumo de tokens
+    try:
+        async with limiter.slot():
+            t0 = time.perf_counter()
+            first = True
+            outcome = "cancelled"  # el consumidor dejó el stream a medias
+            try:
+                stream = await get_client().chat.completions.create(
+                    model=model or OPENAI_MODEL,
+                    temperature=OPENAI_TEMPERATURE if temperature is None else temperature,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                async for chunk in stream:
+                    _count_usage("stream", getattr(chunk, "usage", None))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first:
+                            OPENAI_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t0)
+                            first = False
+                        yield chunk.choices[0].delta.content
+                outcome = "ok"
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                OPENAI_REQUEST_SECONDS.labels("stream", outcome).observe(time.perf_counter() - t0)
+    except Exception as e:
+        _count_failure("stream", e)
+        raise
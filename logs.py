@@ -0,0 +1,75 @@
+# logs.py
+#
+# Logs estructurados: una línea JSON por evento en stdout con hora, nivel,
+# nombre del evento, campos y el contexto del update en curso (cid =
+# id de correlación, update_id, chat_id). El contexto vive en un
+# contextvar, así que lo heredan las tareas lanzadas desde el handler
+# (generación de semanas en segundo plano, compactación del chat).
+
+import os, sys, json, uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+_min_level = LEVELS.get(LOG_LEVEL, 20)
+
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+
+def correlation_id(update_id: Optional[int] = None) -> str:
+    # Estable entre reintentos del mismo update; aleatorio si no hay update_id
+    return f"upd-{update_id}" if update_id is not None else uuid.uuid4().hex[:16]
+
+
+def current() -> dict:
+    return _context.get()
+
+
+@contextmanager
+def context(**fields):
+    # Añade campos al contexto de los logs durante el bloque
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def enabled(level: str) -> bool:
+    return LEVELS[level] >= _min_level
+
+
+def log(level: str, event: str, exc: Optional[BaseException] = None, **fields):
+    if LEVELS[level] < _min_level:
+        return
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "level": level,
+        "event": event,
+        **_context.get(),
+        **fields,
+    }
+    if exc is not None:
+        record["error"] = f"{type(exc).__name__}: {exc}"[:1000]
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    sys.stdout.flush()
+
+
+def debug(event: str, **fields):
+    log("DEBUG", event, **fields)
+
+
+def info(event: str, **fields):
+    log("INFO", event, **fields)
+
+
+def warn(event: str, exc: Optional[BaseException] = None, **fields):
+    log("WARN", event, exc, **fields)
+
+
+def error(event: str, exc: Optional[BaseException] = None, **fields):
+    log("ERROR", event, exc, **fields)
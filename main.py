@@ -1,236 +1,310 @@
 # main.py
 
-import os, httpx, openai, json, re
+import os, hmac, time
+from datetime import date
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
-from datetime import datetime
-
-from db import init_db, SessionLocal, User, MenuLog
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response
+
+from db import init_db, dispose_engines, AsyncSessionLocal, MenuLog
+import update_queue
+import logs
+import metrics
+import profiler
+from update_context import UpdateContext
+import router
+from plans import latest_plan, latest_plan_ref
+import plan_generation
+import plan_cache
+import answer_cache
+import user_cache
+import shopping
+import plan_view
+import chat_memory
+import nutrition
 from onboarding import (
+    STEP_BY_PREFIX,
+    current_step,
     start_onboarding,
-    ask_next,
-    save_answer,
+    handle_onboarding,   # 👈 máquina de estados: una respuesta → un mensaje
     kb_reset_confirm,
     kb_main_menu,
-    handle_callback,   # 👈 nuevo: procesar botones inline de onboarding
 )
-from telegram_utils import tg, answer_callback
+from telegram_utils import (
+    tg,
+    answer_callback,
+    init_client,
+    close_client,
+    start_dispatcher,
+    stop_dispatcher,
+    dispatcher_stats,
+    edit_message,
+    ThrottledEditor,
+)
+import llm
+from llm import chat_completion, LLMBusyError
+from plan_parser import PlanStreamTracker
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")
+# Endpoints de consulta /plans/* (datos personales): solo con la cabecera
+# X-Admin-Token; sin token configurado no existen (404)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.3"))
+BUSY_TEXT = "⏳ Ahora mismo estoy atendiendo muchas peticiones. Inténtalo de nuevo en unos minutos."
+PLAN_PROGRESS_INTERVAL = float(os.getenv("PLAN_PROGRESS_INTERVAL", "1.5"))
 
-TG_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+UPDATE_SECONDS = metrics.histogram("update_handle_seconds", "Tiempo de proceso de un update por ruta", ("route",))
+UPDATES = metrics.counter("updates_total", "Updates procesados por ruta y resultado (ok | error)", ("route", "outcome"))
+CHAT_ANSWERS = metrics.counter("chat_answers_total", "Respuestas del chat libre por origen (cache | llm)", ("source",))
 
 app = FastAPI()
 init_db()
 
 
+def _progress_text(tracker: PlanStreamTracker, total_weeks: int) -> str:
+    return (
+        f"⏳ Generando tu dieta… semana 1/{total_weeks}\n"
+        f"✅ {tracker.days_done}/7 días listos"
+    )
+
+
+def _shopping_view(log, semana: int | None, part: int = 0) -> tuple[str, dict]:
+    # semana=None → todo el plan; el texto sale de la caché por versión de plan
+    mj = log.menu_json or {}
+    total = mj.get("duracion_semanas") or len(mj.get("semanas") or []) or 1
+    if semana is None:
+        items = shopping.shopping_list(log)
+        text = shopping.format_list(items, "Lista de la compra · todo el plan")
+        return shopping.view(text, None, total, part)
+    if not any(w.get("semana") == semana for w in mj.get("semanas") or []):
+        return f"⏳ La semana {semana} aún se está preparando. Vuelve a mirarlo en un rato.", shopping.kb_shopping(semana, total)
+    items = shopping.shopping_list(log, semana=semana)
+    text = shopping.format_list(items, f"Lista de la compra · semana {semana}")
+    return shopping.view(text, semana, total, part)
+
+
+async def _indexed_plan(s, ref):
+    # Solo se lee menu_json si esta versión del plan aún no está en memoria
+    plan = plan_view.cached_plan(ref)
+    if plan is None:
+        log = await s.get(MenuLog, ref.id)
+        plan = plan_view.index_plan(ref, log.menu_json if log else {})
+    return plan
+
+
+async def _plan_page(s, ref, semana: int, dia, part: int = 0) -> tuple[str, dict]:
+    chunks = plan_view.page(await _indexed_plan(s, ref), semana, dia)
+    return plan_view.view(chunks, semana, dia, ref.duracion_semanas, part)
+
+
 @app.on_event("startup")
 async def startup_event():
+    await init_client()
+    start_dispatcher()
+    await llm.init_client()
+    await user_cache.start()
+    update_queue.start_workers(process_update)
     if TELEGRAM_BOT_TOKEN and PUBLIC_BASE_URL:
         webhook_url = f"{PUBLIC_BASE_URL.rstrip('/')}/webhook"
-        api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook"
-        async with httpx.AsyncClient(timeout=10) as client:
-            try:
-                r = await client.post(api_url, json={"url": webhook_url})
-                r.raise_for_status()
-                print("✅ Webhook configurado:", r.json())
-            except Exception as e:
-                print("❌ Error configurando webhook:", e)
+        try:
+            r = await tg("setWebhook", {"url": webhook_url})
+            logs.info("webhook_set", url=webhook_url, response=r)
+        except Exception as e:
+            logs.error("webhook_set_failed", e, url=webhook_url)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await update_queue.stop_workers()
+    await plan_generation.shutdown()
+    await chat_memory.shutdown()
+    await user_cache.stop()
+    await stop_dispatcher()
+    await close_client()
+    await llm.close_client()
+    await dispose_engines()
 
 
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
+    # Solo persistimos el update y respondemos ya: los workers hacen el resto
     data = await request.json()
-    message = data.get("message", {})
-    callback = data.get("callback_query", {})
-
-    chat_id = None
-    text = None
-    is_callback = False
-
-    if message:
-        chat_id = message["chat"]["id"]
-        text = message.get("text", "").strip()
-    elif callback:
-        is_callback = True
-        chat_id = callback["message"]["chat"]["id"]
-        text = callback.get("data", "")
-
-    if not chat_id:
-        return PlainTextResponse("no chat_id")
-
-    # --- Comando /start ---
-    if text and text.startswith("/start"):
-        with SessionLocal() as s:
-            u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-            if u:
-                return await tg("sendMessage", {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Ya tienes un perfil configurado. ¿Quieres sobrescribirlo?",
-                    "reply_markup": kb_reset_confirm()
-                })
-        return await start_onboarding(chat_id)
-
-    # --- Confirmación reset ---
-    if is_callback and text in ("reset_yes", "reset_no"):
-        await answer_callback(callback["id"])
-        if text == "reset_yes":
-            with SessionLocal() as s:
-                u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-                if u:
-                    s.delete(u)
-                    s.commit()
-            return await start_onboarding(chat_id)
-        else:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "👌 Mantendré tu perfil actual."})
-
-    # --- Comando /menu para salir del chat libre ---
-    if text and text.startswith("/menu"):
-        with SessionLocal() as s:
-            u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-            if u and u.vetos == "__chat__":
-                u.vetos = None
-                s.commit()
+    await update_queue.enqueue(data)
+    return PlainTextResponse("ok")
+
+
+async def process_update(data: dict):
+    update = router.decode(data)
+    if update is None:
+        return None
+    route = routes.resolve(update)
+    ctx = UpdateContext(chat_id=update.chat_id, update=update, route=route.name)
+
+    # Con PROFILE_ENABLED=1 se muestrea la pila del update (profiler.py)
+    t0 = time.perf_counter()
+    with profiler.capture(update.update_id) as prof:
+        outcome = "error"
+        try:
+            if route.needs == router.NOTHING:
+                result = await _run(route, ctx)
+            else:
+                # Un único Session (y una única carga de User) por update
+                async with AsyncSessionLocal() as s:
+                    ctx.session = s
+                    if route.needs >= router.USER:
+                        await ctx.load_user()
+                    result = await _run(route, ctx)
+            outcome = "ok"
+            return result
+        finally:
+            prof.route = ctx.route
+            elapsed = time.perf_counter() - t0
+            UPDATE_SECONDS.labels(ctx.route).observe(elapsed)
+            UPDATES.labels(ctx.route, outcome).inc()
+            logs.debug("update_handled", route=ctx.route, outcome=outcome, ms=round(elapsed * 1e3, 1))
+
+
+async def _run(route: router.Route, ctx: UpdateContext):
+    update = ctx.update
+    if update.is_callback:
+        await answer_callback(update.callback_id)
+    u = ctx.user
+    if route.profile and route.needs == router.USER and u is None:
+        # Botón de un chat sin perfil (borrado o antiguo): los handlers de
+        # perfil dan el User por hecho; se remite a /start
+        return await _unknown(ctx)
+    if route.profile and u:
+        if u.onboarding_step != 0:
+            return await _onboarding(ctx)
+        # semana_actual sigue al calendario; al avanzar se generan las siguientes
+        await plan_generation.sync_current_week(ctx.session, u)
+    return await route.handler(ctx)
+
+
+routes = router.Router()
+
+
+# ---------- comandos ----------
+@routes.command("/start", profile=False)
+async def _start(ctx: UpdateContext):
+    if ctx.user:
+        return await tg("sendMessage", {
+            "chat_id": ctx.chat_id,
+            "text": "⚠️ Ya tienes un perfil configurado. ¿Quieres sobrescribirlo?",
+            "reply_markup": kb_reset_confirm()
+        })
+    return await start_onboarding(ctx)
+
+
+@routes.command("/menu", profile=False)
+async def _menu(ctx: UpdateContext):
+    # Sale del chat libre y vuelve al menú principal
+    if ctx.user:
+        if ctx.user.vetos == "__chat__":
+            ctx.user.vetos = None  # marca antigua del modo chat
+        await chat_memory.set_active(ctx.session, ctx.chat_id, False)
+    return await tg("sendMessage", {
+        "chat_id": ctx.chat_id,
+        "text": "Volvemos al menú principal:",
+        "reply_markup": kb_main_menu()
+    })
+
+
+# ---------- reset y onboarding ----------
+@routes.callback(prefix="reset_", profile=False)
+async def _reset(ctx: UpdateContext):
+    if ctx.update.text != "reset_yes":
+        if ctx.update.text == "reset_no":
+            return await tg("sendMessage", {"chat_id": ctx.chat_id, "text": "👌 Mantendré tu perfil actual."})
+        return await _unknown(ctx)
+    if ctx.user:
+        await ctx.session.delete(ctx.user)
+        await ctx.session.commit()
+        ctx.user = None
+    return await start_onboarding(ctx)
+
+
+async def _onboarding(ctx: UpdateContext):
+    # Usuarios con el onboarding a medias: una respuesta → un mensaje
+    u = ctx.user
+    if not (u and u.onboarding_step != 0):
+        return await _unknown(ctx)
+    step = current_step(u)
+    ctx.route = f"onboarding_{step.field}" if step else "onboarding"
+    return await handle_onboarding(ctx, ctx.update.text, ctx.update.is_callback)
+
+
+# Botones de las preguntas (sexo_, act_): fuera del onboarding no hacen nada
+for _prefix in STEP_BY_PREFIX:
+    routes.callback(prefix=_prefix, profile=False, route="onboarding")(_onboarding)
+
+
+# ---------- menú principal ----------
+@routes.callback("menu_generate")
+async def _menu_generate(ctx: UpdateContext):
+    chat_id, s, u = ctx.chat_id, ctx.session, ctx.user
+    # Mensaje inmediato y progreso editándolo mientras llega el stream
+    sent = await tg("sendMessage", {"chat_id": chat_id, "text": "⏳ Generando tu dieta…"})
+    progress = ThrottledEditor(chat_id, sent["result"]["message_id"], PLAN_PROGRESS_INTERVAL)
+    total = u.duracion_plan_semanas or 1
+
+    async def on_progress(tracker: PlanStreamTracker):
+        await progress.update(_progress_text(tracker, total))
+
+    # Plan vacío con una fila por semana; la semana 1 se genera ya
+    log = await plan_generation.create_plan(s, u)
+    try:
+        await plan_generation.generate_week(log.id, 1, on_progress)
+    except LLMBusyError:
+        return await progress.update(BUSY_TEXT, force=True)
+    except Exception as e:
+        logs.error("plan_week1_failed", e, menu_log_id=log.id)
+        return await progress.update("❌ No he podido generar tu dieta. Inténtalo de nuevo.", force=True)
+
+    # Resto de semanas en segundo plano (concurrencia acotada)
+    await plan_generation.ensure_upcoming(log.id, 1)
+    rest = " Las siguientes semanas se irán preparando en segundo plano." if total > 1 else ""
+    return await progress.update(
+        "📅 Tu semana 1 ya está lista y guardada." + rest
+        + " Puedes consultarla aquí o pedirme la lista de la compra.",
+        {"inline_keyboard": [[{"text": "📖 Ver mi dieta", "callback_data": plan_view.callback(1, plan_view.WEEK)}]]},
+        force=True,
+    )
+
+
+@routes.callback("menu_shopping")
+async def _menu_shopping(ctx: UpdateContext):
+    chat_id, u = ctx.chat_id, ctx.user
+    log = await latest_plan(ctx.session, chat_id, u)
+    if log is None:
         return await tg("sendMessage", {
             "chat_id": chat_id,
-            "text": "Volvemos al menú principal:",
-            "reply_markup": kb_main_menu()
+            "text": "🛒 Aún no tienes dieta. Pulsa «📅 Generar dieta completa» y después te preparo la lista.",
         })
+    body, markup = _shopping_view(log, u.semana_actual or 1)
+    return await tg("sendMessage", {"chat_id": chat_id, "text": body, "parse_mode": "HTML", "reply_markup": markup})
 
-    # --- Onboarding flujo normal ---
-    with SessionLocal() as s:
-        u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-
-        if u and u.onboarding_step != 0:
-            step = u.onboarding_step
-            field_map = {
-                1: "sexo",
-                2: "edad",
-                3: "altura_cm",
-                4: "peso_kg",
-                5: "actividad",
-                6: "objetivo_detallado",
-                7: "estilo_dieta",
-                8: "preferencias",
-                9: "no_gustos",
-                10: "alergias",
-                11: "vetos",
-                12: "tiempo_cocina",
-                13: "equipamiento",
-                14: "duracion_plan_semanas",
-                15: "pais",
-            }
-            field = field_map.get(step)
-
-            # 👇 clave: los pasos 1 y 5 se responden con botones inline
-            if is_callback and (text.startswith("sexo_") or text.startswith("act_")):
-                await answer_callback(callback["id"])
-                await handle_callback(chat_id, text)    # deja guardado y avanza de step dentro
-                return await ask_next(chat_id)
-
-            if field:
-                if is_callback:
-                    # Si por error llegan callbacks no esperados aquí, solo los descartamos
-                    await answer_callback(callback["id"])
-                    return await ask_next(chat_id)
-                else:
-                    # Entradas de texto: se validan en save_answer (altura/peso/edad…)
-                    await save_answer(chat_id, field, text)
-                    return await ask_next(chat_id)
-
-        # --- Menú principal callbacks ---
-        if is_callback and text.startswith("menu_"):
-            await answer_callback(callback["id"])
-            if text == "menu_generate":
-                # Recuperar perfil
-                perfil_txt = f"""
-Sexo: {u.sexo}
-Edad: {u.edad}
-Altura: {u.altura_cm} cm
-Peso: {u.peso_kg} kg
-Actividad: {u.actividad}
-Objetivos: {u.objetivo_detallado}
-Estilos: {u.estilo_dieta}
-Equipamiento: {u.equipamiento}
-Semanas plan: {u.duracion_plan_semanas}
-País: {u.pais}
-"""
 
-                # Generar dieta con OpenAI
-                client = openai.OpenAI(api_key=OPENAI_API_KEY)
-                completion = client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    temperature=OPENAI_TEMPERATURE,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": (
-                                "Eres un nutricionista experto. "
-                                "Debes responder ÚNICAMENTE con un JSON válido, sin texto adicional. "
-                                "Formato esperado:\n\n"
-                                "{\n"
-                                '  \"duracion_semanas\": <int>,\n'
-                                '  \"semanas\": [ { \"semana\": 1, \"dias\": { \"lunes\": { \"desayuno\": {\"comida\":..., \"cantidad\":...}, ... } } } ]\n'
-                                "}"
-                            )
-                        },
-                        {"role": "user", "content": f"Genera una dieta en JSON según este perfil:\n{perfil_txt}"}
-                    ]
-                )
-                raw_text = completion.choices[0].message.content.strip()
-
-                # Extraer solo JSON
-                match = re.search(r"\{.*\}", raw_text, re.DOTALL)
-                if match:
-                    dieta_json = match.group(0)
-                else:
-                    dieta_json = "{}"
-
-                # Validar JSON
-                try:
-                    parsed = json.loads(dieta_json)
-                except Exception as e:
-                    print("[ERROR] JSON inválido:", e)
-                    parsed = {}
-
-                # Guardar en DB (JSONB): params como dict para limpieza
-                log = MenuLog(
-                    chat_id=str(chat_id),
-                    params={"perfil": {
-                        "sexo": u.sexo,
-                        "edad": u.edad,
-                        "altura_cm": u.altura_cm,
-                        "peso_kg": u.peso_kg,
-                        "actividad": u.actividad,
-                        "objetivo_detallado": u.objetivo_detallado,
-                        "estilo_dieta": u.estilo_dieta,
-                        "equipamiento": u.equipamiento,
-                        "duracion_plan_semanas": u.duracion_plan_semanas,
-                        "pais": u.pais,
-                    }},
-                    menu_json=parsed,
-                    timestamp=datetime.utcnow()
-                )
-                s.add(log)
-                s.commit()
-
-                return await tg("sendMessage", {
-                    "chat_id": chat_id,
-                    "text": "📅 Tu dieta completa ha sido generada y guardada. Ahora puedes consultarla en el chat libre o pedirme la lista de la compra."
-                })
-
-            if text == "menu_shopping":
-                return await tg("sendMessage", {"chat_id": chat_id, "text": "🛒 (Aquí generaremos tu lista de la compra)"})
-            if text == "menu_profile":
-                perfil_txt = f"""
+@routes.callback("menu_plan")
+async def _menu_plan(ctx: UpdateContext):
+    chat_id, s, u = ctx.chat_id, ctx.session, ctx.user
+    ref = await latest_plan_ref(s, chat_id, u)
+    if ref is None:
+        return await tg("sendMessage", {
+            "chat_id": chat_id,
+            "text": "📖 Aún no tienes dieta. Pulsa «📅 Generar dieta completa» para crearla.",
+        })
+    body, markup = await _plan_page(s, ref, u.semana_actual or 1, date.today().weekday())
+    return await tg("sendMessage", {"chat_id": chat_id, "text": body, "parse_mode": "HTML", "reply_markup": markup})
+
+
+@routes.callback("menu_profile")
+async def _menu_profile(ctx: UpdateContext):
+    u = ctx.user
+    perfil_txt = f"""
 👤 <b>Tu perfil</b>
 Sexo: {u.sexo}
 Edad: {u.edad}
@@ -243,86 +317,219 @@ Equipamiento: {u.equipamiento}
 Semanas plan: {u.duracion_plan_semanas}
 País: {u.pais}
 """
-                return await tg("sendMessage", {"chat_id": chat_id, "text": perfil_txt, "parse_mode": "HTML"})
-            if text == "menu_chat":
-                # Guardamos modo chat y construimos contexto (perfil + dieta si existe)
-                with SessionLocal() as s2:
-                    u2 = s2.query(User).filter(User.chat_id == str(chat_id)).first()
-                    if u2:
-                        u2.vetos = "__chat__"
-
-                        perfil_txt = f"""
-Perfil usuario:
-Sexo: {u2.sexo}
-Edad: {u2.edad}
-Altura: {u2.altura_cm} cm
-Peso: {u2.peso_kg} kg
-Actividad: {u2.actividad}
-Objetivos: {u2.objetivo_detallado}
-Estilos: {u2.estilo_dieta}
-Equipamiento: {u2.equipamiento}
-Semanas plan: {u2.duracion_plan_semanas}
-País: {u2.pais}
-"""
+    return await tg("sendMessage", {"chat_id": ctx.chat_id, "text": perfil_txt, "parse_mode": "HTML"})
+
 
-                        dieta_txt = ""
-                        try:
-                            last_menu = s2.query(MenuLog).order_by(MenuLog.timestamp.desc()).first()
-                            if last_menu and getattr(last_menu, "menu_json", None):
-                                dieta_txt = f"\nDieta actual (resumen):\n{json.dumps(last_menu.menu_json)[:500]}..."
-                        except Exception as e:
-                            print("[WARN] No se pudo recuperar dieta:", e)
-                            s2.rollback()
-
-                        u2.preferencias = perfil_txt + dieta_txt
-                        try:
-                            s2.commit()
-                        except Exception as e:
-                            print("[ERROR] Falló commit en menu_chat:", e)
-                            s2.rollback()
-
-                return await tg("sendMessage", {
-                    "chat_id": chat_id,
-                    "text": "💬 Estoy listo para chatear contigo teniendo en cuenta tu perfil y (si existe) tu dieta actual. Escríbeme lo que quieras sobre recetas, listas o ajustes. (Escribe /menu para volver al menú)"
-                })
-            if text == "menu_help":
-                help_txt = """❓ <b>Ayuda</b>
+@routes.callback("menu_chat")
+async def _menu_chat(ctx: UpdateContext):
+    # El perfil y los días del plan se leen en cada mensaje; aquí solo
+    # se activa la memoria de la conversación
+    u = ctx.user
+    if u:
+        if u.vetos == "__chat__":
+            u.vetos = None  # marca antigua del modo chat
+        await chat_memory.set_active(ctx.session, ctx.chat_id, True)
+    return await tg("sendMessage", {
+        "chat_id": ctx.chat_id,
+        "text": "💬 Estoy listo para chatear contigo teniendo en cuenta tu perfil y (si existe) tu dieta actual. Escríbeme lo que quieras sobre recetas, listas o ajustes. (Escribe /menu para volver al menú)"
+    })
+
+
+HELP_TEXT = """❓ <b>Ayuda</b>
 
 • 📅 Generar dieta completa → crea tu plan semana a semana.
+• 📖 Ver mi dieta → consulta tu plan día a día o por semanas.
 • 🛒 Lista de la compra → consolida los ingredientes de tu plan.
 • ℹ️ Ver mi perfil → repasa la información que configuraste.
 • 💬 Chat con coach → hazme preguntas o pide cambios.
 • /start → reinicia (te preguntará si quieres sobrescribir).
 • /menu → salir del chat libre y volver al menú.
 """
-                return await tg("sendMessage", {"chat_id": chat_id, "text": help_txt, "parse_mode": "HTML"})
-
-        # --- CHAT LIBRE (natural con perfil + dieta si existe) ---
-        if u and u.vetos == "__chat__" and not is_callback and text:
-            context = u.preferencias or ""
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            completion = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                temperature=OPENAI_TEMPERATURE,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Eres un coach nutricional cercano, simpático y natural. "
-                            "Responde de forma conversacional, breve si procede, como si chatearas en Telegram. "
-                            "Ten siempre en cuenta el siguiente perfil y dieta del usuario:\n\n"
-                            f"{context}"
-                        )
-                    },
-                    {"role": "user", "content": text}
-                ]
-            )
-            answer = completion.choices[0].message.content
-            return await tg("sendMessage", {"chat_id": chat_id, "text": answer})
-
-    return await tg("sendMessage", {"chat_id": chat_id, "text": "No entiendo ese comando. Usa /start para comenzar."})
+
+
+@routes.callback("menu_help", needs=router.NOTHING)
+async def _menu_help(ctx: UpdateContext):
+    # Texto fijo: no abre Session
+    return await tg("sendMessage", {"chat_id": ctx.chat_id, "text": HELP_TEXT, "parse_mode": "HTML"})
+
+
+# ---------- navegación (edita el mismo mensaje) ----------
+@routes.callback(prefix="shop_", route="shop_nav")
+async def _shop_nav(ctx: UpdateContext):
+    # Lista de la compra: semana anterior / siguiente / todo el plan
+    target = shopping.parse_callback(ctx.update.text)
+    log = await latest_plan(ctx.session, ctx.chat_id, ctx.user)
+    if target is None or log is None:
+        return None
+    body, markup = _shopping_view(log, *target)
+    return await edit_message(ctx.chat_id, ctx.update.message_id, body, markup, parse_mode="HTML")
+
+
+@routes.callback(prefix="plan_", route="plan_nav")
+async def _plan_nav(ctx: UpdateContext):
+    # Visor del plan: día/semana anterior y siguiente
+    target = plan_view.parse_callback(ctx.update.text)
+    if target is None:
+        return await _unknown(ctx)
+    ref = await latest_plan_ref(ctx.session, ctx.chat_id, ctx.user)
+    if ref is None:
+        return None
+    body, markup = await _plan_page(ctx.session, ref, *target)
+    return await edit_message(ctx.chat_id, ctx.update.message_id, body, markup, parse_mode="HTML")
+
+
+# ---------- texto libre y desconocidos ----------
+@routes.default(callback=False)
+async def _text(ctx: UpdateContext):
+    # Chat libre (perfil + días del plan relevantes + memoria acotada) si
+    # está activo; si no, no sabemos qué hacer con el mensaje
+    chat_id, s, u, text = ctx.chat_id, ctx.session, ctx.user, ctx.update.text
+    mem = await chat_memory.active_memory(s, chat_id) if u and text else None
+    if mem is None:
+        return await _unknown(ctx)
+    ctx.route = "chat"
+    turns = await chat_memory.history(s, mem)
+    params = plan_generation.profile_params(u)
+    # Preguntas frecuentes (clase FAQ explícita, sin referencias al plan): la
+    # respuesta se genera y se cachea con un prompt que solo lleva el trozo de
+    # perfil de la clave (sin nombre, historial ni plan), así vale para
+    # cualquiera con ese trozo. El resto va al LLM con todo y no se cachea.
+    general = (answer_cache.ANSWER_CACHE_ENABLED and answer_cache.faq(text)
+               and not chat_memory.mentions_plan(text))
+    answer = None
+    if general:
+        slice_key = answer_cache.profile_slice(params)
+        answer = answer_cache.cache.get(text, slice_key)
+        if answer is None:
+            messages = chat_memory.build_messages(answer_cache.profile_text(params), "", None, [], text)
+    else:
+        dieta = ""
+        ref = await latest_plan_ref(s, chat_id, u)
+        if ref is not None:
+            plan = await _indexed_plan(s, ref)
+            dieta = chat_memory.plan_context(plan.weeks, text, u.semana_actual or 1)
+        messages = chat_memory.build_messages(plan_generation.profile_text(params), dieta, mem, turns, text)
+    CHAT_ANSWERS.labels("llm" if answer is None else "cache").inc()
+    if answer is None:
+        t0 = time.perf_counter()
+        try:
+            answer = await chat_completion(messages)
+        except LLMBusyError:
+            return await tg("sendMessage", {"chat_id": chat_id, "text": BUSY_TEXT})
+        if general:
+            tokens = sum(chat_memory.estimate_tokens(m["content"]) for m in messages) + chat_memory.estimate_tokens(answer)
+            answer_cache.cache.put(text, slice_key, answer, tokens, time.perf_counter() - t0)
+    turns.append(await chat_memory.append(s, mem, "user", text))
+    turns.append(await chat_memory.append(s, mem, "assistant", answer))
+    await s.commit()
+    if chat_memory.needs_compaction(turns):
+        chat_memory.schedule_compaction(chat_id)
+    return await tg("sendMessage", {"chat_id": chat_id, "text": answer})
+
+
+@routes.default(callback=True, needs=router.NOTHING, profile=False)
+async def _unknown(ctx: UpdateContext):
+    return await tg("sendMessage", {"chat_id": ctx.chat_id, "text": "No entiendo ese comando. Usa /start para comenzar."})
+
+
+# ---------- consulta (admin) ----------
+def require_admin(x_admin_token: str = Header(default="")):
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404)
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="X-Admin-Token no válido")
+
+
+admin = APIRouter(prefix="/plans", dependencies=[Depends(require_admin)])
+
+
+@admin.get("/{chat_id}/status")
+async def plan_status(chat_id: str):
+    # Qué semanas del plan activo están listas / generándose / pendientes
+    async with AsyncSessionLocal() as s:
+        ctx = await UpdateContext.load(s, chat_id)
+        log = await latest_plan(s, chat_id, ctx.user)
+        if log is None:
+            return {"chat_id": chat_id, "plan": None}
+        return {"chat_id": chat_id, "plan": await plan_generation.plan_status(s, log)}
+
+
+@admin.get("/{chat_id}/shopping")
+async def plan_shopping(chat_id: str, semana: int | None = None, desde: date | None = None, hasta: date | None = None):
+    # Lista consolidada del plan activo: una semana, un rango de fechas o todo
+    async with AsyncSessionLocal() as s:
+        ctx = await UpdateContext.load(s, chat_id)
+        log = await latest_plan(s, chat_id, ctx.user)
+    if log is None:
+        return {"chat_id": chat_id, "items": None}
+    items = shopping.shopping_list(log, semana=semana, desde=desde, hasta=hasta)
+    return {
+        "chat_id": chat_id,
+        "menu_log_id": log.id,
+        "items": [
+            {
+                "nombre": i.nombre,
+                "categoria": i.categoria,
+                "cantidades": {d: shopping.format_amount(d, q) for d, q in i.cantidades.items()},
+                "veces": i.veces,
+            }
+            for i in items
+        ],
+    }
+
+
+@admin.get("/{chat_id}/score")
+async def plan_score(chat_id: str, semana: int | None = None):
+    # Macros estimados de cada día (tabla local de alimentos) frente al objetivo
+    async with AsyncSessionLocal() as s:
+        ctx = await UpdateContext.load(s, chat_id)
+        log = await latest_plan(s, chat_id, ctx.user)
+    targets = nutrition.targets_for(ctx.user) if ctx.user else None
+    if log is None or targets is None:
+        return {"chat_id": chat_id, "targets": targets, "days": None}
+    days = nutrition.score_plan(log.menu_json, targets)
+    if semana is not None:
+        days = [d for d in days if d.semana == semana]
+    return {
+        "chat_id": chat_id,
+        "menu_log_id": log.id,
+        "targets": targets,
+        "puntuacion_media": round(sum(d.puntuacion for d in days) / len(days), 1) if days else None,
+        "days": [
+            {
+                "semana": d.semana,
+                "dia": d.dia,
+                "kcal": d.total.kcal,
+                "prote_g": d.total.prote_g,
+                "grasa_g": d.total.grasa_g,
+                "carbo_g": d.total.carbo_g,
+                "cobertura": d.cobertura,
+                "desviacion": d.desviacion,
+                "puntuacion": d.puntuacion,
+                "sin_identificar": d.sin_identificar,
+            }
+            for d in days
+        ],
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus (formato texto); la profundidad de la cola durable es una
+    # consulta, así que se lee aquí y no en cada update
+    try:
+        update_queue.QUEUE_DEPTH.set(await update_queue.pending_count())
+    except Exception as e:
+        logs.warn("metrics_queue_depth_failed", e)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", "telegram": dispatcher_stats(), "plan_cache": plan_cache.stats(),
+            "answer_cache": answer_cache.stats(), "user_cache": user_cache.stats(),
+            "profiler": profiler.stats()}
+
+
+# Después de declarar todas sus rutas
+app.include_router(admin)
@@ -0,0 +1,214 @@
+# metrics.py
+#
+# Métricas en memoria expuestas en formato texto de Prometheus (/metrics),
+# sin dependencias: contadores, gauges e histogramas de buckets fijos.
+# Se registran desde el event loop (un solo hilo), así que una observación
+# es una búsqueda bisect y un par de sumas sobre listas, sin locks. Las
+# series de cada métrica se crean al primer uso de sus etiquetas; las
+# etiquetas deben ser de un conjunto acotado (ruta, método, código), nunca
+# texto del usuario. Los valores que ya viven en otros módulos (colas,
+# pool de conexiones) se leen al hacer scrape con gauges de función.
+
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Segundos: consultas y llamadas locales / llamadas a APIs y handlers / LLM
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_registry: dict[str, "_Metric"] = {}
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: se esperaban etiquetas {self.labelnames}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _samples(self):
+        ...
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+# ---------- contador ----------
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_labels(self.labelnames, values)} {_fmt(child.value)}"
+
+
+# ---------- gauge ----------
+class _GaugeChild:
+    __slots__ = ("value", "fn")
+
+    def __init__(self):
+        self.value = 0.0
+        self.fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, fn: Callable[[], float]):
+        # Se evalúa al hacer scrape (p. ej. la profundidad de una cola)
+        self.fn = fn
+
+    def get(self) -> float:
+        if self.fn is None:
+            return self.value
+        try:
+            return float(self.fn())
+        except Exception:
+            return math.nan
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def set_function(self, fn: Callable[[], float]):
+        self._children[()].set_function(fn)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_labels(self.labelnames, values)} {_fmt(child.get())}"
+
+
+# ---------- histograma ----------
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), list(child.counts)):
+                cumulative += n
+                le = f'le="{_fmt(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            base = _labels(self.labelnames, values)
+            yield f"{self.name}_sum{base} {_fmt(child.sum)}"
+            yield f"{self.name}_count{base} {child.count}"
+
+
+# ---------- registro ----------
+def _register(metric: _Metric) -> _Metric:
+    # Idempotente por nombre: un módulo recargado reutiliza la métrica
+    existing = _registry.get(metric.name)
+    if existing is not None:
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f"métrica {metric.name} ya registrada con otra definición")
+        return existing
+    _registry[metric.name] = metric
+    return metric
+
+
+def counter(name: str, doc: str, labelnames: tuple = ()) -> Counter:
+    return _register(Counter(name, doc, labelnames))
+
+
+def gauge(name: str, doc: str, labelnames: tuple = ()) -> Gauge:
+    return _register(Gauge(name, doc, labelnames))
+
+
+def histogram(name: str, doc: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, doc, labelnames, buckets))
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
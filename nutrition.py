@@ -1,5 +1,11 @@
-from dataclasses import dataclass
-from typing import Literal, Dict, Any
+import json, re, unicodedata
+from dataclasses import dataclass, field
+from typing import Literal, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+from foods import Nutrients, estimate_meal
+from recipes import get_catalog
 
 Actividad = Literal["sedentaria","ligera","moderada","alta","muy alta"]
 
@@ -10,6 +16,23 @@ FACTORES = {
     "alta": 1.725,
     "muy alta": 1.9,
 }
+FACTOR_DEFECTO = 1.375
+
+# onboarding guarda sedentario/ligero/moderado/alto/muy_alto (callback act_*);
+# FACTORES usa las etiquetas en femenino. Ambas formas → clave de FACTORES
+ACTIVIDAD_ALIAS = {
+    "sedentario": "sedentaria", "sedentaria": "sedentaria",
+    "ligero": "ligera", "ligera": "ligera",
+    "moderado": "moderada", "moderada": "moderada",
+    "alto": "alta", "alta": "alta",
+    "muy alto": "muy alta", "muy alta": "muy alta",
+}
+
+FACTOR_OBJETIVO = {"perder": 0.85, "mantener": 1.0, "ganar": 1.10}
+
+# Bandas de macros (g por kg de peso)
+PROTE_MIN_G_KG, PROTE_MAX_G_KG, PROTE_TOPE_G = 1.6, 2.2, 180
+GRASA_G_KG, GRASA_MIN_G = 0.8, 40
 
 @dataclass
 class Profile:
@@ -22,27 +45,76 @@ class Profile:
     objetivo: Literal["perder","mantener","ganar"] = "perder"
     alergias: list[str] = None
     vetos: list[str] = None
+    no_gustos: list[str] = None
     equipamiento: list[str] = None
     tiempo_min: int = 20
     pais: str = "ES"
 
+    def restricciones(self) -> list[str]:
+        return [*(self.alergias or []), *(self.vetos or []), *(self.no_gustos or [])]
+
+# Respuestas del onboarding que significan "ninguna restricción"; "__chat__"
+# es la marca del modo chat que main.py guarda en vetos
+NO_RESTRICTION = {"", "no", "ninguna", "ninguno", "nada", "none", "n/a", "-", "__chat__"}
+_SPLIT_RE = re.compile(r"\s*(?:[,;/\n]|\by\b|\be\b|\bo\b)\s*")
+_NEGATION_RE = re.compile(r"^(?:sin|nada de|no)\s+")
+
+def normalizar_restriccion(value) -> str:
+    # "Sin Gluten." → "gluten"; "" si la respuesta significa "ninguna"
+    t = unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode()
+    t = _NEGATION_RE.sub("", " ".join(t.lower().split())).strip(" .")
+    return "" if t in NO_RESTRICTION else t
+
+def _lista(value) -> list[str]:
+    # Campo de texto libre o lista JSON → lista ("gluten y lactosa" → 2)
+    if isinstance(value, list):
+        parts = [str(v) for v in value]
+    elif not value or not normalizar_restriccion(value):
+        return []
+    else:
+        try:
+            v = json.loads(value)
+            parts = [str(x) for x in v] if isinstance(v, list) else None
+        except (TypeError, ValueError):
+            parts = None
+        if parts is None:
+            parts = _SPLIT_RE.split(str(value))
+    return [p.strip() for p in parts if normalizar_restriccion(p)]
+
+def terminos_restriccion(value) -> list[str]:
+    # Misma lista, normalizada: es lo que comparan las cachés (plan_cache, answer_cache)
+    return [normalizar_restriccion(p) for p in _lista(value)]
+
+def normalizar_actividad(actividad: Optional[str]) -> Optional[Actividad]:
+    t = unicodedata.normalize("NFKD", actividad or "").encode("ascii", "ignore").decode()
+    return ACTIVIDAD_ALIAS.get(" ".join(t.lower().replace("_", " ").split()))
+
+def es_masculino(sexo: Optional[str]) -> bool:
+    # "M" o el literal guardado por onboarding ("Masculino")
+    return (sexo or "").strip().upper().startswith("M")
+
 def mifflin_st_jeor(sexo: str, kg: float, cm: int, edad: int) -> float:
-    return 10*kg + 6.25*cm - 5*edad + (5 if sexo.upper()=="M" else -161)
+    return 10*kg + 6.25*cm - 5*edad + (5 if es_masculino(sexo) else -161)
 
 def tdee(bmr: float, actividad: Actividad) -> float:
-    return bmr * FACTORES.get(actividad, 1.375)
+    return bmr * FACTORES.get(normalizar_actividad(actividad), FACTOR_DEFECTO)
 
 def objetivo_kcal(tdee_val: float, objetivo: str) -> float:
-    if objetivo == "perder":
-        return tdee_val * 0.85
-    if objetivo == "ganar":
-        return tdee_val * 1.10
-    return tdee_val
+    return tdee_val * FACTOR_OBJETIVO.get(objetivo, 1.0)
+
+def objetivo_desde_texto(texto: Optional[str]) -> str:
+    # objetivo_detallado es texto libre: se reduce a perder / ganar / mantener
+    t = (texto or "").lower()
+    if re.search(r"perd|adelgaz|bajar|defin|grasa", t):
+        return "perder"
+    if re.search(r"ganar|masa|volumen|m[uú]scul|subir", t):
+        return "ganar"
+    return "mantener"
 
 def calcular_macros(peso_kg: float, kcal_obj: float) -> dict:
     # bandas seguras
-    prote = max(min(2.2*peso_kg, 180), 1.6*peso_kg)
-    grasa = max(0.8*peso_kg, 40)
+    prote = max(min(PROTE_MAX_G_KG*peso_kg, PROTE_TOPE_G), PROTE_MIN_G_KG*peso_kg)
+    grasa = max(GRASA_G_KG*peso_kg, GRASA_MIN_G)
     kcal_prot = prote*4
     kcal_grasa = grasa*9
     carb = max((kcal_obj - kcal_prot - kcal_grasa)/4, 0)
@@ -53,12 +125,141 @@ def calcular_macros(peso_kg: float, kcal_obj: float) -> dict:
         "carbo_g": round(carb)
     }
 
-def plantilla_plan_dia(kcal: int) -> Dict[str, Any]:
-    # Simplificado – luego lo conectaremos a recipes.json
+def profile_from_perfil(perfil: dict) -> Profile:
+    # MenuLog.params["perfil"] (textos del onboarding) → Profile
+    tiempo = re.search(r"\d+", str(perfil.get("tiempo_cocina") or ""))
+    return Profile(
+        nombre=perfil.get("nombre") or "",
+        sexo="M" if es_masculino(perfil.get("sexo")) else "F",
+        edad=perfil.get("edad") or 35,
+        altura_cm=perfil.get("altura_cm") or 170,
+        peso_kg=perfil.get("peso_kg") or 70,
+        actividad=normalizar_actividad(perfil.get("actividad")) or "ligera",
+        objetivo=objetivo_desde_texto(perfil.get("objetivo_detallado")),
+        alergias=_lista(perfil.get("alergias")),
+        vetos=_lista(perfil.get("vetos")),
+        no_gustos=_lista(perfil.get("no_gustos")),
+        equipamiento=_lista(perfil.get("equipamiento")),
+        tiempo_min=int(tiempo.group()) if tiempo else None,
+        pais=perfil.get("pais") or "ES",
+    )
+
+def kcal_profile(p: Profile) -> float:
+    return objetivo_kcal(tdee(mifflin_st_jeor(p.sexo, p.peso_kg, p.altura_cm, p.edad), p.actividad), p.objetivo)
+
+def plantilla_plan_dia(kcal: int, profile: Optional[Profile] = None) -> Dict[str, Any]:
+    # Día montado con el catálogo de recetas (sin LLM) respetando restricciones
+    if profile is None:
+        return get_catalog().plan_day(kcal)
+    return get_catalog().plan_day(kcal, profile.restricciones(), profile.equipamiento or [], profile.tiempo_min)
+
+def plan_semana_catalogo(profile: Profile, semana: int) -> Dict[str, Any]:
+    # Semana completa con el mismo formato que las del LLM ({"semana", "dias"})
+    return get_catalog().plan_week(
+        kcal_profile(profile), semana, profile.restricciones(), profile.equipamiento or [], profile.tiempo_min
+    )
+
+# ---------- cálculo por lotes (NumPy) ----------
+# Mismas fórmulas que mifflin_st_jeor → tdee → objetivo_kcal → calcular_macros,
+# pero sobre columnas enteras. Las etiquetas (sexo, actividad, objetivo) se
+# resuelven una vez por valor distinto, no por fila. Filas con datos
+# numéricos ausentes quedan en NaN.
+def _map_labels(values: Sequence, fn) -> np.ndarray:
+    table = {v: fn(v) for v in set(values)}
+    return np.fromiter(map(table.__getitem__, values), dtype=float, count=len(values))
+
+def _as_float(values: Sequence) -> np.ndarray:
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=float, count=len(values))
+
+def calcular_lote(sexo: Sequence, peso_kg: Sequence, altura_cm: Sequence, edad: Sequence,
+                  actividad: Sequence, objetivo: Sequence) -> dict[str, np.ndarray]:
+    # objetivo: "perder"/"mantener"/"ganar" o el texto libre de objetivo_detallado
+    kg, cm, años = _as_float(peso_kg), _as_float(altura_cm), _as_float(edad)
+    ajuste_sexo = _map_labels(sexo, lambda v: 5 if es_masculino(v) else -161)
+    factor_act = _map_labels(actividad, lambda v: FACTORES.get(normalizar_actividad(v), FACTOR_DEFECTO))
+    factor_obj = _map_labels(
+        objetivo, lambda v: FACTOR_OBJETIVO.get(v if v in FACTOR_OBJETIVO else objetivo_desde_texto(v), 1.0)
+    )
+
+    bmr = 10*kg + 6.25*cm - 5*años + ajuste_sexo
+    tdee_val = bmr * factor_act
+    kcal = tdee_val * factor_obj
+    prote = np.maximum(np.minimum(PROTE_MAX_G_KG*kg, PROTE_TOPE_G), PROTE_MIN_G_KG*kg)
+    grasa = np.maximum(GRASA_G_KG*kg, GRASA_MIN_G)
+    carbo = np.maximum((kcal - prote*4 - grasa*9) / 4, 0)
     return {
-        "desayuno": "Yogur griego + fruta + avena (~400 kcal)",
-        "comida": "Pollo adobado air fryer + patata y calabacín (~700 kcal)",
-        "cena": "Tortilla + ensalada + pan integral (~600 kcal)",
-        "snack": "Fruta o skyr (~200 kcal)",
-        "kcal_approx": kcal
+        "bmr": bmr,
+        "tdee": tdee_val,
+        "kcal": np.round(kcal),
+        "prote_g": np.round(prote),
+        "grasa_g": np.round(grasa),
+        "carbo_g": np.round(carbo),
     }
+
+# ---------- verificación del plan generado ----------
+# Peso de cada desviación en la puntuación del día
+PESOS_DESVIACION = {"kcal": 0.4, "prote_g": 0.3, "grasa_g": 0.15, "carbo_g": 0.15}
+
+def targets_for(u) -> Optional[dict]:
+    # kcal_objetivo/macros guardados; si faltan, se calculan del perfil
+    if u.kcal_objetivo and u.macros:
+        return {"kcal": u.kcal_objetivo, **{k: u.macros[k] for k in ("prote_g", "grasa_g", "carbo_g") if k in u.macros}}
+    if not (u.sexo and u.edad and u.altura_cm and u.peso_kg):
+        return None
+    bmr = mifflin_st_jeor(u.sexo, u.peso_kg, u.altura_cm, u.edad)
+    kcal = objetivo_kcal(tdee(bmr, u.actividad), objetivo_desde_texto(u.objetivo_detallado))
+    return calcular_macros(u.peso_kg, kcal)
+
+@dataclass
+class DayScore:
+    semana: int
+    dia: str
+    total: Nutrients
+    cobertura: float                      # ingredientes reconocidos / total
+    desviacion: dict[str, float]          # (real - objetivo) / objetivo
+    puntuacion: int                       # 0-100
+    sin_identificar: list[str] = field(default_factory=list)
+
+def score_day(semana: int, dia: str, comidas: dict, targets: dict) -> DayScore:
+    total = Nutrients()
+    matched = 0
+    unmatched: list[str] = []
+    for meal in comidas.values():
+        if isinstance(meal, str):
+            comida, cantidad = meal, ""
+        elif isinstance(meal, dict):
+            comida, cantidad = str(meal.get("comida") or ""), str(meal.get("cantidad") or "")
+        else:
+            continue
+        est = estimate_meal(comida, cantidad)
+        total.add(est.nutrients)
+        matched += est.matched
+        unmatched += est.unmatched
+
+    desviacion = {}
+    for k in PESOS_DESVIACION:
+        objetivo = targets.get(k)
+        if objetivo:
+            desviacion[k] = round((getattr(total, k) - objetivo) / objetivo, 3)
+    peso = sum(PESOS_DESVIACION[k] for k in desviacion)
+    error = sum(PESOS_DESVIACION[k] * min(abs(v), 1.0) for k, v in desviacion.items()) / peso if peso else 1.0
+    n = matched + len(unmatched)
+    return DayScore(
+        semana=semana,
+        dia=dia,
+        total=Nutrients(*(round(getattr(total, k), 1) for k in ("kcal", "prote_g", "grasa_g", "carbo_g"))),
+        cobertura=round(matched / n, 3) if n else 0.0,
+        desviacion=desviacion,
+        puntuacion=round(100 * (1 - error)),
+        sin_identificar=unmatched,
+    )
+
+def score_plan(menu_json: dict, targets: dict) -> list[DayScore]:
+    out = []
+    for week in (menu_json or {}).get("semanas") or []:
+        if not isinstance(week, dict):
+            continue
+        for dia, comidas in (week.get("dias") or {}).items():
+            if isinstance(comidas, dict):
+                out.append(score_day(week.get("semana"), dia, comidas, targets))
+    return out
@@ -2,10 +2,12 @@
 
 import json
 import re
-from typing import Optional
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
 
-from db import SessionLocal, User
+from db import User
 from telegram_utils import tg  # limpio, sin import circular
+from update_context import UpdateContext
 
 # ---------- utils de saneo/parse ----------
 NUM_ONLY_RE = re.compile(r"[^\d.,+-]")
@@ -99,6 +101,7 @@ def kb_main_menu():
     return {
         "inline_keyboard": [
             [{"text": "📅 Generar dieta completa", "callback_data": "menu_generate"}],
+            [{"text": "📖 Ver mi dieta", "callback_data": "menu_plan"}],
             [{"text": "🛒 Lista de la compra", "callback_data": "menu_shopping"}],
             [{"text": "ℹ️ Ver mi perfil", "callback_data": "menu_profile"}],
             [{"text": "💬 Chat con coach", "callback_data": "menu_chat"}],
@@ -106,263 +109,182 @@ def kb_main_menu():
         ]
     }
 
-# ---------- helpers de flujo ----------
-async def _profile_complete_message(chat_id: str):
-    await tg(
-        "sendMessage",
-        {
-            "chat_id": chat_id,
-            "text": "🎉 ¡Perfil completo! Ahora puedes usar el menú principal:",
-            "reply_markup": kb_main_menu(),
-        },
-    )
-
-async def _advance_and_ask_next(chat_id: str):
-    # Relee estado y pregunta lo siguiente
-    with SessionLocal() as s:
-        u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-        if not u:
-            return await start_onboarding(chat_id)
-
-        step = u.onboarding_step or 1
-
-        if step == 1 and not u.sexo:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Cuál es tu sexo?", "reply_markup": kb_sexo()})
-        if step == 2 and not u.edad:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Qué edad tienes? (solo número, ej. 35)"})
-        if step == 3 and not u.altura_cm:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Cuál es tu altura en cm? (solo número, ej. 180)"})
-        if step == 4 and not u.peso_kg:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Cuál es tu peso actual en kg? (puede ser decimal, ej. 72.5)"})
-        if step == 5 and not u.actividad:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Qué nivel de actividad tienes?", "reply_markup": kb_actividad()})
-        if step == 6 and not u.objetivo_detallado:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "🎯 ¿Cuál es tu objetivo principal?"})
-        if step == 7 and not u.estilo_dieta:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "🍽️ ¿Qué estilo de cocina prefieres?"})
-        if step == 8 and not u.preferencias:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Qué alimentos prefieres incluir en tu dieta?"})
-        if step == 9 and not u.no_gustos:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Qué alimentos no te gustan o quieres evitar?"})
-        if step == 10 and not u.alergias:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Tienes alguna alergia o intolerancia?"})
-        if step == 11 and not u.vetos:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Hay algún alimento o grupo que quieras vetar por completo?"})
-        if step == 12 and not u.tiempo_cocina:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "⏱️ ¿Cuánto tiempo tienes para cocinar normalmente? (minutos, ej. 30)"})
-        if step == 13 and not u.equipamiento:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "🔧 ¿Qué equipamiento tienes en tu cocina?"})
-        if step == 14 and not u.duracion_plan_semanas:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "¿Cuántas semanas quieres que dure tu plan? (solo número, ej. 4)"})
-        if step == 15 and not u.pais:
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "🌍 ¿En qué país vives?"})
-
-        # Si nada bloquea, perfil listo
+# ---------- parsers por campo ----------
+# Cada parser devuelve el valor a guardar o None si la respuesta no es válida
+def parse_text(value: str) -> Optional[str]:
+    return value or None
+
+def parse_edad(value: str) -> Optional[int]:
+    return parse_int_safe(value, min_v=5, max_v=100)
+
+def parse_altura(value: str) -> Optional[float]:
+    return parse_float_safe(value, min_v=80, max_v=250)  # márgenes amplios
+
+def parse_peso(value: str) -> Optional[float]:
+    return parse_float_safe(value, min_v=20, max_v=400)
+
+def parse_tiempo(value: str) -> Optional[str]:
+    i = parse_int_safe(value, min_v=0, max_v=300)
+    return None if i is None else str(i)  # el modelo lo tiene como String
+
+def parse_semanas(value: str) -> Optional[int]:
+    return parse_int_safe(value, min_v=1, max_v=52)
+
+SEXO_CODES = {"M": "Masculino", "F": "Femenino", "ND": "No decir"}
+
+def parse_sexo(value: str) -> str:
+    # Para completitud si llega por texto en vez de botón
+    val = value.lower()
+    if val.startswith("m"):
+        return "Masculino"
+    if val.startswith("f"):
+        return "Femenino"
+    return "No decir"
+
+def parse_actividad(value: str) -> str:
+    # Para completitud si llega por texto en vez de botón
+    val = value.lower().replace(" ", "_")
+    for o in ("muy_alto", "sedentario", "ligero", "moderado", "alto"):
+        if o in val:
+            return o
+    return "sedentario"
+
+# ---------- máquina de estados ----------
+@dataclass(frozen=True)
+class Step:
+    n: int
+    field: str
+    question: str
+    parse: Callable[[str], Any] = parse_text
+    error: str = "Escribe una respuesta, por favor."
+    keyboard: Optional[Callable[[], dict]] = None
+    # Pasos que también se responden con botones inline
+    callback_prefix: Optional[str] = None
+    from_callback: Optional[Callable[[str], Any]] = None
+    confirm: Optional[Callable[[Any], str]] = None
+
+
+STEPS = [
+    Step(1, "sexo", "¿Cuál es tu sexo?", parse=parse_sexo, keyboard=kb_sexo,
+         callback_prefix="sexo_", from_callback=lambda code: SEXO_CODES.get(code, "No decir"),
+         confirm=lambda v: f"Sexo: {v} ✅"),
+    Step(2, "edad", "¿Qué edad tienes? (solo número, ej. 35)", parse=parse_edad,
+         error="Edad inválida. Escribe solo un número (ej. 35)."),
+    Step(3, "altura_cm", "¿Cuál es tu altura en cm? (solo número, ej. 180)", parse=parse_altura,
+         error="Altura inválida. Introduce solo número en cm (ej. 180)."),
+    Step(4, "peso_kg", "¿Cuál es tu peso actual en kg? (puede ser decimal, ej. 72.5)", parse=parse_peso,
+         error="Peso inválido. Introduce solo número en kg (ej. 72.5)."),
+    # guardamos el literal del botón (sedentario/ligero/moderado/alto/muy_alto)
+    Step(5, "actividad", "¿Qué nivel de actividad tienes?", parse=parse_actividad, keyboard=kb_actividad,
+         callback_prefix="act_", from_callback=lambda act: act,
+         confirm=lambda v: f"Actividad: {v.replace('_', ' ').capitalize()} ✅"),
+    Step(6, "objetivo_detallado", "🎯 ¿Cuál es tu objetivo principal?"),
+    Step(7, "estilo_dieta", "🍽️ ¿Qué estilo de cocina prefieres?"),
+    # texto libre; si algún día haces chips, puedes usar dump_list
+    Step(8, "preferencias", "¿Qué alimentos prefieres incluir en tu dieta?"),
+    Step(9, "no_gustos", "¿Qué alimentos no te gustan o quieres evitar?"),
+    Step(10, "alergias", "¿Tienes alguna alergia o intolerancia?"),
+    Step(11, "vetos", "¿Hay algún alimento o grupo que quieras vetar por completo?"),
+    Step(12, "tiempo_cocina", "⏱️ ¿Cuánto tiempo tienes para cocinar normalmente? (minutos, ej. 30)",
+         parse=parse_tiempo, error="Tiempo inválido. Pon minutos en número (ej. 30)."),
+    Step(13, "equipamiento", "🔧 ¿Qué equipamiento tienes en tu cocina?"),
+    Step(14, "duracion_plan_semanas", "¿Cuántas semanas quieres que dure tu plan? (solo número, ej. 4)",
+         parse=parse_semanas, error="Duración inválida. Pon semanas en número (1–52)."),
+    Step(15, "pais", "🌍 ¿En qué país vives?"),
+]
+
+STEP_BY_N = {st.n: st for st in STEPS}
+STEP_BY_FIELD = {st.field: st for st in STEPS}
+STEP_BY_PREFIX = {st.callback_prefix: st for st in STEPS if st.callback_prefix}
+LAST_STEP = STEPS[-1].n
+
+COMPLETE_TEXT = "🎉 ¡Perfil completo! Ahora puedes usar el menú principal:"
+WELCOME_TEXT = "¡Hola! Soy tu coach nutricional 🤖🥗. Vamos a configurar tu perfil paso a paso.\n\nPrimero: "
+
+
+def current_step(u: User) -> Optional[Step]:
+    return STEP_BY_N.get(u.onboarding_step or 0)
+
+
+def _apply(u: User, step: Step, value: Any):
+    # Guarda el valor y, si respondía al paso en curso, avanza al siguiente
+    setattr(u, step.field, value)
+    if u.onboarding_step == step.n:
+        u.onboarding_step = step.n + 1 if step.n < LAST_STEP else 0
+
+
+def _prompt(u: User, prefix: str = "") -> tuple[str, Optional[dict]]:
+    # Mensaje para el estado actual: pregunta pendiente o cierre del perfil
+    step = current_step(u)
+    if step is None:
         u.onboarding_step = 0
-        s.commit()
+        return prefix + COMPLETE_TEXT, kb_main_menu()
+    return prefix + step.question, step.keyboard() if step.keyboard else None
 
-    await _profile_complete_message(chat_id)
 
-def _bump_step(u: User, max_step: int = 15):
-    if u.onboarding_step and u.onboarding_step < max_step:
-        u.onboarding_step += 1
-    else:
-        u.onboarding_step = 0
+async def _send(ctx: UpdateContext, text: str, reply_markup: Optional[dict] = None):
+    # Cada transición termina aquí: exactamente un mensaje saliente
+    payload = {"chat_id": ctx.chat_id, "text": text}
+    if reply_markup:
+        payload["reply_markup"] = reply_markup
+    return await tg("sendMessage", payload)
 
 # ---------- flujo público ----------
-async def start_onboarding(chat_id: str):
-    with SessionLocal() as s:
-        u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-        if not u:
-            u = User(chat_id=str(chat_id), onboarding_step=1)
-            s.add(u)
-            s.commit()
-    await tg(
-        "sendMessage",
-        {
-            "chat_id": chat_id,
-            "text": "¡Hola! Soy tu coach nutricional 🤖🥗. Vamos a configurar tu perfil paso a paso.\n\nPrimero: ¿Cuál es tu sexo?",
-            "reply_markup": kb_sexo(),
-        },
-    )
-
-async def ask_next(chat_id: str):
-    await _advance_and_ask_next(chat_id)
+async def start_onboarding(ctx: UpdateContext):
+    if not ctx.user:
+        ctx.user = User(chat_id=str(ctx.chat_id), onboarding_step=1)
+        ctx.session.add(ctx.user)
+        await ctx.session.commit()
+    text, markup = _prompt(ctx.user)
+    await _send(ctx, WELCOME_TEXT + text, markup)
+
+async def ask_next(ctx: UpdateContext):
+    # Repite la pregunta pendiente (o el cierre si ya no queda ninguna)
+    if not ctx.user:
+        return await start_onboarding(ctx)
+    text, markup = _prompt(ctx.user)
+    await ctx.session.commit()
+    return await _send(ctx, text, markup)
 
 # Manejo de inline callbacks (sexo, actividad, y posibles confirmaciones)
-async def handle_callback(chat_id: str, data: str):
-    with SessionLocal() as s:
-        u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-        if not u:
-            return await start_onboarding(chat_id)
-
-        if data.startswith("sexo_"):
-            code = data.split("_", 1)[1]
-            mapping = {"M": "Masculino", "F": "Femenino", "ND": "No decir"}
-            u.sexo = mapping.get(code, "No decir")
-            if u.onboarding_step < 2:
-                u.onboarding_step = 2
-            s.commit()
-            await tg("sendMessage", {"chat_id": chat_id, "text": f"Sexo: {u.sexo} ✅"})
-            return await _advance_and_ask_next(chat_id)
-
-        if data.startswith("act_"):
-            act = data.split("_", 1)[1]
-            u.actividad = act  # guardamos el literal (sedentario/ligero/moderado/alto/muy_alto)
-            # si estamos en el paso 5, avanzamos
-            if u.onboarding_step < 6:
-                u.onboarding_step = 6
-            s.commit()
-            pretty = act.replace("_", " ").capitalize()
-            await tg("sendMessage", {"chat_id": chat_id, "text": f"Actividad: {pretty} ✅"})
-            return await _advance_and_ask_next(chat_id)
-
-        # resets u otros
-        if data == "reset_yes":
-            # ejemplo sencillo: poner a 1 y borrar campos principales
-            u.sexo = None
-            u.edad = None
-            u.altura_cm = None
-            u.peso_kg = None
-            u.actividad = None
-            u.objetivo_detallado = None
-            u.estilo_dieta = None
-            u.preferencias = None
-            u.no_gustos = None
-            u.alergias = None
-            u.vetos = None
-            u.tiempo_cocina = None
-            u.equipamiento = None
-            u.duracion_plan_semanas = None
-            u.pais = None
-            u.onboarding_step = 1
-            s.commit()
-            await tg("sendMessage", {"chat_id": chat_id, "text": "✅ Perfil reiniciado. Empezamos de nuevo."})
-            return await _advance_and_ask_next(chat_id)
-
-        if data == "reset_no":
-            return await tg("sendMessage", {"chat_id": chat_id, "text": "Perfecto, mantenemos tu perfil actual."})
+async def handle_callback(ctx: UpdateContext, data: str):
+    u = ctx.user
+    if not u:
+        return await start_onboarding(ctx)
+
+    # reset_yes / reset_no los atiende main._reset
+    prefix, _, code = data.partition("_")
+    step = STEP_BY_PREFIX.get(prefix + "_")
+    if step is None:
+        # Botón que no pertenece al onboarding: se repite la pregunta pendiente
+        return await ask_next(ctx)
+
+    value = step.from_callback(code)
+    _apply(u, step, value)
+    text, markup = _prompt(u, step.confirm(value) + "\n\n")
+    await ctx.session.commit()
+    return await _send(ctx, text, markup)
 
 # Guardado de respuestas de texto con validaciones
-async def save_answer(chat_id: str, field: str, value: str):
-    value = normalize_text(value)
-    with SessionLocal() as s:
-        u = s.query(User).filter(User.chat_id == str(chat_id)).first()
-        if not u:
-            return
-
-        # Validaciones según campo
-        if field == "edad":
-            i = parse_int_safe(value, min_v=5, max_v=100)
-            if i is None:
-                return await tg("sendMessage", {"chat_id": chat_id, "text": "Edad inválida. Escribe solo un número (ej. 35)."})
-            u.edad = i
-            if u.onboarding_step < 3:
-                u.onboarding_step = 3
-
-        elif field == "altura_cm":
-            f = parse_float_safe(value, min_v=80, max_v=250)  # márgenes amplios
-            if f is None:
-                return await tg("sendMessage", {"chat_id": chat_id, "text": "Altura inválida. Introduce solo número en cm (ej. 180)."})
-            u.altura_cm = f
-            if u.onboarding_step < 4:
-                u.onboarding_step = 4
-
-        elif field == "peso_kg":
-            f = parse_float_safe(value, min_v=20, max_v=400)
-            if f is None:
-                return await tg("sendMessage", {"chat_id": chat_id, "text": "Peso inválido. Introduce solo número en kg (ej. 72.5)."})
-            u.peso_kg = f
-            if u.onboarding_step < 5:
-                u.onboarding_step = 5
-
-        elif field == "objetivo_detallado":
-            u.objetivo_detallado = value
-            if u.onboarding_step < 7:
-                u.onboarding_step = 7
-
-        elif field == "estilo_dieta":
-            u.estilo_dieta = value
-            if u.onboarding_step < 8:
-                u.onboarding_step = 8
-
-        elif field == "preferencias":
-            # dejamos texto libre; si algún día haces chips, puedes usar dump_list
-            u.preferencias = value
-            if u.onboarding_step < 9:
-                u.onboarding_step = 9
-
-        elif field == "no_gustos":
-            u.no_gustos = value
-            if u.onboarding_step < 10:
-                u.onboarding_step = 10
-
-        elif field == "alergias":
-            u.alergias = value
-            if u.onboarding_step < 11:
-                u.onboarding_step = 11
-
-        elif field == "vetos":
-            u.vetos = value
-            if u.onboarding_step < 12:
-                u.onboarding_step = 12
-
-        elif field == "tiempo_cocina":
-            i = parse_int_safe(value, min_v=0, max_v=300)
-            if i is None:
-                return await tg("sendMessage", {"chat_id": chat_id, "text": "Tiempo inválido. Pon minutos en número (ej. 30)."})
-            u.tiempo_cocina = str(i)  # tu modelo lo tiene como String
-            if u.onboarding_step < 13:
-                u.onboarding_step = 13
-
-        elif field == "equipamiento":
-            u.equipamiento = value
-            if u.onboarding_step < 14:
-                u.onboarding_step = 14
-
-        elif field == "duracion_plan_semanas":
-            i = parse_int_safe(value, min_v=1, max_v=52)
-            if i is None:
-                return await tg("sendMessage", {"chat_id": chat_id, "text": "Duración inválida. Pon semanas en número (1–52)."})
-            u.duracion_plan_semanas = i
-            if u.onboarding_step < 15:
-                u.onboarding_step = 15
-
-        elif field == "pais":
-            u.pais = value
-            u.onboarding_step = 0  # cierre
-
-        elif field == "sexo":
-            # Para completitud si llega por texto
-            val = value.lower()
-            if val.startswith("m"):
-                u.sexo = "Masculino"
-            elif val.startswith("f"):
-                u.sexo = "Femenino"
-            else:
-                u.sexo = "No decir"
-            if u.onboarding_step < 2:
-                u.onboarding_step = 2
-
-        elif field == "actividad":
-            # Para completitud si llega por texto
-            val = value.lower()
-            opciones = ["sedentario", "ligero", "moderado", "alto", "muy alto", "muy_alto"]
-            matched = None
-            for o in opciones:
-                if o.replace(" ", "_") in val:
-                    matched = o.replace(" ", "_")
-                    break
-            u.actividad = matched or "sedentario"
-            if u.onboarding_step < 6:
-                u.onboarding_step = 6
-
-        else:
-            # Fallback genérico: guardamos como texto
-            setattr(u, field, value)
-            _bump_step(u)
-
-        s.commit()
-
-    # Pregunta el siguiente campo o cierra
-    await _advance_and_ask_next(chat_id)
+async def save_answer(ctx: UpdateContext, field: str, value: str):
+    u = ctx.user
+    if not u:
+        return
+    step = STEP_BY_FIELD[field]
+    parsed = step.parse(normalize_text(value))
+    if parsed is None:
+        return await _send(ctx, step.error)
+
+    _apply(u, step, parsed)
+    text, markup = _prompt(u)
+    await ctx.session.commit()
+    return await _send(ctx, text, markup)
+
+async def handle_onboarding(ctx: UpdateContext, text: str, is_callback: bool):
+    # Punto de entrada desde main.py para usuarios con onboarding en curso
+    if is_callback:
+        return await handle_callback(ctx, text)
+    step = current_step(ctx.user)
+    if step is None:
+        return await ask_next(ctx)
+    return await save_answer(ctx, step.field, text)
@@ -0,0 +1,227 @@
+# plan_cache.py
+#
+# Caché de semanas de plan por huella de perfil. Muchos usuarios comparten
+# sexo, franja de edad/peso/altura, actividad, estilo y país: la semana k
+# generada para uno sirve para el resto sin volver a llamar a OpenAI.
+# Dos niveles: memoria (LRU + TTL) y la tabla plan_cache.
+#
+# Alergias, vetos y no_gustos forman parte de la huella (conjunto normalizado)
+# y, además, una semana nunca se sirve ni se guarda si menciona alguno.
+# Preferencias y equipamiento entran como conjunto normalizado y el tiempo
+# de cocina por franjas: todo lo que lleva el prompt del plan está en la huella.
+
+import os, time, json, hashlib, re, unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+import logs
+from db import AsyncSessionLocal, PlanCacheEntry
+from nutrition import objetivo_desde_texto, terminos_restriccion
+from recipes import equipment_of
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", str(14 * 24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "2000"))
+# Anchura de las franjas de la huella
+PLAN_CACHE_AGE_BAND = int(os.getenv("PLAN_CACHE_AGE_BAND", "5"))
+PLAN_CACHE_WEIGHT_BAND = float(os.getenv("PLAN_CACHE_WEIGHT_BAND", "5"))
+PLAN_CACHE_HEIGHT_BAND = float(os.getenv("PLAN_CACHE_HEIGHT_BAND", "5"))
+PLAN_CACHE_COOK_TIME_BAND = float(os.getenv("PLAN_CACHE_COOK_TIME_BAND", "15"))
+
+RESTRICTION_FIELDS = ("alergias", "vetos", "no_gustos")
+
+
+# ---------- normalización ----------
+def _norm(value) -> str:
+    text = unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode()
+    return " ".join(text.lower().split())
+
+
+def _band(value, width: float) -> Optional[int]:
+    try:
+        return int(float(value) // width * width)
+    except (TypeError, ValueError):
+        return None
+
+
+def restriction_terms(perfil: dict) -> list[str]:
+    # Misma normalización que la exclusión de recetas (nutrition._lista)
+    terms = set()
+    for field in RESTRICTION_FIELDS:
+        terms.update(terminos_restriccion(perfil.get(field)))
+    return sorted(terms)
+
+
+def equipment_terms(perfil: dict) -> list[str]:
+    # Equipamiento conocido → el de las recetas ("vitro" = "placa"); el resto, tal cual
+    terms = set()
+    for item in terminos_restriccion(perfil.get("equipamiento")):
+        terms.update(equipment_of([item]) or {item})
+    return sorted(terms)
+
+
+def cook_time_band(perfil: dict) -> Optional[int]:
+    # "30 min", "unos 30" → minutos por franjas; sin número, sin franja
+    minutes = re.search(r"\d+", str(perfil.get("tiempo_cocina") or ""))
+    return _band(minutes.group(), PLAN_CACHE_COOK_TIME_BAND) if minutes else None
+
+
+def fingerprint(perfil: dict) -> str:
+    # Huella estable de los campos de MenuLog.params["perfil"] que cambian el plan
+    key = {
+        "sexo": _norm(perfil.get("sexo")),
+        "edad": _band(perfil.get("edad"), PLAN_CACHE_AGE_BAND),
+        "peso": _band(perfil.get("peso_kg"), PLAN_CACHE_WEIGHT_BAND),
+        "altura": _band(perfil.get("altura_cm"), PLAN_CACHE_HEIGHT_BAND),
+        "actividad": _norm(perfil.get("actividad")).replace(" ", "_"),
+        "objetivo": objetivo_desde_texto(_norm(perfil.get("objetivo_detallado"))),
+        "estilo": _norm(perfil.get("estilo_dieta")),
+        "pais": _norm(perfil.get("pais")),
+        "preferencias": sorted(set(terminos_restriccion(perfil.get("preferencias")))),
+        "equipamiento": equipment_terms(perfil),
+        "tiempo_cocina": cook_time_band(perfil),
+        "restricciones": restriction_terms(perfil),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def violates(week: dict, terms: list[str]) -> Optional[str]:
+    # Primer término restringido que aparece en la semana (singular o plural)
+    if not terms:
+        return None
+    text = _norm(json.dumps(week, ensure_ascii=False))
+    for term in terms:
+        if re.search(rf"\b{re.escape(term)}(?:s|es)?\b", text):
+            return term
+    return None
+
+
+# ---------- nivel en memoria ----------
+class PlanCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, int], tuple[float, dict]] = OrderedDict()
+        self.hits_memory = 0
+        self.hits_db = 0
+        self.misses = 0
+        self.rejected = 0
+        self.stores = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: tuple[str, int], now: Optional[float] = None) -> Optional[dict]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        ts, data = item
+        if (now or time.monotonic()) - ts > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: tuple[str, int], data: dict, now: Optional[float] = None):
+        self._entries[key] = (now or time.monotonic(), data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: tuple[str, int]):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_db
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits_memory": self.hits_memory,
+            "hits_db": self.hits_db,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "stores": self.stores,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "llm_calls_saved": hits,
+        }
+
+
+cache = PlanCache(PLAN_CACHE_TTL_SECONDS, PLAN_CACHE_MAX_ENTRIES)
+
+
+# ---------- API ----------
+async def lookup(perfil: dict, semana: int) -> Optional[dict]:
+    if not PLAN_CACHE_ENABLED:
+        return None
+    key = (fingerprint(perfil), semana)
+    terms = restriction_terms(perfil)
+
+    data = cache.get(key)
+    if data is not None:
+        if violates(data, terms) is None:
+            cache.hits_memory += 1
+            return data
+        cache.discard(key)
+        cache.rejected += 1
+
+    cutoff = datetime.utcnow() - timedelta(seconds=PLAN_CACHE_TTL_SECONDS)
+    async with AsyncSessionLocal() as s:
+        row = (await s.execute(
+            select(PlanCacheEntry)
+            .where(PlanCacheEntry.fingerprint == key[0], PlanCacheEntry.semana == semana)
+            .where(PlanCacheEntry.created_at >= cutoff)
+        )).scalars().first()
+        if row is not None and violates(row.data, terms) is None:
+            await s.execute(
+                update(PlanCacheEntry)
+                .where(PlanCacheEntry.id == row.id)
+                .values(hits=PlanCacheEntry.hits + 1)
+                .execution_options(synchronize_session=False)
+            )
+            await s.commit()
+            cache.put(key, row.data)
+            cache.hits_db += 1
+            return row.data
+        if row is not None:
+            cache.rejected += 1
+
+    cache.misses += 1
+    return None
+
+
+async def store(perfil: dict, semana: int, data: dict) -> bool:
+    # Guarda una semana recién generada; False si no se cachea
+    if not PLAN_CACHE_ENABLED:
+        return False
+    term = violates(data, restriction_terms(perfil))
+    if term is not None:
+        logs.warn("plan_cache_restriction_hit", semana=semana, term=term)
+        return False
+    key = (fingerprint(perfil), semana)
+    cache.put(key, data)
+    async with AsyncSessionLocal() as s:
+        existing = (await s.execute(
+            select(PlanCacheEntry)
+            .where(PlanCacheEntry.fingerprint == key[0], PlanCacheEntry.semana == semana)
+        )).scalars().first()
+        if existing is not None:
+            existing.data = data
+            existing.created_at = datetime.utcnow()
+            existing.hits = 0
+        else:
+            s.add(PlanCacheEntry(fingerprint=key[0], semana=semana, data=data))
+        try:
+            await s.commit()
+        except IntegrityError:
+            # Otro worker guardó la misma huella a la vez: vale cualquiera
+            await s.rollback()
+    cache.stores += 1
+    return True
+
+
+def stats() -> dict:
+    return {"enabled": PLAN_CACHE_ENABLED, **cache.stats()}
@@ -0,0 +1,332 @@
+# plan_generation.py
+#
+# Generación del plan semana a semana. La semana 1 se genera en cuanto el
+# usuario lo pide (con progreso en Telegram); el resto se genera en segundo
+# plano con concurrencia acotada, o bajo demanda cuando avanza semana_actual.
+# Cada semana se guarda en plan_weeks y MenuLog.menu_json se reensambla con
+# las semanas listas.
+
+import os, asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select, update, or_, and_
+
+import logs
+import metrics
+import nutrition
+import plan_cache
+from db import AsyncSessionLocal, MenuLog, PlanWeek, User
+from llm import stream_chat_completion
+from plan_parser import PlanStreamTracker, parse_week
+from plans import set_active_plan
+
+PLAN_WEEK_CONCURRENCY = int(os.getenv("PLAN_WEEK_CONCURRENCY", "2"))
+# Semanas que se adelantan en segundo plano por delante de semana_actual
+PLAN_PREFETCH_WEEKS = int(os.getenv("PLAN_PREFETCH_WEEKS", "2"))
+# Una semana "generating" más antigua que esto se considera abandonada
+PLAN_GENERATING_TIMEOUT = float(os.getenv("PLAN_GENERATING_TIMEOUT", "600"))
+# Si OpenAI falla (caído, saturado o respuesta ilegible), la semana se monta
+# con el catálogo de recetas en lugar de quedar en "failed"
+PLAN_FALLBACK_ENABLED = os.getenv("PLAN_FALLBACK_ENABLED", "1") == "1"
+
+PLAN_WEEKS = metrics.counter(
+    "plan_weeks_total", "Semanas de plan terminadas por origen (cache | llm | catalogo | failed)", ("source",))
+PLAN_BACKGROUND = metrics.gauge("plan_background_tasks", "Semanas programadas o generándose en segundo plano")
+
+WEEK_SYSTEM_PROMPT = (
+    "Eres un nutricionista experto. "
+    "Debes responder ÚNICAMENTE con un JSON válido, sin texto adicional. "
+    "Genera SOLO la semana indicada. Formato esperado:\n\n"
+    "{\n"
+    '  "semana": <int>,\n'
+    '  "dias": { "lunes": { "desayuno": {"comida":..., "cantidad":...}, ... }, ..., "domingo": {...} }\n'
+    "}"
+)
+
+ProgressCallback = Callable[[PlanStreamTracker], Awaitable[object]]
+
+
+# ---------- perfil ----------
+def profile_params(u: User) -> dict:
+    return {
+        "sexo": u.sexo,
+        "edad": u.edad,
+        "altura_cm": u.altura_cm,
+        "peso_kg": u.peso_kg,
+        "actividad": u.actividad,
+        "objetivo_detallado": u.objetivo_detallado,
+        "estilo_dieta": u.estilo_dieta,
+        "preferencias": u.preferencias,
+        "equipamiento": u.equipamiento,
+        "duracion_plan_semanas": u.duracion_plan_semanas,
+        "pais": u.pais,
+        "alergias": u.alergias,
+        "vetos": None if u.vetos == "__chat__" else u.vetos,
+        "no_gustos": u.no_gustos,
+        "tiempo_cocina": u.tiempo_cocina,
+    }
+
+
+def profile_text(perfil: dict) -> str:
+    return f"""
+Sexo: {perfil.get("sexo")}
+Edad: {perfil.get("edad")}
+Altura: {perfil.get("altura_cm")} cm
+Peso: {perfil.get("peso_kg")} kg
+Actividad: {perfil.get("actividad")}
+Objetivos: {perfil.get("objetivo_detallado")}
+Estilos: {perfil.get("estilo_dieta")}
+Prefiere incluir: {perfil.get("preferencias")}
+Equipamiento: {perfil.get("equipamiento")}
+Tiempo para cocinar: {perfil.get("tiempo_cocina")}
+Semanas plan: {perfil.get("duracion_plan_semanas")}
+País: {perfil.get("pais")}
+Alergias: {perfil.get("alergias")}
+Vetos: {perfil.get("vetos")}
+No le gustan: {perfil.get("no_gustos")}
+"""
+
+
+def week_messages(perfil: dict, semana: int, total: int) -> list[dict]:
+    # Cada semana se pide de forma independiente (sin depender de la anterior)
+    # para poder generarlas en paralelo
+    return [
+        {"role": "system", "content": WEEK_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Genera la semana {semana} de {total} de una dieta en JSON según este perfil:\n"
+                f"{profile_text(perfil)}\n"
+                f"No incluyas NUNCA alimentos de alergias, vetos ni 'no le gustan'.\n"
+                f"Varía los platos respecto a otras semanas (usa el número de semana {semana} como referencia)."
+            ),
+        },
+    ]
+
+
+# ---------- estado en base de datos ----------
+async def create_plan(s, u: User) -> MenuLog:
+    total = u.duracion_plan_semanas or 1
+    log = MenuLog(
+        chat_id=str(u.chat_id),
+        params={"perfil": profile_params(u)},
+        menu_json={"duracion_semanas": total, "semanas": []},
+        timestamp=datetime.utcnow(),
+    )
+    s.add(log)
+    await s.flush()
+    s.add_all([PlanWeek(menu_log_id=log.id, semana=k, status="pending") for k in range(1, total + 1)])
+    set_active_plan(u, log)
+    u.semana_actual = 1
+    await s.commit()
+    return log
+
+
+def _claimable():
+    # Semanas que se pueden (re)generar: pendientes, fallidas o "generating"
+    # abandonadas (el proceso que las tenía murió sin terminarlas)
+    stale = datetime.utcnow() - timedelta(seconds=PLAN_GENERATING_TIMEOUT)
+    return or_(
+        PlanWeek.status.in_(("pending", "failed")),
+        and_(PlanWeek.status == "generating", PlanWeek.updated_at < stale),
+    )
+
+
+async def _claim_week(log_id: int, semana: int) -> bool:
+    # Pasa la semana a "generating" solo si nadie la está generando ya
+    async with AsyncSessionLocal() as s:
+        result = await s.execute(
+            update(PlanWeek)
+            .where(PlanWeek.menu_log_id == log_id, PlanWeek.semana == semana)
+            .where(_claimable())
+            .values(status="generating", updated_at=datetime.utcnow(), error=None)
+            .execution_options(synchronize_session=False)
+        )
+        await s.commit()
+    return result.rowcount == 1
+
+
+async def _finish_week(log_id: int, semana: int, data: Optional[dict], error: Optional[str] = None):
+    async with AsyncSessionLocal() as s:
+        await s.execute(
+            update(PlanWeek)
+            .where(PlanWeek.menu_log_id == log_id, PlanWeek.semana == semana)
+            .values(
+                status="ready" if data is not None else "failed",
+                data=data,
+                error=error,
+                updated_at=datetime.utcnow(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await s.commit()
+    if data is not None:
+        await assemble(log_id)
+
+
+_assemble_locks = [asyncio.Lock() for _ in range(64)]
+
+
+async def assemble(log_id: int):
+    # Reconstruye MenuLog.menu_json desde las semanas listas (fuente de verdad:
+    # plan_weeks). Serializado por plan para no pisar semanas concurrentes.
+    async with _assemble_locks[log_id % len(_assemble_locks)]:
+        async with AsyncSessionLocal() as s:
+            log = await s.get(MenuLog, log_id)
+            if log is None:
+                return
+            weeks = (await s.execute(
+                select(PlanWeek.data)
+                .where(PlanWeek.menu_log_id == log_id, PlanWeek.status == "ready")
+                .order_by(PlanWeek.semana)
+            )).scalars().all()
+            previous = log.menu_json or {}
+            total = previous.get("duracion_semanas") or len(weeks)
+            # "version" cambia con cada reensamblado: clave de las cachés por plan
+            log.menu_json = {
+                "duracion_semanas": total,
+                "semanas": list(weeks),
+                "version": previous.get("version", 0) + 1,
+            }
+            await s.commit()
+
+
+async def plan_status(s, log: MenuLog) -> dict:
+    rows = (await s.execute(
+        select(PlanWeek.semana, PlanWeek.status)
+        .where(PlanWeek.menu_log_id == log.id)
+        .order_by(PlanWeek.semana)
+    )).all()
+    return {
+        "menu_log_id": log.id,
+        "duracion_semanas": (log.menu_json or {}).get("duracion_semanas"),
+        "weeks": [{"semana": k, "status": st} for k, st in rows],
+        "ready": [k for k, st in rows if st == "ready"],
+    }
+
+# ---------- generación ----------
+async def _release_week(log_id: int, semana: int):
+    # Devuelve a "pending" una semana que se dejó de generar a medias
+    async with AsyncSessionLocal() as s:
+        await s.execute(
+            update(PlanWeek)
+            .where(PlanWeek.menu_log_id == log_id, PlanWeek.semana == semana, PlanWeek.status == "generating")
+            .values(status="pending", updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await s.commit()
+
+
+async def generate_week(log_id: int, semana: int, on_progress: Optional[ProgressCallback] = None) -> Optional[dict]:
+    # Devuelve la semana generada, o None si ya la estaba generando otro
+    if not await _claim_week(log_id, semana):
+        return None
+    try:
+        return await _generate_claimed(log_id, semana, on_progress)
+    except asyncio.CancelledError:
+        # shutdown() cancela las tareas de fondo: CancelledError no es una
+        # Exception y la semana se quedaría en "generating"
+        await _release_week(log_id, semana)
+        raise
+
+
+async def _generate_claimed(log_id: int, semana: int, on_progress: Optional[ProgressCallback]) -> dict:
+    async with AsyncSessionLocal() as s:
+        log = await s.get(MenuLog, log_id)
+        perfil = (log.params or {}).get("perfil", {})
+        total = (log.menu_json or {}).get("duracion_semanas") or 1
+
+    cached = await plan_cache.lookup(perfil, semana)
+    if cached is not None:
+        week = {"semana": semana, "dias": cached["dias"]}
+        await _finish_week(log_id, semana, week)
+        PLAN_WEEKS.labels("cache").inc()
+        return week
+
+    tracker = PlanStreamTracker()
+    chunks = []
+    try:
+        async for delta in stream_chat_completion(week_messages(perfil, semana, total)):
+            chunks.append(delta)
+            if tracker.feed(delta) and on_progress is not None:
+                await on_progress(tracker)
+        week = parse_week("".join(chunks).strip(), semana)
+    except Exception as e:
+        if PLAN_FALLBACK_ENABLED:
+            logs.warn("plan_week_fallback", e, menu_log_id=log_id, semana=semana)
+            week = {**nutrition.plan_semana_catalogo(nutrition.profile_from_perfil(perfil), semana), "origen": "catalogo"}
+            # Sin plan_cache.store: la próxima vez se vuelve a intentar con el LLM
+            await _finish_week(log_id, semana, week)
+            PLAN_WEEKS.labels("catalogo").inc()
+            return week
+        await _finish_week(log_id, semana, None, f"{type(e).__name__}: {e}"[:500])
+        PLAN_WEEKS.labels("failed").inc()
+        raise
+    await _finish_week(log_id, semana, week)
+    PLAN_WEEKS.labels("llm").inc()
+    await plan_cache.store(perfil, semana, week)
+    return week
+
+
+_background: set[asyncio.Task] = set()
+_week_sem: Optional[asyncio.Semaphore] = None
+PLAN_BACKGROUND.set_function(lambda: len(_background))
+
+
+def _semaphore() -> asyncio.Semaphore:
+    global _week_sem
+    if _week_sem is None:
+        _week_sem = asyncio.Semaphore(PLAN_WEEK_CONCURRENCY)
+    return _week_sem
+
+
+async def _generate_bounded(log_id: int, semana: int):
+    async with _semaphore():
+        try:
+            await generate_week(log_id, semana)
+        except Exception as e:
+            logs.warn("plan_week_failed", e, menu_log_id=log_id, semana=semana)
+
+
+def schedule_weeks(log_id: int, semanas: list[int]):
+    # Semanas independientes entre sí: en paralelo, acotadas por el semáforo
+    for k in semanas:
+        task = asyncio.create_task(_generate_bounded(log_id, k))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+
+async def ensure_upcoming(log_id: int, semana_actual: int):
+    # Programa las semanas pendientes (o abandonadas a medias) desde
+    # semana_actual hasta el prefetch
+    upto = semana_actual + PLAN_PREFETCH_WEEKS
+    async with AsyncSessionLocal() as s:
+        pending = (await s.execute(
+            select(PlanWeek.semana)
+            .where(PlanWeek.menu_log_id == log_id)
+            .where(PlanWeek.semana >= semana_actual, PlanWeek.semana <= upto)
+            .where(_claimable())
+            .order_by(PlanWeek.semana)
+        )).scalars().all()
+    schedule_weeks(log_id, list(pending))
+
+
+async def sync_current_week(s, u: User):
+    # semana_actual avanza con el calendario desde la fecha del plan activo;
+    # al cambiar, se adelanta la generación de las semanas siguientes
+    activo = u.menu_activo or {}
+    if not activo.get("menu_log_id") or not activo.get("timestamp"):
+        return
+    started = datetime.fromisoformat(activo["timestamp"])
+    semana = min((datetime.utcnow() - started).days // 7 + 1, u.duracion_plan_semanas or 1)
+    if semana != (u.semana_actual or 1):
+        u.semana_actual = semana
+        await s.commit()
+        await ensure_upcoming(activo["menu_log_id"], semana)
+
+
+async def shutdown():
+    for task in list(_background):
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
@@ -0,0 +1,407 @@
+# plan_parser.py
+#
+# Lectura de los planes JSON que devuelve el LLM: extracción en una pasada
+# (llaves balanceadas, respetando strings), validación contra el esquema
+# semanas → días → comidas {comida, cantidad} y reparación de salidas
+# truncadas conservando los días completos.
+
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+
+# ---------- progreso incremental del stream ----------
+class PlanStreamTracker:
+    # Recorre el JSON a medida que llega (un solo paso, sin re-parsear) y
+    # cuenta los días y semanas ya cerrados dentro de "semanas" → "dias".
+    def __init__(self):
+        self.weeks_done = 0
+        self.days_done = 0
+        self.current_week: Optional[int] = None
+        self.chars = 0
+        # pila de contenedores abiertos: (tipo "{" / "[", clave bajo la que cuelga)
+        self._stack: list[tuple[str, Optional[str]]] = []
+        self._in_string = False
+        self._escape = False
+        self._buf: list[str] = []
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._last_string: Optional[str] = None
+        self._after_semana_key = False
+        self._number: list[str] = []
+
+    def feed(self, chunk: str) -> bool:
+        # Devuelve True si se ha cerrado algún día o semana en este trozo
+        before = (self.days_done, self.weeks_done)
+        self.chars += len(chunk)
+        for ch in chunk:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._buf.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = "".join(self._buf)
+                else:
+                    self._buf.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._buf = []
+            elif ch == ":":
+                if self._expect_key:
+                    self._key = self._last_string
+                    self._expect_key = False
+                    self._after_semana_key = self._key == "semana"
+                    self._number = []
+            elif ch in "{[":
+                parent_key = self._key if self._stack and self._stack[-1][0] == "{" else self._parent_key()
+                self._stack.append((ch, parent_key))
+                self._expect_key = ch == "{"
+                self._key = None
+            elif ch in "}]":
+                self._close_number()
+                if self._stack:
+                    kind, key = self._stack.pop()
+                    self._on_close(kind, key)
+                self._expect_key = False
+            elif ch == ",":
+                self._close_number()
+                self._expect_key = bool(self._stack) and self._stack[-1][0] == "{"
+            elif self._after_semana_key and ch.isdigit():
+                self._number.append(ch)
+        return (self.days_done, self.weeks_done) != before
+
+    def _parent_key(self) -> Optional[str]:
+        # Elementos de un array heredan la clave del array ("semanas")
+        return self._stack[-1][1] if self._stack else None
+
+    def _close_number(self):
+        if self._after_semana_key and self._number:
+            self.current_week = int("".join(self._number))
+        self._after_semana_key = False
+        self._number = []
+
+    def _on_close(self, kind: str, key: Optional[str]):
+        if kind != "{" or not self._stack:
+            return
+        parent_kind, parent_key = self._stack[-1]
+        if parent_kind == "{" and parent_key == "dias":
+            self.days_done += 1
+        elif parent_kind == "[" and parent_key == "semanas":
+            self.weeks_done += 1
+
+
+# ---------- esquema ----------
+class PlanParseError(ValueError):
+    """La salida del LLM no contiene ningún día válido."""
+
+
+DAY_NAMES = {
+    "lunes": "lunes", "martes": "martes", "miercoles": "miércoles", "miércoles": "miércoles",
+    "jueves": "jueves", "viernes": "viernes", "sabado": "sábado", "sábado": "sábado",
+    "domingo": "domingo",
+}
+
+
+@dataclass
+class Meal:
+    comida: str
+    cantidad: str = ""
+    extra: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {"comida": self.comida, "cantidad": self.cantidad, **self.extra}
+
+
+@dataclass
+class Day:
+    nombre: str
+    comidas: dict[str, Meal]
+
+
+@dataclass
+class Week:
+    semana: int
+    dias: list[Day]
+
+    def to_dict(self) -> dict:
+        return {
+            "semana": self.semana,
+            "dias": {d.nombre: {k: m.to_dict() for k, m in d.comidas.items()} for d in self.dias},
+        }
+
+
+@dataclass
+class Plan:
+    semanas: list[Week]
+    duracion_semanas: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "duracion_semanas": self.duracion_semanas or len(self.semanas),
+            "semanas": [w.to_dict() for w in self.semanas],
+        }
+
+
+@dataclass
+class ParseResult:
+    plan: Optional[Plan]
+    repaired: bool = False
+    issues: list[str] = field(default_factory=list)
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, bool) or value is None:
+        return ""
+    if isinstance(value, (int, float)):
+        return f"{value:g}"
+    return str(value).strip() if isinstance(value, str) else ""
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _meal(raw: Any) -> Optional[Meal]:
+    if isinstance(raw, str):
+        return Meal(comida=raw.strip()) if raw.strip() else None
+    if isinstance(raw, list):
+        items = [m for m in map(_meal, raw) if m is not None]
+        if not items:
+            return None
+        return Meal(
+            comida=" + ".join(m.comida for m in items),
+            cantidad="; ".join(m.cantidad for m in items if m.cantidad),
+        )
+    if not isinstance(raw, dict):
+        return None
+    comida = _text(raw.get("comida") or raw.get("plato") or raw.get("nombre"))
+    if not comida:
+        return None
+    extra = {
+        k: v for k, v in raw.items()
+        if k not in ("comida", "plato", "nombre", "cantidad") and isinstance(v, (str, int, float))
+    }
+    return Meal(comida=comida, cantidad=_text(raw.get("cantidad")), extra=extra)
+
+
+def _day(name: str, raw: Any, issues: list[str]) -> Optional[Day]:
+    if isinstance(raw, dict) and isinstance(raw.get("comidas"), dict):
+        raw = raw["comidas"]
+    if not isinstance(raw, dict):
+        issues.append(f"día {name}: no es un objeto")
+        return None
+    comidas = {}
+    for tipo, value in raw.items():
+        if tipo == "dia":
+            continue
+        meal = _meal(value)
+        if meal is None:
+            issues.append(f"día {name}: comida '{tipo}' inválida")
+        else:
+            comidas[str(tipo).strip().lower()] = meal
+    if not comidas:
+        issues.append(f"día {name}: sin comidas")
+        return None
+    key = str(name).strip().lower()
+    return Day(nombre=DAY_NAMES.get(key, key), comidas=comidas)
+
+
+def _week(raw: Any, default_n: int, issues: list[str]) -> Optional[Week]:
+    if not isinstance(raw, dict):
+        return None
+    dias_raw = raw.get("dias")
+    if dias_raw is None and any(str(k).lower() in DAY_NAMES for k in raw):
+        dias_raw = {k: v for k, v in raw.items() if str(k).lower() in DAY_NAMES}
+    if isinstance(dias_raw, list):
+        # [{"dia": "lunes", ...}] → {"lunes": {...}}
+        dias_raw = {
+            _text(d.get("dia")) or f"dia {i + 1}": d
+            for i, d in enumerate(dias_raw) if isinstance(d, dict)
+        }
+    if not isinstance(dias_raw, dict):
+        issues.append(f"semana {default_n}: sin días")
+        return None
+    dias = [d for name, value in dias_raw.items() if (d := _day(name, value, issues)) is not None]
+    if not dias:
+        return None
+    return Week(semana=_int(raw.get("semana")) or default_n, dias=dias)
+
+
+def coerce_plan(obj: Any, issues: Optional[list[str]] = None) -> Optional[Plan]:
+    # Acepta {"semanas": [...]}, una semana {"semana", "dias"} o solo los días
+    issues = [] if issues is None else issues
+    if not isinstance(obj, dict):
+        return None
+    raw_weeks = obj.get("semanas")
+    if isinstance(raw_weeks, list):
+        weeks = [w for i, raw in enumerate(raw_weeks) if (w := _week(raw, i + 1, issues)) is not None]
+    else:
+        week = _week(obj, 1, issues)
+        weeks = [week] if week else []
+    if not weeks:
+        return None
+    return Plan(semanas=weeks, duracion_semanas=_int(obj.get("duracion_semanas")))
+
+
+# ---------- extracción ----------
+MAX_CANDIDATES = 8
+# Un plan no pasa de ~6 niveles; más profundidad es basura (y json.loads
+# recursivo podría desbordar la pila)
+MAX_DEPTH = 32
+_CLOSERS = {"{": "}", "[": "]"}
+_STRING_STOP = re.compile(r'["\\\\]')
+
+
+@dataclass
+class _Scan:
+    parts: list[str]    # JSON saneado (sin comas colgantes), por trozos
+    complete: bool      # el objeto raíz se cerró
+    end: int            # posición en el texto original donde terminó el escaneo
+    # cortes seguros para reparar: (nº de trozos, pila abierta, cierra un día)
+    cuts: list[tuple[int, tuple[str, ...], bool]]
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def _scan(raw: str, start: int) -> _Scan:
+    # Una sola pasada desde raw[start] == "{": sigue strings y escapes, quita
+    # comas colgantes y apunta dónde se podría cortar si la salida se trunca
+    out: list[str] = []
+    stack: list[tuple[str, Optional[str]]] = []
+    cuts: list[tuple[int, tuple[str, ...], bool]] = []
+    expect_key = False
+    last_string: Optional[str] = None
+    key: Optional[str] = None
+
+    i = start
+    n = len(raw)
+    while i < n:
+        ch = raw[i]
+        i += 1
+        if ch == '"':
+            # El contenido del string se salta con una búsqueda (no carácter a
+            # carácter): solo importan las comillas y los escapes
+            parts = []
+            while True:
+                m = _STRING_STOP.search(raw, i)
+                if m is None:
+                    out.append('"' + "".join(parts) + raw[i:])
+                    return _Scan(out, False, n, cuts)
+                parts.append(raw[i:m.start()])
+                if m.group() == '"':
+                    i = m.end()
+                    break
+                parts.append(raw[m.start():m.start() + 2])
+                i = m.start() + 2
+            last_string = "".join(parts)
+            out.append('"' + last_string + '"')
+            continue
+        elif ch == ":":
+            if expect_key:
+                key, expect_key = last_string, False
+        elif ch in "{[":
+            parent = key if stack and stack[-1][0] == "{" else (stack[-1][1] if stack else None)
+            stack.append((ch, parent))
+            if len(stack) > MAX_DEPTH:
+                return _Scan(out, False, i, [])
+            expect_key, key = ch == "{", None
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack or _CLOSERS[stack[-1][0]] != ch:
+                # cierre que no corresponde: se trata como truncado aquí
+                return _Scan(out, False, i - 1, cuts)
+            kind, _ = stack.pop()
+            out.append(ch)
+            if not stack:
+                return _Scan(out, True, i, cuts)
+            closes_day = kind == "{" and stack[-1][1] == "dias"
+            cuts.append((len(out), tuple(k for k, _ in stack), closes_day))
+            expect_key = False
+            continue
+        elif ch == ",":
+            expect_key = stack[-1][0] == "{"
+        out.append(ch)
+    return _Scan(out, False, n, cuts)
+
+
+def _loads(text: str) -> Any:
+    try:
+        return json.loads(text, strict=False)
+    except RecursionError as e:
+        raise ValueError("JSON demasiado anidado") from e
+
+
+def _repair(scan: _Scan) -> Optional[Any]:
+    # Corta en el último día cerrado (o, si no hay, en el último objeto
+    # cerrado) y cierra los contenedores que quedaban abiertos
+    day_cuts = [c for c in scan.cuts if c[2]]
+    for length, stack, _ in reversed((day_cuts or scan.cuts)[-3:]):
+        try:
+            return _loads("".join(scan.parts[:length]) + "".join(_CLOSERS[k] for k in reversed(stack)))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_plan(raw_text: str) -> ParseResult:
+    # Primer objeto JSON del texto que encaje con el esquema del plan
+    issues: list[str] = []
+    raw_text = raw_text or ""
+    pos = raw_text.find("{")
+    # Caso habitual (JSON correcto, quizá con prosa o ```json alrededor):
+    # del primer "{" al último "}" sin escanear
+    last = raw_text.rfind("}")
+    if 0 <= pos < last:
+        try:
+            plan = coerce_plan(_loads(raw_text[pos:last + 1]))
+        except ValueError:
+            plan = None
+        if plan is not None:
+            return ParseResult(plan)
+    for _ in range(MAX_CANDIDATES):
+        if pos < 0:
+            break
+        scan = _scan(raw_text, pos)
+        if scan.complete:
+            try:
+                plan = coerce_plan(_loads(scan.text), issues)
+            except ValueError as e:
+                issues.append(f"JSON inválido en {pos}: {e}")
+                plan = None
+            if plan is not None:
+                return ParseResult(plan, issues=issues)
+            pos = raw_text.find("{", pos + 1)
+            continue
+        # Truncado: no puede haber un objeto completo más adelante
+        plan = coerce_plan(_repair(scan), issues)
+        if plan is not None:
+            issues.append("salida truncada: se conservan los días completos")
+            return ParseResult(plan, repaired=True, issues=issues)
+        break
+    issues.append("no se encontró un plan válido")
+    return ParseResult(None, issues=issues)
+
+
+def parse_week(raw_text: str, semana: int) -> dict:
+    # Semana `semana` (o la primera) ya validada; PlanParseError si no hay días
+    result = parse_plan(raw_text)
+    if result.plan is None:
+        raise PlanParseError("; ".join(result.issues[-3:]))
+    weeks = result.plan.semanas
+    week = next((w for w in weeks if w.semana == semana), weeks[0])
+    week.semana = semana
+    return week.to_dict()
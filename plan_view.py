@@ -0,0 +1,194 @@
+# plan_view.py
+#
+# Visor paginado del plan guardado: una página por día o por semana, con
+# teclado inline para moverse (día/semana anterior y siguiente) editando el
+# mismo mensaje. Las páginas se renderizan al pedirlas y se memorizan por
+# (plan, versión del plan): navegar no vuelve a leer ni a serializar
+# MenuLog.menu_json. Una página que no cabe en un mensaje de Telegram se
+# parte en trozos navegables.
+
+import os, unicodedata
+from collections import OrderedDict
+from html import escape
+from typing import Optional
+
+from plans import PlanRef
+from shopping import WEEKDAYS
+from telegram_utils import split_message
+
+PLAN_VIEW_CACHE_MAX_PLANS = int(os.getenv("PLAN_VIEW_CACHE_MAX_PLANS", "256"))
+
+DAY_TITLES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+DAY_SHORT = ["L", "M", "X", "J", "V", "S", "D"]
+MEAL_ICONS = {"desayuno": "🍳", "almuerzo": "🥪", "comida": "🍽️", "merienda": "🍎", "cena": "🌙"}
+WEEK = "w"  # "día" de la página resumen de la semana
+
+
+class _PlanPages:
+    # Semanas del plan indexadas por número y páginas ya renderizadas
+    def __init__(self, menu_json: dict):
+        mj = menu_json or {}
+        self.total = mj.get("duracion_semanas") or len(mj.get("semanas") or []) or 1
+        self.weeks: dict[int, dict] = {}
+        for w in mj.get("semanas") or []:
+            if isinstance(w, dict) and isinstance(w.get("semana"), int):
+                self.weeks[w["semana"]] = w
+        self.pages: dict[tuple, list[str]] = {}
+
+
+_cache: OrderedDict[tuple[int, int], _PlanPages] = OrderedDict()
+
+
+# ---------- caché ----------
+def cached_plan(ref: PlanRef) -> Optional[_PlanPages]:
+    plan = _cache.get((ref.id, ref.version))
+    if plan is not None:
+        _cache.move_to_end((ref.id, ref.version))
+    return plan
+
+
+def index_plan(ref: PlanRef, menu_json: dict) -> _PlanPages:
+    # Con el documento ya leído: se indexa una vez para esta versión del plan
+    key = (ref.id, ref.version)
+    plan = _cache.get(key)
+    if plan is None:
+        plan = _cache[key] = _PlanPages(menu_json)
+        while len(_cache) > PLAN_VIEW_CACHE_MAX_PLANS:
+            _cache.popitem(last=False)
+    return plan
+
+
+def page(plan: _PlanPages, semana: int, dia) -> list[str]:
+    return plan.pages.get((semana, dia)) or _render(plan, semana, dia)
+
+
+# ---------- renderizado ----------
+def _ascii(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode()
+    return " ".join(text.lower().split())
+
+
+def days_by_index(week: dict) -> dict[int, dict]:
+    out = {}
+    for name, meals in (week.get("dias") or {}).items():
+        key = _ascii(name)
+        if key in WEEKDAYS and isinstance(meals, dict):
+            out[WEEKDAYS.index(key)] = meals
+    return out
+
+
+def _meal_lines(slot: str, meal) -> list[str]:
+    icon = MEAL_ICONS.get(_ascii(slot), "•")
+    if not isinstance(meal, dict):
+        return [f"{icon} <b>{escape(slot.capitalize())}</b>", escape(str(meal))]
+    lines = [f"{icon} <b>{escape(slot.capitalize())}</b>", escape(str(meal.get("comida") or "—"))]
+    extra = [escape(str(meal["cantidad"]))] if meal.get("cantidad") else []
+    if meal.get("kcal"):
+        extra.append(f"{meal['kcal']} kcal")
+    if extra:
+        lines.append(f"<i>{' · '.join(extra)}</i>")
+    return lines
+
+
+def _header(plan: _PlanPages, semana: int, week: Optional[dict]) -> str:
+    head = f"📅 <b>Semana {semana}</b> de {plan.total}"
+    if week and week.get("origen") == "catalogo":
+        head += "\n<i>Montada con el catálogo de recetas</i>"
+    return head
+
+
+def render_week(plan: _PlanPages, semana: int) -> str:
+    week = plan.weeks.get(semana)
+    if week is None:
+        return f"⏳ La semana {semana} aún se está preparando. Vuelve a mirarla en un rato."
+    lines = [_header(plan, semana, week)]
+    days = days_by_index(week)
+    for i, meals in sorted(days.items()):
+        lines.append(f"\n<b>{DAY_TITLES[i]}</b>")
+        for slot, meal in meals.items():
+            name = meal.get("comida") if isinstance(meal, dict) else meal
+            lines.append(f"• {escape(slot.capitalize())}: {escape(str(name or '—'))}")
+    if not days:
+        lines.append("\nEsta semana no tiene comidas.")
+    return "\n".join(lines)
+
+
+def render_day(plan: _PlanPages, semana: int, dia: int) -> str:
+    week = plan.weeks.get(semana)
+    if week is None:
+        return f"⏳ La semana {semana} aún se está preparando. Vuelve a mirarla en un rato."
+    meals = days_by_index(week).get(dia)
+    lines = [f"{_header(plan, semana, week)} · <b>{DAY_TITLES[dia]}</b>"]
+    if not meals:
+        lines.append("\nNo hay comidas para este día.")
+    for slot, meal in (meals or {}).items():
+        lines.append("")
+        lines.extend(_meal_lines(slot, meal))
+    return "\n".join(lines)
+
+
+def _render(plan: _PlanPages, semana: int, dia) -> list[str]:
+    text = render_week(plan, semana) if dia == WEEK else render_day(plan, semana, dia)
+    # Margen bajo el límite: la parte "(1/2)" del pie no debe desbordar
+    chunks = split_message(text, limit=4000)
+    plan.pages[(semana, dia)] = chunks
+    return chunks
+
+
+# ---------- navegación ----------
+def callback(semana: int, dia, part: int = 0) -> str:
+    return f"plan_{semana}_{dia}_{part}"
+
+
+def parse_callback(data: str) -> Optional[tuple[int, object, int]]:
+    # None si no es un botón válido (antiguo o manipulado): va a _unknown
+    try:
+        _, semana, dia, part = data.split("_")
+        semana, dia, part = int(semana), (WEEK if dia == WEEK else int(dia)), int(part)
+    except ValueError:
+        return None
+    if semana < 1 or part < 0 or (dia != WEEK and not 0 <= dia < len(DAY_TITLES)):
+        return None
+    return semana, dia, part
+
+
+def kb_plan(semana: int, dia, total: int, part: int = 0, parts: int = 1):
+    rows = []
+    if parts > 1:
+        nav = []
+        if part > 0:
+            nav.append({"text": f"◀ {part}/{parts}", "callback_data": callback(semana, dia, part - 1)})
+        if part < parts - 1:
+            nav.append({"text": f"{part + 2}/{parts} ▶", "callback_data": callback(semana, dia, part + 1)})
+        rows.append(nav)
+    if dia == WEEK:
+        nav = []
+        if semana > 1:
+            nav.append({"text": f"◀ Semana {semana - 1}", "callback_data": callback(semana - 1, WEEK)})
+        if semana < total:
+            nav.append({"text": f"Semana {semana + 1} ▶", "callback_data": callback(semana + 1, WEEK)})
+        if nav:
+            rows.append(nav)
+        rows.append([{"text": s, "callback_data": callback(semana, i)} for i, s in enumerate(DAY_SHORT)])
+        return {"inline_keyboard": rows}
+
+    # Días consecutivos, pasando de una semana a la siguiente
+    nav = []
+    if (semana, dia) > (1, 0):
+        ps, pd = (semana, dia - 1) if dia > 0 else (semana - 1, 6)
+        nav.append({"text": f"◀ {DAY_TITLES[pd]}", "callback_data": callback(ps, pd)})
+    if (semana, dia) < (total, 6):
+        ns, nd = (semana, dia + 1) if dia < 6 else (semana + 1, 0)
+        nav.append({"text": f"{DAY_TITLES[nd]} ▶", "callback_data": callback(ns, nd)})
+    if nav:
+        rows.append(nav)
+    rows.append([{"text": f"🗓 Semana {semana} completa", "callback_data": callback(semana, WEEK)}])
+    return {"inline_keyboard": rows}
+
+
+def view(chunks: list[str], semana: int, dia, total: int, part: int = 0) -> tuple[str, dict]:
+    part = min(max(part, 0), len(chunks) - 1)
+    text = chunks[part]
+    if len(chunks) > 1:
+        text += f"\n\n<i>({part + 1}/{len(chunks)})</i>"
+    return text, kb_plan(semana, dia, total, part, len(chunks))
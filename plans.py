@@ -0,0 +1,66 @@
+# plans.py
+#
+# Acceso a los planes guardados en MenuLog. El plan activo de cada usuario se
+# apunta desde User.menu_activo ({"menu_log_id": ..., "timestamp": ...}) para
+# leerlo por clave primaria; si falta, se usa el índice (chat_id, timestamp).
+
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import MenuLog, User
+
+
+def set_active_plan(u: User, log: MenuLog):
+    # Requiere que log ya tenga id (tras flush/commit)
+    u.menu_activo = {"menu_log_id": log.id, "timestamp": log.timestamp.isoformat()}
+
+
+async def latest_plan(s: AsyncSession, chat_id: int | str, u: Optional[User] = None) -> Optional[MenuLog]:
+    chat_id = str(chat_id)
+    pointer = (u.menu_activo or {}).get("menu_log_id") if u is not None else None
+    if pointer:
+        log = await s.get(MenuLog, pointer)
+        if log is not None and log.chat_id == chat_id:
+            return log
+
+    q = (
+        select(MenuLog)
+        .where(MenuLog.chat_id == chat_id)
+        .order_by(MenuLog.timestamp.desc())
+        .limit(1)
+    )
+    return (await s.execute(q)).scalars().first()
+
+
+class PlanRef(NamedTuple):
+    id: int
+    version: int
+    duracion_semanas: int
+
+
+async def latest_plan_ref(s: AsyncSession, chat_id: int | str, u: Optional[User] = None) -> Optional[PlanRef]:
+    # Como latest_plan pero sin traer el documento: solo id y versión del plan
+    chat_id = str(chat_id)
+    cols = (
+        MenuLog.id,
+        MenuLog.menu_json["version"].as_integer(),
+        MenuLog.menu_json["duracion_semanas"].as_integer(),
+    )
+    pointer = (u.menu_activo or {}).get("menu_log_id") if u is not None else None
+    row = None
+    if pointer:
+        row = (await s.execute(
+            select(*cols).where(MenuLog.id == pointer, MenuLog.chat_id == chat_id)
+        )).first()
+    if row is None:
+        row = (await s.execute(
+            select(*cols)
+            .where(MenuLog.chat_id == chat_id)
+            .order_by(MenuLog.timestamp.desc())
+            .limit(1)
+        )).first()
+    if row is None:
+        return None
+    return PlanRef(row[0], row[1] or 0, row[2] or 1)
@@ -0,0 +1,122 @@
+# profile_report.py
+#
+# Resume los perfiles de updates lentos que guarda profiler.py (formato
+# folded, un fichero por update en PROFILE_DIR): marcos más calientes por
+# tiempo propio (la hoja de cada muestra: dónde se estaba realmente) y por
+# tiempo inclusivo (el marco aparece en la pila), con el número de perfiles
+# en que aparece cada uno.
+#
+#   python profile_report.py --top 25
+#   python profile_report.py --route menu_generate --min-ms 2000
+#   python profile_report.py --merge all.folded   → un solo fichero para flamegraph.pl/speedscope
+
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from profiler import PROFILE_DIR, PROFILE_INTERVAL_MS, SUFFIX
+
+_NAME_RE = re.compile(r"-upd(?P<update>[^-]+)-(?P<route>.+)-(?P<ms>\d+)ms" + re.escape(SUFFIX) + "$")
+
+
+@dataclass
+class Profile:
+    path: str
+    route: str
+    ms: int
+    stacks: Counter
+
+
+def load_profiles(directory: str, route: str = None, min_ms: int = 0) -> list[Profile]:
+    out = []
+    if not os.path.isdir(directory):
+        return out
+    for name in sorted(os.listdir(directory)):
+        m = _NAME_RE.search(name)
+        if not m or (route and m["route"] != route) or int(m["ms"]) < min_ms:
+            continue
+        stacks = Counter()
+        with open(os.path.join(directory, name), encoding="utf-8") as fh:
+            for line in fh:
+                stack, _, n = line.rstrip("\n").rpartition(" ")
+                if stack and n.isdigit():
+                    stacks[stack] += int(n)
+        out.append(Profile(name, m["route"], int(m["ms"]), stacks))
+    return out
+
+
+def hottest(profiles: list[Profile]) -> tuple[Counter, Counter, Counter, int]:
+    # (propio, inclusivo, perfiles en que aparece, muestras totales)
+    own, inclusive, seen_in = Counter(), Counter(), Counter()
+    total = 0
+    for p in profiles:
+        seen = set()
+        for stack, n in p.stacks.items():
+            frames = stack.split(";")[1:]  # sin la raíz "update <ruta>"
+            if not frames:
+                continue
+            total += n
+            own[frames[-1]] += n
+            for f in set(frames):
+                inclusive[f] += n
+            seen.update(frames)
+        for f in seen:
+            seen_in[f] += 1
+    return own, inclusive, seen_in, total
+
+
+def _table(title: str, counts: Counter, seen_in: Counter, total: int, top: int) -> list[str]:
+    lines = [title, f"{'%':>6} {'ms':>9} {'perfiles':>8}  marco"]
+    for frame, n in counts.most_common(top):
+        lines.append(f"{100 * n / total:6.1f} {n * PROFILE_INTERVAL_MS:9.0f} {seen_in[frame]:8d}  {frame}")
+    return lines
+
+
+def main(directory: str, top: int, route: str, min_ms: int, as_json: bool, merge: str):
+    profiles = load_profiles(directory, route, min_ms)
+    if not profiles:
+        print(f"No hay perfiles en {directory}")
+        return
+    own, inclusive, seen_in, total = hottest(profiles)
+
+    if merge:
+        merged = Counter()
+        for p in profiles:
+            merged.update(p.stacks)
+        with open(merge, "w", encoding="utf-8") as fh:
+            for stack, n in merged.most_common():
+                fh.write(f"{stack} {n}\n")
+
+    if as_json:
+        print(json.dumps({
+            "profiles": len(profiles),
+            "samples": total,
+            "routes": dict(Counter(p.route for p in profiles).most_common()),
+            "self": [{"frame": f, "samples": n, "profiles": seen_in[f]} for f, n in own.most_common(top)],
+            "inclusive": [{"frame": f, "samples": n, "profiles": seen_in[f]} for f, n in inclusive.most_common(top)],
+        }, ensure_ascii=False))
+        return
+
+    ms = sorted(p.ms for p in profiles)
+    routes = ", ".join(f"{r} ({n})" for r, n in Counter(p.route for p in profiles).most_common())
+    print(f"{len(profiles)} perfiles, {total} muestras (~{total * PROFILE_INTERVAL_MS / 1e3:.1f}s), "
+          f"mediana {ms[len(ms) // 2]} ms, máx {ms[-1]} ms")
+    print(f"Rutas: {routes}\n")
+    print("\n".join(_table("— Tiempo propio (hoja de la pila) —", own, seen_in, total, top)))
+    print()
+    print("\n".join(_table("— Tiempo inclusivo —", inclusive, seen_in, total, top)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=PROFILE_DIR)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--route", default=None, help="solo los perfiles de esta ruta (p. ej. menu_generate)")
+    parser.add_argument("--min-ms", type=int, default=0)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--merge", default=None, help="escribe todas las pilas juntas en este fichero folded")
+    args = parser.parse_args()
+    main(args.dir, args.top, args.route, args.min_ms, args.json, args.merge)
@@ -0,0 +1,245 @@
+# profiler.py
+#
+# Profiler de muestreo opcional para updates lentos. Con PROFILE_ENABLED=1,
+# cada update procesado se registra en un hilo muestreador que cada
+# PROFILE_INTERVAL_MS toma la pila de su tarea:
+#   - si la tarea está ejecutándose, la pila real del hilo del event loop;
+#   - si está esperando (lo normal: OpenAI, Telegram, la base de datos), la
+#     cadena de awaits de su corrutina, de modo que el tiempo de pared queda
+#     atribuido a la llamada por la que espera.
+# Al terminar, el perfil se guarda si el update tardó al menos
+# PROFILE_THRESHOLD_MS o si le toca el muestreo 1 de cada PROFILE_SAMPLE_EVERY.
+# Formato "folded" (una línea "marco;marco;… muestras"), el que leen
+# flamegraph.pl, speedscope e inferno; un fichero por update en PROFILE_DIR,
+# conservando los PROFILE_MAX_FILES más recientes.
+#
+# Desactivado, capture() devuelve un objeto nulo compartido: una llamada y
+# una comprobación por update, sin hilo ni muestreo.
+#
+#   python profile_report.py --top 25   → marcos más calientes de los perfiles
+
+import os, gc, sys, time, asyncio, threading, itertools, queue
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+import logs
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_THRESHOLD_MS = float(os.getenv("PROFILE_THRESHOLD_MS", "1000"))
+# 0 = solo por umbral; N = además, uno de cada N updates aunque sea rápido
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+# Profundidad máxima de una pila (las más largas se recortan por la raíz)
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "64"))
+
+SUFFIX = ".folded"
+# Handle._run del event loop: lo que hay por encima es maquinaria de asyncio/uvicorn
+_LOOP_ENTRY = ("_run", os.path.join("asyncio", "events.py"))
+
+
+# ---------- pilas ----------
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+_paths: dict[str, str] = {}
+
+
+def _short_path(path: str) -> str:
+    # site-packages/httpx/_client.py → httpx/_client.py; módulos propios → main.py
+    short = _paths.get(path)
+    if short is None:
+        parts = path.replace("\\", "/").split("/")
+        if "site-packages" in parts:
+            short = "/".join(parts[parts.index("site-packages") + 1:])
+        elif "lib" in parts and parts[-2].startswith("python"):
+            short = "/".join(parts[-2:])
+        else:
+            short = parts[-1]
+        _paths[path] = short
+    return short
+
+
+def thread_stack(frame) -> list[str]:
+    # Pila real del hilo (raíz → hoja) sin la maquinaria del event loop
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == _LOOP_ENTRY[0] and code.co_filename.endswith(_LOOP_ENTRY[1]):
+            break
+        stack.append(_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack[-PROFILE_MAX_DEPTH:]
+
+
+def await_stack(coro) -> list[str]:
+    # Cadena de awaits de una corrutina suspendida (raíz → hoja); la hoja es
+    # el último marco Python, el que espera a un Future. Los generadores
+    # async iterados con "async for" aparecen como un objeto asend sin
+    # frame: el generador se obtiene de sus referencias.
+    stack = []
+    obj = coro
+    while obj is not None and len(stack) < PROFILE_MAX_DEPTH:
+        if isinstance(obj, asyncio.Task):
+            obj = obj.get_coro()
+            continue
+        if isinstance(obj, asyncio.Future):
+            break
+        frame = getattr(obj, "cr_frame", None) or getattr(obj, "ag_frame", None) or getattr(obj, "gi_frame", None)
+        if frame is None:
+            inner = next((r for r in gc.get_referents(obj) if hasattr(r, "ag_frame") or hasattr(r, "cr_frame")), None)
+            if inner is None or inner is obj:
+                break
+            obj = inner
+            continue
+        stack.append(_label(frame))
+        obj = getattr(obj, "cr_await", None) or getattr(obj, "ag_await", None) or getattr(obj, "gi_yieldfrom", None)
+    return stack
+
+
+# ---------- captura de un update ----------
+class Capture:
+    def __init__(self, update_id: Optional[int], sample: bool):
+        self.update_id = update_id
+        self.route = "unknown"
+        self.sample = sample
+        self.stacks: Counter[str] = Counter()
+        self.task = asyncio.current_task()
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.t0 = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        _sampler.add(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.t0
+        _sampler.remove(self)
+        if self.stacks and (self.sample or self.elapsed * 1e3 >= PROFILE_THRESHOLD_MS):
+            _sampler.save(self)
+        return False
+
+    def take(self, frames: dict):
+        if self.task is None:
+            return
+        if asyncio.current_task(self.loop) is self.task:
+            stack = thread_stack(frames.get(self.thread_id))
+        else:
+            stack = await_stack(self.task.get_coro())
+        if stack:
+            self.stacks[";".join(stack)] += 1
+
+
+class _NullCapture:
+    # Lo que devuelve capture() con el profiler desactivado; asignar la ruta no hace nada
+    __slots__ = ()
+    route = property(lambda self: "unknown", lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullCapture()
+_counter = itertools.count(1)
+
+
+def capture(update_id: Optional[int] = None):
+    if not PROFILE_ENABLED:
+        return _NULL
+    sample = PROFILE_SAMPLE_EVERY > 0 and next(_counter) % PROFILE_SAMPLE_EVERY == 0
+    return Capture(update_id, sample)
+
+
+# ---------- hilo muestreador ----------
+class Sampler:
+    def __init__(self, interval: float, directory: str, max_files: int):
+        self.interval = interval
+        self.directory = directory
+        self.max_files = max_files
+        self._active: dict[int, Capture] = {}
+        self._pending: queue.SimpleQueue = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.samples = 0
+        self.saved = 0
+
+    def add(self, cap: Capture):
+        self._active[id(cap)] = cap
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def remove(self, cap: Capture):
+        self._active.pop(id(cap), None)
+
+    def save(self, cap: Capture):
+        # La escritura va al hilo muestreador: el update no espera al disco
+        self._pending.put(cap)
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._active and self._pending.empty():
+                self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for cap in list(self._active.values()):
+                try:
+                    cap.take(frames)
+                    self.samples += 1
+                except Exception:
+                    pass  # la tarea cambió mientras se leía su pila
+            del frames
+            while not self._pending.empty():
+                try:
+                    self._write(self._pending.get_nowait())
+                except Exception as e:
+                    logs.warn("profile_write_failed", e)
+
+    def _write(self, cap: Capture):
+        os.makedirs(self.directory, exist_ok=True)
+        ms = round(cap.elapsed * 1e3)
+        name = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-upd{cap.update_id}-{cap.route}-{ms}ms{SUFFIX}"
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as fh:
+            # Raíz común con la ruta: los perfiles de varias rutas se pueden juntar
+            for stack, n in cap.stacks.most_common():
+                fh.write(f"update {cap.route};{stack} {n}\n")
+        self.saved += 1
+        logs.info("profile_saved", path=path, route=cap.route, ms=ms, samples=sum(cap.stacks.values()))
+        self._rotate()
+
+    def _rotate(self):
+        files = sorted(f for f in os.listdir(self.directory) if f.endswith(SUFFIX))
+        for old in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+
+
+_sampler = Sampler(PROFILE_INTERVAL_MS / 1e3, PROFILE_DIR, PROFILE_MAX_FILES)
+
+
+def stats() -> dict:
+    return {
+        "enabled": PROFILE_ENABLED,
+        "threshold_ms": PROFILE_THRESHOLD_MS,
+        "sample_every": PROFILE_SAMPLE_EVERY,
+        "active": len(_sampler._active),
+        "samples": _sampler.samples,
+        "saved": _sampler.saved,
+    }
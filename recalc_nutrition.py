@@ -0,0 +1,83 @@
+# recalc_nutrition.py
+#
+# Recalcula kcal_objetivo y macros de todos los usuarios con perfil completo
+# (tras cambiar FACTORES, FACTOR_OBJETIVO o las bandas de calcular_macros).
+# Lee los usuarios por bloques (paginación por id), calcula cada bloque con
+# nutrition.calcular_lote y lo escribe con un UPDATE masivo por clave primaria.
+#
+#   python recalc_nutrition.py --chunk-size 5000
+#   python recalc_nutrition.py --dry-run
+
+import argparse
+import math
+import time
+
+from sqlalchemy import select, update
+
+import user_cache
+from db import SessionLocal, User
+from nutrition import calcular_lote
+
+COLUMNS = (User.id, User.sexo, User.peso_kg, User.altura_cm, User.edad, User.actividad, User.objetivo_detallado)
+
+
+def iter_chunks(s, chunk_size: int):
+    last_id = 0
+    while True:
+        rows = s.execute(
+            select(*COLUMNS)
+            .where(User.id > last_id, User.onboarding_step == 0)
+            .order_by(User.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def recalc_chunk(rows) -> list[dict]:
+    ids, sexo, peso, altura, edad, actividad, objetivo = zip(*rows)
+    r = calcular_lote(sexo, peso, altura, edad, actividad, objetivo)
+    out = []
+    for i, user_id in enumerate(ids):
+        kcal = r["kcal"][i]
+        if math.isnan(kcal):
+            continue  # perfil incompleto: se deja como estaba
+        out.append({
+            "id": user_id,
+            "kcal_objetivo": int(kcal),
+            "macros": {
+                "kcal": int(kcal),
+                "prote_g": int(r["prote_g"][i]),
+                "grasa_g": int(r["grasa_g"][i]),
+                "carbo_g": int(r["carbo_g"][i]),
+            },
+        })
+    return out
+
+
+def main(chunk_size: int, dry_run: bool):
+    t0 = time.perf_counter()
+    seen = updated = 0
+    with SessionLocal() as s:
+        for rows in iter_chunks(s, chunk_size):
+            values = recalc_chunk(rows)
+            seen += len(rows)
+            updated += len(values)
+            if values and not dry_run:
+                s.execute(update(User), values)
+                # El UPDATE masivo no pasa por el ORM: vacía las cachés de usuarios
+                user_cache.invalidate_all(s)
+                s.commit()
+            print(f"… {seen} usuarios leídos, {updated} recalculados")
+    verb = "se recalcularían" if dry_run else "recalculados"
+    print(f"✅ {updated}/{seen} usuarios {verb} en {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    main(args.chunk_size, args.dry_run)
@@ -0,0 +1,252 @@
+# recipes.py
+#
+# Catálogo de recetas (data/recipes.json) cargado una vez en estructuras
+# indexadas: índices invertidos por comida del día, palabra de ingrediente,
+# alérgeno y equipamiento, y las recetas ordenadas por tiempo de preparación.
+# Con eso se monta un día o una semana que cuadra con las kcal objetivo sin
+# llamar al LLM (respaldo cuando OpenAI va lento o está caído).
+
+import json, os, re, random, unicodedata
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from foods import estimate_meal
+from ingredients import normalize_name, parse_meal
+
+RECIPES_JSON = os.getenv("RECIPES_JSON", os.path.join(os.path.dirname(__file__), "data", "recipes.json"))
+
+SLOTS = ("desayuno", "comida", "merienda", "cena")
+# Reparto de las kcal del día entre comidas
+SLOT_SHARE = {"desayuno": 0.25, "comida": 0.35, "merienda": 0.10, "cena": 0.30}
+DAYS = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+# Las raciones se escalan para cuadrar kcal, dentro de este margen
+SCALE_MIN, SCALE_MAX = 0.75, 1.5
+
+# Término escrito por el usuario → alérgeno del catálogo
+ALLERGEN_ALIASES = {
+    "gluten": "gluten", "trigo": "gluten", "celiaco": "gluten", "celiaquia": "gluten", "celiaca": "gluten",
+    "lactosa": "lactosa", "lacteo": "lactosa", "lacteos": "lactosa", "leche": "lactosa",
+    "huevo": "huevo", "huevos": "huevo",
+    "frutos secos": "frutos secos", "fruto seco": "frutos secos", "nuez": "frutos secos", "nueces": "frutos secos",
+    "almendra": "frutos secos", "almendras": "frutos secos", "avellana": "frutos secos",
+    "cacahuete": "cacahuete", "cacahuetes": "cacahuete", "mani": "cacahuete",
+    "pescado": "pescado", "marisco": "marisco", "mariscos": "marisco", "crustaceos": "marisco", "gamba": "marisco",
+    "soja": "soja", "sesamo": "sesamo",
+}
+# Lo que cuenta el usuario → equipamiento que usan las recetas
+EQUIPMENT_ALIASES = {
+    "horno": ("horno",), "microondas": ("microondas",), "batidora": ("batidora",),
+    "air fryer": ("air fryer",), "airfryer": ("air fryer",), "freidora de aire": ("air fryer",),
+    "sarten": ("sarten",), "olla": ("olla",),
+    "fuego": ("sarten", "olla"), "vitro": ("sarten", "olla"), "vitroceramica": ("sarten", "olla"),
+    "induccion": ("sarten", "olla"), "placa": ("sarten", "olla"), "cocina": ("sarten", "olla"),
+}
+_NUMBER_RE = re.compile(r"(\d+(?:[.,]\d+)?)(\s*)(g|gr|ml)?\b")
+# Alias (palabra o frase) dentro de una respuesta libre: "Soy celíaca",
+# "intolerancia a la lactosa"; los más largos primero ("frutos secos")
+_ALLERGEN_RE = re.compile(r"\b(" + "|".join(sorted(map(re.escape, ALLERGEN_ALIASES), key=len, reverse=True)) + r")\b")
+_WORD_RE = re.compile(r"[a-z]+")
+# Palabras de relleno de las respuestas que no se buscan como ingrediente
+_FILLER = {"con", "sin", "del", "los", "las", "que", "por", "para", "muy", "poco", "mucho", "nada", "todo",
+           "gusta", "gustan", "soy", "tengo", "alergia", "alergico", "alergica", "intolerancia", "intolerante"}
+
+
+def _ascii(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode()
+    return " ".join(text.lower().split())
+
+
+def equipment_of(equipamiento: Iterable[str]) -> set[str]:
+    # "vitro y horno" → {"sarten", "olla", "horno"}
+    have: set[str] = set()
+    for item in equipamiento:
+        t = _ascii(item)
+        for alias, targets in EQUIPMENT_ALIASES.items():
+            if alias in t:
+                have.update(targets)
+    return have
+
+
+@dataclass(frozen=True)
+class Recipe:
+    id: int
+    nombre: str
+    comidas: tuple[str, ...]
+    cantidad: str
+    alergenos: frozenset[str]
+    equipamiento: frozenset[str]
+    tiempo_min: int
+    kcal: float
+    ingredientes: tuple[str, ...]  # claves normalizadas (como en shopping)
+
+
+def scale_cantidad(cantidad: str, factor: float) -> str:
+    # g/ml redondeados a 5; unidades, cucharadas… a medias unidades
+    def repl(m: re.Match) -> str:
+        value = float(m.group(1).replace(",", ".")) * factor
+        if m.group(3):
+            value = max(5, round(value / 5) * 5)
+            return f"{value:g}{m.group(2)}{m.group(3)}"
+        return f"{max(0.5, round(value * 2) / 2):g}{m.group(2)}"
+    return _NUMBER_RE.sub(repl, cantidad)
+
+
+class RecipeCatalog:
+    def __init__(self, rows: list[dict]):
+        self.recipes: list[Recipe] = []
+        self.by_slot: dict[str, set[int]] = {s: set() for s in SLOTS}
+        self.by_ingredient: dict[str, set[int]] = {}
+        self.by_allergen: dict[str, set[int]] = {}
+        self.by_equipment: dict[str, set[int]] = {}
+
+        for row in rows:
+            idx = len(self.recipes)
+            keys = tuple(dict.fromkeys(k for k, *_ in parse_meal(row["nombre"], row["cantidad"])))
+            recipe = Recipe(
+                id=row["id"],
+                nombre=row["nombre"],
+                comidas=tuple(row["comidas"]),
+                cantidad=row["cantidad"],
+                alergenos=frozenset(_ascii(a) for a in row.get("alergenos", [])),
+                equipamiento=frozenset(_ascii(e) for e in row.get("equipamiento", [])),
+                tiempo_min=int(row.get("tiempo_min", 0)),
+                kcal=float(row.get("kcal") or estimate_meal(row["nombre"], row["cantidad"]).nutrients.kcal),
+                ingredientes=keys,
+            )
+            self.recipes.append(recipe)
+            for slot in recipe.comidas:
+                self.by_slot.setdefault(slot, set()).add(idx)
+            # Clave completa y cada palabra: "aceite de oliva" se excluye con "aceite"
+            for key in keys:
+                for term in {key, *key.split()}:
+                    self.by_ingredient.setdefault(term, set()).add(idx)
+            for a in recipe.alergenos:
+                self.by_allergen.setdefault(a, set()).add(idx)
+            for e in recipe.equipamiento:
+                self.by_equipment.setdefault(e, set()).add(idx)
+
+        order = sorted(range(len(self.recipes)), key=lambda i: self.recipes[i].tiempo_min)
+        self._by_time_ids = order
+        self._by_time_values = [self.recipes[i].tiempo_min for i in order]
+        self._all = frozenset(range(len(self.recipes)))
+
+    def __len__(self):
+        return len(self.recipes)
+
+    # ---------- filtros ----------
+    def excluded(self, terms: Iterable[str]) -> set[int]:
+        # Recetas con un alérgeno o ingrediente que el usuario no puede/quiere
+        # comer. Las respuestas son texto libre ("no me gusta el pescado"):
+        # cuenta cada alias y cada palabra que contengan, no solo el término entero.
+        out: set[int] = set()
+        for term in terms:
+            t = _ascii(term)
+            if not t:
+                continue
+            for alias in _ALLERGEN_RE.findall(t):
+                out |= self.by_allergen.get(ALLERGEN_ALIASES[alias], set())
+            out |= self.by_ingredient.get(t, set())
+            out |= self.by_ingredient.get(normalize_name(t)[0], set())
+            for word in _WORD_RE.findall(t):
+                if len(word) < 3 or word in _FILLER:
+                    continue
+                out |= self.by_ingredient.get(word, set())
+                out |= self.by_ingredient.get(normalize_name(word)[0], set())
+        return out
+
+    def not_equipped(self, equipamiento: Iterable[str]) -> set[int]:
+        # Sin datos de equipamiento no se filtra
+        have = equipment_of(equipamiento)
+        if not have:
+            return set()
+        out: set[int] = set()
+        for e, ids in self.by_equipment.items():
+            if e not in have:
+                out |= ids
+        return out
+
+    def within_time(self, tiempo_max: Optional[int]) -> frozenset[int]:
+        if tiempo_max is None:
+            return self._all
+        return frozenset(self._by_time_ids[:bisect_right(self._by_time_values, tiempo_max)])
+
+    # ---------- montaje ----------
+    def _pick(self, slot: str, allowed: set[int], fallback: set[int], target: float,
+              rng: random.Random, avoid: set[int]) -> Optional[int]:
+        cands = self.by_slot.get(slot, set()) & allowed or self.by_slot.get(slot, set()) & fallback
+        if not cands:
+            return None
+        fresh = cands - avoid or cands
+        ranked = sorted(fresh, key=lambda i: abs(self.recipes[i].kcal - target))
+        return rng.choice(ranked[:3])
+
+    def plan_day(self, kcal: float, excluir: Iterable[str] = (), equipamiento: Iterable[str] = (),
+                 tiempo_max: Optional[int] = None, rng: Optional[random.Random] = None,
+                 avoid: Iterable[int] = (), _filters: Optional[tuple[set[int], set[int]]] = None) -> dict:
+        rng = rng or random.Random(0)
+        if _filters is None:
+            _filters = self.filters(excluir, equipamiento, tiempo_max)
+        allowed, fallback = _filters
+        avoid = set(avoid)
+
+        # Si una comida se queda sin candidatas, su parte se reparte entre las siguientes
+        chosen = {}
+        remaining_kcal, remaining_share = kcal, 1.0
+        for slot in SLOTS:
+            target = remaining_kcal * SLOT_SHARE[slot] / remaining_share
+            idx = self._pick(slot, allowed, fallback, target, rng, avoid)
+            remaining_share -= SLOT_SHARE[slot]
+            if idx is not None:
+                chosen[slot] = idx
+                remaining_kcal -= self.recipes[idx].kcal
+            if remaining_share <= 0:
+                break
+        total = sum(self.recipes[i].kcal for i in chosen.values())
+        factor = min(max(kcal / total, SCALE_MIN), SCALE_MAX) if total else 1.0
+        return {
+            slot: {
+                "comida": self.recipes[i].nombre,
+                "cantidad": scale_cantidad(self.recipes[i].cantidad, factor),
+                "kcal": round(self.recipes[i].kcal * factor),
+                "receta_id": self.recipes[i].id,
+            }
+            for slot, i in chosen.items()
+        }
+
+    def filters(self, excluir: Iterable[str], equipamiento: Iterable[str],
+                tiempo_max: Optional[int]) -> tuple[set[int], set[int]]:
+        # (permitidas, permitidas sin límite de tiempo): las restricciones de
+        # alimentos nunca se relajan; el tiempo sí, si no queda nada
+        safe = set(self._all) - self.excluded(excluir) - self.not_equipped(equipamiento)
+        return safe & self.within_time(tiempo_max), safe
+
+    def plan_week(self, kcal: float, semana: int, excluir: Iterable[str] = (),
+                  equipamiento: Iterable[str] = (), tiempo_max: Optional[int] = None) -> dict:
+        # Semilla por semana: el mismo perfil obtiene la misma semana k
+        rng = random.Random(semana)
+        filters = self.filters(excluir, equipamiento, tiempo_max)
+        ids = {r.id: i for i, r in enumerate(self.recipes)}
+        dias = {}
+        recent: list[set[int]] = []
+        for day in DAYS:
+            avoid = set().union(*recent[-2:]) if recent else set()
+            plan = self.plan_day(kcal, rng=rng, avoid=avoid, _filters=filters)
+            dias[day] = plan
+            recent.append({ids[m["receta_id"]] for m in plan.values()})
+        return {"semana": semana, "dias": dias}
+
+
+def load_catalog(path: str = RECIPES_JSON) -> RecipeCatalog:
+    with open(path, encoding="utf-8") as fh:
+        return RecipeCatalog(json.load(fh))
+
+
+_catalog: Optional[RecipeCatalog] = None
+
+
+def get_catalog() -> RecipeCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
@@ -0,0 +1,137 @@
+# router.py
+#
+# Enrutado de updates de Telegram por tablas. El update se decodifica una
+# sola vez en un Update tipado y se resuelve con búsquedas en diccionario:
+#   - comandos (/start, /menu): tabla exacta por el primer token del texto;
+#   - callbacks: tabla exacta por el data completo ("menu_plan") y, si no
+#     está, tabla de prefijos por lo que precede al primer "_" ("plan_",
+#     "shop_", "sexo_"…);
+#   - lo demás, a la ruta por defecto de mensajes o de callbacks.
+# Cada ruta declara qué estado de la base de datos necesita (nada, una
+# Session o además el User), de modo que quien la ejecuta no abre una
+# Session para las rutas que no la usan.
+
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Awaitable, Callable, Optional
+
+# Estado que necesita una ruta (de menos a más)
+NOTHING = 0
+SESSION = 1
+USER = 2
+
+Handler = Callable[..., Awaitable[object]]
+
+
+class Update(tuple):
+    # Tupla con nombres que se crea con Update((...)): el constructor de
+    # tuple, en C. El __new__ que genera NamedTuple (Python, con argumentos
+    # por nombre) costaba más que todo el enrutado
+    __slots__ = ()
+    _fields = ("update_id", "chat_id", "text", "is_callback", "callback_id", "message_id", "command")
+
+    update_id: Optional[int] = property(itemgetter(0))
+    chat_id: int | str = property(itemgetter(1))
+    text: str = property(itemgetter(2))              # texto del mensaje o data del callback
+    is_callback: bool = property(itemgetter(3))
+    callback_id: Optional[str] = property(itemgetter(4))
+    message_id: Optional[int] = property(itemgetter(5))  # mensaje al que pertenece el botón
+    command: Optional[str] = property(itemgetter(6))     # "/start" en "/start@Bot payload"
+
+    def __repr__(self):
+        return "Update(" + ", ".join(f"{k}={v!r}" for k, v in zip(self._fields, self)) + ")"
+
+
+def decode(data: dict) -> Optional[Update]:
+    # None si el update no es un mensaje ni un callback con chat (ediciones,
+    # inline queries, miembros del chat…) o si el JSON está malformado.
+    # Acceso directo: Telegram siempre manda chat.id en un mensaje; el
+    # callback de un mensaje inline no trae message
+    try:
+        message = data.get("message")
+        if message is not None:
+            text = message.get("text")
+            text = text.strip() if text else ""
+            command = text.split(None, 1)[0].partition("@")[0] if text[:1] == "/" else None
+            return Update((data.get("update_id"), message["chat"]["id"], text, False, None, None, command))
+        callback = data.get("callback_query")
+        if callback is not None:
+            origin = callback.get("message")
+            if origin:
+                return Update((data.get("update_id"), origin["chat"]["id"], callback.get("data") or "", True,
+                               callback.get("id"), origin.get("message_id"), None))
+    except (AttributeError, KeyError, TypeError):
+        pass
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    name: str            # etiqueta acotada para métricas y logs
+    handler: Handler
+    needs: int = USER
+    # Solo para perfiles completos: con el onboarding a medias el update va
+    # al onboarding (lo decide quien ejecuta la ruta)
+    profile: bool = True
+
+
+class Router:
+    def __init__(self):
+        self._commands: dict[str, Route] = {}
+        self._callbacks: dict[str, Route] = {}
+        self._prefixes: dict[str, Route] = {}   # sin el "_" final: "plan", "shop"
+        self._default_message: Optional[Route] = None
+        self._default_callback: Optional[Route] = None
+
+    # ---------- registro ----------
+    def command(self, name: str, *, needs: int = USER, profile: bool = True, route: str = None):
+        def register(handler: Handler) -> Handler:
+            self._commands[name] = Route(route or name.lstrip("/"), handler, needs, profile)
+            return handler
+        return register
+
+    def callback(self, data: str = None, *, prefix: str = None, needs: int = USER, profile: bool = True,
+                 route: str = None):
+        # data exacto ("menu_plan") o prefijo hasta el primer "_" incluido ("plan_")
+        if (data is None) == (prefix is None):
+            raise ValueError("callback(): indica data o prefix")
+        if prefix is not None and (not prefix.endswith("_") or "_" in prefix[:-1]):
+            raise ValueError(f"prefijo de callback no válido: {prefix!r}")
+
+        def register(handler: Handler) -> Handler:
+            r = Route(route or data or prefix.rstrip("_"), handler, needs, profile)
+            if data is not None:
+                self._callbacks[data] = r
+            else:
+                self._prefixes[prefix[:-1]] = r
+            return handler
+        return register
+
+    def default(self, *, callback: bool, needs: int = USER, profile: bool = True, route: str = None):
+        def register(handler: Handler) -> Handler:
+            r = Route(route or ("callback_other" if callback else "text"), handler, needs, profile)
+            if callback:
+                self._default_callback = r
+            else:
+                self._default_message = r
+            return handler
+        return register
+
+    # ---------- resolución ----------
+    def resolve(self, update: Update) -> Route:
+        if update.is_callback:
+            data = update.text
+            r = self._callbacks.get(data)
+            if r is None:
+                head, sep, _ = data.partition("_")
+                r = self._prefixes.get(head) if sep else None
+            return r or self._default_callback
+        if update.command is not None:
+            r = self._commands.get(update.command)
+            if r is not None:
+                return r
+        return self._default_message
+
+    def routes(self) -> list[Route]:
+        defaults = [r for r in (self._default_message, self._default_callback) if r is not None]
+        return [*self._commands.values(), *self._callbacks.values(), *self._prefixes.values(), *defaults]
@@ -0,0 +1,233 @@
+# shopping.py
+#
+# Lista de la compra a partir de un plan guardado (MenuLog.menu_json), sin
+# llamar a OpenAI. Recorre las comidas una sola vez, las separa en
+# ingredientes (ingredients.py) y suma por ingrediente y magnitud. El
+# resultado se cachea por (plan, versión del plan, alcance).
+
+import os, re, math, unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from html import escape
+from typing import Iterable, Optional
+
+from ingredients import parse_meal
+
+SHOPPING_CACHE_MAX_ENTRIES = int(os.getenv("SHOPPING_CACHE_MAX_ENTRIES", "512"))
+
+WEEKDAYS = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
+
+# ---------- tablas ----------
+_PLURALS = {"rebanada": "rebanadas", "loncha": "lonchas", "puñado": "puñados", "lata": "latas",
+            "filete": "filetes", "diente": "dientes", "ración": "raciones", "pizca": "pizcas"}
+
+_CATEGORIES = [
+    ("🥦 Frutas y verduras", "platano manzana pera naranja fresa fruto kiwi uva melon sandia pina mango "
+     "tomate lechuga espinaca brocoli calabacin zanahoria cebolla ajo pimiento pepino berenjena champinon "
+     "judia patata boniato aguacate limon verdura fruta ensalada calabaza coliflor esparrago"),
+    ("🍗 Carnes, pescados y huevos", "pollo pavo ternera cerdo lomo jamon huevo salmon atun merluza bacalao "
+     "sardina gamba pescado carne hamburguesa tofu tempeh seitan"),
+    ("🧀 Lácteos", "leche yogur queso kefir requeson nata mantequilla"),
+    ("🌾 Cereales, pan y legumbres", "arroz pasta pan avena quinoa cuscus tortilla harina cereal "
+     "garbanzo lenteja alubia legumbre"),
+    ("🫒 Despensa", "aceite sal pimienta vinagre especia oregano comino miel azucar cacao nuez almendra "
+     "cacahuete semilla chia crema caldo mostaza"),
+]
+_CATEGORY_RES = [
+    (name, re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, words.split()), key=len, reverse=True)) + r")"))
+    for name, words in _CATEGORIES
+]
+OTHER_CATEGORY = "🛒 Otros"
+
+
+def _ascii(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+
+
+@lru_cache(maxsize=4096)
+def category(key: str) -> str:
+    for name, pattern in _CATEGORY_RES:
+        if pattern.search(key):
+            return name
+    return OTHER_CATEGORY
+
+
+# ---------- agregación ----------
+@dataclass
+class ShoppingItem:
+    nombre: str
+    categoria: str
+    cantidades: dict[str, float] = field(default_factory=dict)
+    veces: int = 0
+
+
+def _day_key(name: str) -> str:
+    return _ascii(str(name).strip().lower())
+
+
+def aggregate(menu_json: dict, semanas: Optional[Iterable[int]] = None,
+              dias: Optional[dict[int, set[str]]] = None) -> list[ShoppingItem]:
+    # Una pasada por las comidas de las semanas (y días) pedidos
+    wanted = set(semanas) if semanas is not None else None
+    totals: dict[str, ShoppingItem] = {}
+    for week in (menu_json or {}).get("semanas") or []:
+        if not isinstance(week, dict):
+            continue
+        n = week.get("semana")
+        if wanted is not None and n not in wanted:
+            continue
+        day_filter = dias.get(n) if dias is not None else None
+        for day_name, meals in (week.get("dias") or {}).items():
+            if day_filter is not None and _day_key(day_name) not in day_filter:
+                continue
+            if not isinstance(meals, dict):
+                continue
+            for meal in meals.values():
+                if isinstance(meal, str):
+                    comida, cantidad = meal, ""
+                elif isinstance(meal, dict):
+                    comida, cantidad = str(meal.get("comida") or ""), str(meal.get("cantidad") or "")
+                else:
+                    continue
+                for key, display, dim, qty in parse_meal(comida, cantidad):
+                    item = totals.get(key)
+                    if item is None:
+                        item = totals[key] = ShoppingItem(nombre=display, categoria=category(key))
+                    item.veces += 1
+                    if dim is not None:
+                        item.cantidades[dim] = item.cantidades.get(dim, 0.0) + qty
+    return sorted(totals.values(), key=lambda i: (i.categoria, i.nombre))
+
+
+def days_in_range(start: datetime, desde: date, hasta: date) -> dict[int, set[str]]:
+    # Semana k del plan = días [start + 7(k-1), start + 7k); dentro de cada
+    # semana, el día se elige por su nombre (lunes…domingo)
+    start_day = start.date() if isinstance(start, datetime) else start
+    out: dict[int, set[str]] = {}
+    d = max(desde, start_day)
+    while d <= hasta:
+        semana = (d - start_day).days // 7 + 1
+        out.setdefault(semana, set()).add(WEEKDAYS[d.weekday()])
+        d += timedelta(days=1)
+    return out
+
+
+# ---------- caché por versión de plan ----------
+_cache: OrderedDict[tuple, list[ShoppingItem]] = OrderedDict()
+
+
+def plan_version(menu_json: dict) -> tuple:
+    # plan_generation.assemble incrementa "version" cada vez que cambia el plan
+    mj = menu_json or {}
+    return mj.get("version", 0), len(mj.get("semanas") or [])
+
+
+def shopping_list(log, semana: Optional[int] = None,
+                  desde: Optional[date] = None, hasta: Optional[date] = None) -> list[ShoppingItem]:
+    key = (log.id, plan_version(log.menu_json), semana, desde, hasta)
+    items = _cache.get(key)
+    if items is not None:
+        _cache.move_to_end(key)
+        return items
+    if desde is not None or hasta is not None:
+        desde = desde or log.timestamp.date()
+        hasta = hasta or desde + timedelta(days=6)
+        dias = days_in_range(log.timestamp, desde, hasta)
+        items = aggregate(log.menu_json, dias.keys(), dias)
+    else:
+        items = aggregate(log.menu_json, None if semana is None else [semana])
+    _cache[key] = items
+    while len(_cache) > SHOPPING_CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return items
+
+
+# ---------- presentación ----------
+def _fmt_number(x: float) -> str:
+    return f"{x:.1f}".rstrip("0").rstrip(".")
+
+
+def format_amount(dim: str, qty: float) -> str:
+    if dim == "g":
+        return f"{_fmt_number(qty / 1000)} kg" if qty >= 1000 else f"{round(qty)} g"
+    if dim == "ml":
+        return f"{_fmt_number(qty / 1000)} l" if qty >= 1000 else f"{round(qty)} ml"
+    if dim == "ud":
+        return f"{math.ceil(qty)} ud"
+    n = math.ceil(qty)
+    return f"{n} {_PLURALS.get(dim, dim) if n != 1 else dim}"
+
+
+def format_list(items: list[ShoppingItem], title: str) -> str:
+    # Se envía con parse_mode=HTML: nombres y unidades vienen del plan (LLM)
+    if not items:
+        return f"🛒 <b>{escape(title)}</b>\n\nNo hay comidas en este periodo."
+    lines = [f"🛒 <b>{escape(title)}</b>"]
+    current = None
+    for item in items:
+        if item.categoria != current:
+            current = item.categoria
+            lines.append(f"\n<b>{escape(current)}</b>")
+        amounts = escape(" + ".join(format_amount(d, q) for d, q in item.cantidades.items()))
+        name = escape(item.nombre)
+        lines.append(f"• {name}: {amounts}" if amounts else f"• {name} (al gusto)")
+    return "\n".join(lines)
+
+
+# ---------- navegación ----------
+def callback(semana: Optional[int], part: int = 0) -> str:
+    return f"shop_all_{part}" if semana is None else f"shop_w_{semana}_{part}"
+
+
+def parse_callback(data: str) -> Optional[tuple[Optional[int], int]]:
+    # (semana o None = todo el plan, parte); los botones antiguos no llevan parte
+    fields = data.split("_")
+    try:
+        if fields[1] == "all" and len(fields) <= 3:
+            semana, part = None, int(fields[2]) if len(fields) == 3 else 0
+        elif fields[1] == "w" and len(fields) in (3, 4):
+            semana, part = int(fields[2]), int(fields[3]) if len(fields) == 4 else 0
+            if semana < 1:
+                return None
+        else:
+            return None
+    except (IndexError, ValueError):
+        return None
+    return (semana, part) if part >= 0 else None
+
+
+def kb_shopping(semana: Optional[int], total: int, part: int = 0, parts: int = 1):
+    rows = []
+    if parts > 1:
+        nav = []
+        if part > 0:
+            nav.append({"text": f"◀ {part}/{parts}", "callback_data": callback(semana, part - 1)})
+        if part < parts - 1:
+            nav.append({"text": f"{part + 2}/{parts} ▶", "callback_data": callback(semana, part + 1)})
+        rows.append(nav)
+    week = semana or 1
+    nav = []
+    if week > 1:
+        nav.append({"text": f"◀ Semana {week - 1}", "callback_data": callback(week - 1)})
+    if week < total:
+        nav.append({"text": f"Semana {week + 1} ▶", "callback_data": callback(week + 1)})
+    if nav:
+        rows.append(nav)
+    rows.append([{"text": "🧾 Todo el plan", "callback_data": callback(None)}])
+    return {"inline_keyboard": rows}
+
+
+def view(text: str, semana: Optional[int], total: int, part: int = 0) -> tuple[str, dict]:
+    # Listas largas (todo el plan) en trozos navegables, como el visor del plan;
+    # margen bajo el límite para el pie "(1/2)". Import local: solo el
+    # renderizado toca telegram_utils; quien agrega la lista no lo carga
+    from telegram_utils import split_message
+
+    chunks = split_message(text, limit=4000)
+    part = min(max(part, 0), len(chunks) - 1)
+    body = chunks[part]
+    if len(chunks) > 1:
+        body += f"\n\n<i>({part + 1}/{len(chunks)})</i>"
+    return body, kb_shopping(semana, total, part, len(chunks))
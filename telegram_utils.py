@@ -1,26 +1,354 @@
 # telegram_utils.py
 
-import os, httpx
+import os, asyncio, heapq, itertools, time, httpx
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional
+
 from dotenv import load_dotenv
 
+import logs
+import metrics
+
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TG_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+TG_API = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}"
+
+# ---------- cliente HTTP compartido ----------
+# Un único AsyncClient para todo el proceso: reutiliza conexiones TCP+TLS
+# con api.telegram.org en vez de abrir una nueva en cada llamada.
+TG_TIMEOUT = float(os.getenv("TG_TIMEOUT", "10"))
+TG_MAX_CONNECTIONS = int(os.getenv("TG_MAX_CONNECTIONS", "100"))
+TG_MAX_KEEPALIVE = int(os.getenv("TG_MAX_KEEPALIVE", "20"))
+TG_KEEPALIVE_EXPIRY = float(os.getenv("TG_KEEPALIVE_EXPIRY", "30"))
+TG_HTTP2 = os.getenv("TG_HTTP2", "0") == "1"
+
+_client: httpx.AsyncClient | None = None
+
+TG_REQUEST_SECONDS = metrics.histogram("telegram_request_seconds", "Duración de cada llamada HTTP a la Bot API", ("method",))
+TG_RESPONSES = metrics.counter(
+    "telegram_responses_total", "Respuestas de la Bot API por método y código HTTP (error = sin respuesta)",
+    ("method", "status"))
+TG_DISPATCH_WAIT_SECONDS = metrics.histogram(
+    "telegram_dispatch_wait_seconds", "Espera de un envío en el dispatcher (rate limiting) antes de salir")
+TG_QUEUE_DEPTH = metrics.gauge("telegram_dispatch_queue_depth", "Envíos pendientes en el dispatcher de salida")
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_client(http2: bool = TG_HTTP2) -> httpx.AsyncClient:
+    if http2 and not _http2_available():
+        logs.warn("telegram_http2_unavailable", hint="pip install httpx[http2]; usando HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(
+        max_connections=TG_MAX_CONNECTIONS,
+        max_keepalive_connections=TG_MAX_KEEPALIVE,
+        keepalive_expiry=TG_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(timeout=TG_TIMEOUT, limits=limits, http2=http2)
+
+
+async def init_client() -> httpx.AsyncClient:
+    # Se llama desde el hook de startup de FastAPI
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_client()
+    return _client
+
+
+async def close_client():
+    # Se llama desde el hook de shutdown de FastAPI
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # Si no pasó por el startup (scripts sueltos), se crea bajo demanda
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_client()
+    return _client
 
 # ---------- función base ----------
-async def tg(method: str, payload: dict):
+async def _post(method: str, payload: dict):
+    # Una llamada HTTP; reintenta los 429 respetando retry_after
     url = f"{TG_API}/{method}"
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.post(url, json=payload)
-        # ⚠️ fix: no crashear si answerCallbackQuery llega tarde
-        if r.status_code == 400 and method == "answerCallbackQuery":
-            print("[INFO] Ignorando callback viejo:", r.text)
-            return None
-        r.raise_for_status()
-        return r.json()
+    for attempt in range(TG_MAX_RETRIES + 1):
+        t0 = time.perf_counter()
+        try:
+            r = await get_client().post(url, json=payload)
+        except Exception:
+            TG_RESPONSES.labels(method, "error").inc()
+            raise
+        finally:
+            TG_REQUEST_SECONDS.labels(method).observe(time.perf_counter() - t0)
+        TG_RESPONSES.labels(method, str(r.status_code)).inc()
+        if r.status_code == 429 and attempt < TG_MAX_RETRIES:
+            retry_after = _retry_after(r)
+            if _dispatcher is not None:
+                _dispatcher.retries_429 += 1
+            logs.warn("telegram_rate_limited", method=method, retry_after=retry_after)
+            await asyncio.sleep(retry_after)
+            continue
+        break
+    # ⚠️ fix: no crashear si answerCallbackQuery llega tarde
+    if r.status_code == 400 and method == "answerCallbackQuery":
+        logs.info("telegram_stale_callback", response=r.text[:200])
+        return None
+    r.raise_for_status()
+    return r.json()
+
+
+def _retry_after(r: httpx.Response) -> float:
+    try:
+        return float(r.json().get("parameters", {}).get("retry_after", 1))
+    except Exception:
+        return float(r.headers.get("Retry-After", 1))
+
+
+async def tg(method: str, payload: dict, priority: Optional[int] = None):
+    # Con el dispatcher arrancado los envíos pasan por los rate limiters;
+    # sin él (scripts, benchmarks) se llama directamente a la API.
+    if _dispatcher is None:
+        return await _post(method, payload)
+    return await _dispatcher.submit(method, payload, priority)
+
+# ---------- dispatcher de salida con rate limiting ----------
+# Telegram permite ~30 msg/s globales y ~1 msg/s por chat. Los envíos de un
+# mismo chat salen en orden por su propio carril; todos compiten por el
+# bucket global, que atiende antes a los de mayor prioridad.
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+TG_CHAT_BUCKETS_MAX = int(os.getenv("TG_CHAT_BUCKETS_MAX", "10000"))
+
+PRIORITY_CALLBACK = 0   # answerCallbackQuery: el spinner del botón no puede esperar
+PRIORITY_NORMAL = 1     # respuestas y ediciones
+PRIORITY_BULK = 2       # envíos masivos / no interactivos
+
+_CHATLESS_METHODS = {"answerCallbackQuery", "setWebhook", "deleteWebhook", "getMe"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        # Segundos hasta que haya un token libre (0 si ya lo hay)
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    async def wait(self):
+        while (d := self.delay()) > 0:
+            await asyncio.sleep(d)
+        self.take()
+
+
+class PriorityTokenBucket(TokenBucket):
+    # Bucket compartido: si hay espera, se sirve primero la prioridad más baja
+    def __init__(self, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.delay() == 0:
+            self.take()
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await fut
+
+    async def _pump(self):
+        while self._waiters:
+            d = self.delay()
+            if d > 0:
+                await asyncio.sleep(d)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self.take()
+                fut.set_result(None)
+
+
+@dataclass
+class _Job:
+    method: str
+    payload: dict
+    priority: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class OutboundDispatcher:
+    def __init__(self):
+        self.global_bucket = PriorityTokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_BURST)
+        self._chat_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lanes: dict[str, deque] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # métricas
+        self.sent = 0
+        self.failed = 0
+        self.retries_429 = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def depth(self) -> int:
+        return len(self.global_bucket) + sum(len(q) for q in self._lanes.values())
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "active_chats": len(self._lanes),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries_429": self.retries_429,
+            "wait_avg_s": self.wait_total / self.sent if self.sent else 0.0,
+            "wait_max_s": self.wait_max,
+        }
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)
+            if len(self._chat_buckets) > TG_CHAT_BUCKETS_MAX:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def submit(self, method: str, payload: dict, priority: Optional[int] = None) -> asyncio.Future:
+        if priority is None:
+            priority = PRIORITY_CALLBACK if method == "answerCallbackQuery" else PRIORITY_NORMAL
+        job = _Job(method, payload, priority, asyncio.get_running_loop().create_future())
+        chat_id = payload.get("chat_id")
+        if chat_id is None or method in _CHATLESS_METHODS:
+            self._spawn(self._send(job))
+        else:
+            key = str(chat_id)
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = deque()
+                self._spawn(self._drain_lane(key, lane))
+            lane.append(job)
+        return job.future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain_lane(self, chat_id: str, lane: deque):
+        try:
+            while lane:
+                await self._chat_bucket(chat_id).wait()
+                await self._send(lane.popleft())
+        finally:
+            self._lanes.pop(chat_id, None)
+            for job in lane:
+                if not job.future.done():
+                    job.future.cancel()
+
+    async def _send(self, job: _Job):
+        await self.global_bucket.acquire(job.priority)
+        waited = time.monotonic() - job.enqueued_at
+        self.wait_total += waited
+        TG_DISPATCH_WAIT_SECONDS.observe(waited)
+        self.wait_max = max(self.wait_max, waited)
+        try:
+            result = await _post(job.method, job.payload)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_dispatcher: Optional[OutboundDispatcher] = None
+TG_QUEUE_DEPTH.set_function(lambda: _dispatcher.depth() if _dispatcher is not None else 0)
+
+
+def start_dispatcher() -> OutboundDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+
+async def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        d, _dispatcher = _dispatcher, None
+        await d.close()
+
+
+def dispatcher_stats() -> dict:
+    return _dispatcher.stats() if _dispatcher is not None else {}
 
 # ---------- utilidades ----------
+TG_MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = TG_MESSAGE_LIMIT) -> list[str]:
+    # Trozos de como mucho limit caracteres cortando por líneas (las etiquetas
+    # HTML de los mensajes abren y cierran en la misma línea); una línea más
+    # larga que el límite se corta tal cual
+    chunks, current, size = [], [], 0
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        extra = len(line) + (1 if current else 0)
+        if size + extra > limit:
+            chunks.append("\n".join(current))
+            current, size, extra = [], 0, len(line)
+        current.append(line)
+        size += extra
+    if current:
+        chunks.append("\n".join(current))
+    return chunks or [""]
+
 async def answer_callback(callback_id: str, text: str = ""):
     payload = {"callback_query_id": callback_id}
     if text:
@@ -29,11 +357,35 @@ async def answer_callback(callback_id: str, text: str = ""):
         return await tg("answerCallbackQuery", payload)
     except Exception as e:
         # seguridad extra
-        print("[WARN] answerCallback falló:", e)
+        logs.warn("telegram_answer_callback_failed", e)
         return None
 
-async def edit_message(chat_id: str, message_id: int, text: str, reply_markup: dict = None):
+async def edit_message(chat_id: str, message_id: int, text: str, reply_markup: dict = None, parse_mode: str = None):
     payload = {"chat_id": chat_id, "message_id": message_id, "text": text}
     if reply_markup:
         payload["reply_markup"] = reply_markup
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
     return await tg("editMessageText", payload)
+
+
+class ThrottledEditor:
+    # Edita un mismo mensaje como mucho cada min_interval segundos y solo si
+    # el texto cambia (Telegram rechaza ediciones idénticas)
+    def __init__(self, chat_id: str, message_id: int, min_interval: float = 1.5):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+        self._last_text = None
+        self._last_at = 0.0
+
+    async def update(self, text: str, reply_markup: dict = None, force: bool = False):
+        now = time.monotonic()
+        if text == self._last_text or (not force and now - self._last_at < self.min_interval):
+            return None
+        self._last_text, self._last_at = text, now
+        try:
+            return await edit_message(self.chat_id, self.message_id, text, reply_markup)
+        except Exception as e:
+            logs.warn("telegram_progress_edit_failed", e, message_id=self.message_id)
+            return None
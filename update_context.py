@@ -0,0 +1,34 @@
+# update_context.py
+
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import user_cache
+from db import User
+from router import Update
+
+
+@dataclass
+class UpdateContext:
+    # Estado de un update: una sola Session y el User cargado una vez.
+    # Se pasa a los handlers y al onboarding en lugar del chat_id suelto.
+    # Las rutas que no necesitan la base de datos lo reciben sin Session.
+    chat_id: int | str
+    session: Optional[AsyncSession] = None
+    user: Optional[User] = None
+    # Etiqueta de la rama que lo atiende, para las métricas
+    route: str = "unknown"
+    update: Optional[Update] = None
+
+    async def load_user(self) -> Optional[User]:
+        # Sin SELECT si está en la caché de usuarios (ver user_cache.py)
+        self.user = await user_cache.load(self.session, self.chat_id)
+        return self.user
+
+    @classmethod
+    async def load(cls, session: AsyncSession, chat_id: int | str) -> "UpdateContext":
+        ctx = cls(chat_id=chat_id, session=session)
+        await ctx.load_user()
+        return ctx
@@ -0,0 +1,252 @@
+# update_queue.py
+#
+# Cola durable de updates de Telegram sobre la propia base de datos.
+# El webhook solo persiste el update y responde; un pool de workers async
+# los procesa con semántica at-least-once, reintentos con backoff y
+# dead-letter cuando se agotan los intentos.
+#
+# Orden por chat: solo se reclama el update más antiguo de cada chat, así que
+# los updates de un mismo chat se procesan en orden (incluidos reintentos)
+# mientras que chats distintos avanzan en paralelo.
+
+import os, asyncio, random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import and_, or_, exists, select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+import dedup
+import logs
+import metrics
+from db import AsyncSessionLocal, QueuedUpdate, DeadLetter, ProcessedUpdate
+
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "4"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1.0"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+QUEUE_BACKOFF_BASE = float(os.getenv("QUEUE_BACKOFF_BASE", "2"))
+QUEUE_BACKOFF_MAX = float(os.getenv("QUEUE_BACKOFF_MAX", "300"))
+# Si un worker muere con un update "processing", se reclama pasado este tiempo
+QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "600"))
+
+QUEUE_DEPTH = metrics.gauge("update_queue_depth", "Updates en la cola (pendientes + en proceso)")
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "update_queue_wait_seconds", "Desde que llega el update hasta que un worker lo reclama (primer intento)",
+    buckets=metrics.SLOW_BUCKETS)
+QUEUE_RESULTS = metrics.counter(
+    "update_queue_results_total", "Updates procesados por resultado (done | retry | dead_letter)", ("result",))
+QUEUE_DUPLICATES = metrics.counter("update_queue_duplicates_total", "Updates reenviados por Telegram e ignorados")
+
+
+@dataclass
+class Job:
+    id: int
+    update_id: Optional[int]
+    chat_id: Optional[str]
+    payload: dict
+    attempts: int
+
+
+def update_chat_id(data: dict) -> Optional[str]:
+    message = data.get("message") or (data.get("callback_query") or {}).get("message") or {}
+    chat = message.get("chat") or {}
+    return str(chat["id"]) if "id" in chat else None
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(QUEUE_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), QUEUE_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+# ---------- operaciones sobre la tabla ----------
+async def enqueue(data: dict) -> Optional[int]:
+    # Devuelve None si el update_id ya se recibió (reenvío de Telegram)
+    update_id = data.get("update_id")
+    chat_id = update_chat_id(data)
+    if update_id is not None and dedup.recent.contains(update_id):
+        QUEUE_DUPLICATES.inc()
+        return None
+
+    async with AsyncSessionLocal() as s:
+        if update_id is not None:
+            s.add(ProcessedUpdate(update_id=update_id, chat_id=chat_id))
+        row = QueuedUpdate(
+            update_id=update_id,
+            chat_id=chat_id,
+            payload=data,
+            status="pending",
+            attempts=0,
+            available_at=datetime.utcnow(),
+        )
+        s.add(row)
+        try:
+            await s.commit()
+        except IntegrityError:
+            await s.rollback()
+            dedup.recent.add(update_id)
+            QUEUE_DUPLICATES.inc()
+            logs.info("update_duplicate", update_id=update_id)
+            return None
+        row_id = row.id
+
+    if update_id is not None:
+        dedup.recent.add(update_id)
+    _notify()
+    return row_id
+
+
+async def claim_next() -> Optional[Job]:
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=QUEUE_VISIBILITY_TIMEOUT)
+    earlier = aliased(QueuedUpdate)
+    is_chat_head = ~exists().where(and_(
+        earlier.chat_id == QueuedUpdate.chat_id,
+        earlier.id < QueuedUpdate.id,
+    ))
+    async with AsyncSessionLocal() as s:
+        q = (
+            select(QueuedUpdate)
+            .where(or_(
+                and_(QueuedUpdate.status == "pending", QueuedUpdate.available_at <= now),
+                and_(QueuedUpdate.status == "processing", QueuedUpdate.locked_at < stale),
+            ))
+            .where(is_chat_head)
+            .order_by(QueuedUpdate.id)
+            .limit(1)
+        )
+        if s.bind.dialect.name == "postgresql":
+            q = q.with_for_update(skip_locked=True)
+        row = (await s.execute(q)).scalars().first()
+        if not row:
+            return None
+        # UPDATE condicionado a attempts: si otro worker (o proceso) lo ha
+        # reclamado entre el SELECT y aquí, no afecta a ninguna fila
+        attempts = row.attempts or 0
+        created_at = row.created_at
+        job = Job(row.id, row.update_id, row.chat_id, row.payload, attempts + 1)
+        result = await s.execute(
+            update(QueuedUpdate)
+            .where(QueuedUpdate.id == row.id, QueuedUpdate.attempts == attempts)
+            .values(status="processing", locked_at=now, attempts=attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await s.commit()
+    if result.rowcount != 1:
+        return None
+    if attempts == 0 and created_at is not None:
+        QUEUE_WAIT_SECONDS.observe(max((now - created_at).total_seconds(), 0.0))
+    return job
+
+
+async def complete(job: Job):
+    async with AsyncSessionLocal() as s:
+        await s.execute(delete(QueuedUpdate).where(QueuedUpdate.id == job.id))
+        await s.commit()
+
+
+async def fail(job: Job, error: Exception):
+    err = f"{type(error).__name__}: {error}"[:1000]
+    async with AsyncSessionLocal() as s:
+        row = await s.get(QueuedUpdate, job.id)
+        if not row:
+            return
+        if job.attempts >= QUEUE_MAX_ATTEMPTS:
+            s.add(DeadLetter(
+                update_id=row.update_id,
+                chat_id=row.chat_id,
+                payload=row.payload,
+                attempts=job.attempts,
+                last_error=err,
+                created_at=row.created_at,
+            ))
+            await s.delete(row)
+            QUEUE_RESULTS.labels("dead_letter").inc()
+            logs.error("update_dead_letter", error=err, attempts=job.attempts)
+        else:
+            row.status = "pending"
+            row.locked_at = None
+            row.last_error = err
+            row.available_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(job.attempts))
+            QUEUE_RESULTS.labels("retry").inc()
+            logs.warn("update_retry", error=err, attempts=job.attempts)
+        await s.commit()
+
+
+async def release(job: Job):
+    # Devuelve el update a la cola sin contar el intento (p. ej. en shutdown)
+    async with AsyncSessionLocal() as s:
+        row = await s.get(QueuedUpdate, job.id)
+        if row:
+            row.status = "pending"
+            row.locked_at = None
+            row.attempts = max((row.attempts or 1) - 1, 0)
+            await s.commit()
+
+
+async def pending_count() -> int:
+    async with AsyncSessionLocal() as s:
+        return (await s.execute(select(func.count()).select_from(QueuedUpdate))).scalar_one()
+
+# ---------- pool de workers ----------
+Handler = Callable[[dict], Awaitable[object]]
+
+_wakeup: Optional[asyncio.Event] = None
+_workers: list[asyncio.Task] = []
+
+
+def _notify():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _worker(handler: Handler):
+    while True:
+        try:
+            job = await claim_next()
+            if job is None:
+                # puede que otro worker se adelantara: un segundo intento
+                job = await claim_next()
+        except Exception as e:
+            logs.error("update_queue_claim_failed", e)
+            job = None
+
+        if job is None:
+            try:
+                await dedup.prune_db()
+            except Exception as e:
+                logs.warn("processed_updates_prune_failed", e)
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        # Todo lo que se loguee mientras se procesa lleva el id de correlación
+        with logs.context(cid=logs.correlation_id(job.update_id), update_id=job.update_id, chat_id=job.chat_id):
+            try:
+                await handler(job.payload)
+            except asyncio.CancelledError:
+                await release(job)
+                raise
+            except Exception as e:
+                await fail(job, e)
+            else:
+                await complete(job)
+                QUEUE_RESULTS.labels("done").inc()
+
+
+def start_workers(handler: Handler, n: int = QUEUE_WORKERS) -> list[asyncio.Task]:
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for i in range(n):
+        _workers.append(asyncio.create_task(_worker(handler), name=f"update-worker-{i}"))
+    return _workers
+
+
+async def stop_workers():
+    for t in _workers:
+        t.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
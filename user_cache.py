@@ -0,0 +1,381 @@
+# user_cache.py
+#
+# Caché en proceso de los User por chat_id (perfil y estado del onboarding):
+# la mayoría de updates leen el User que el update anterior del mismo chat
+# acaba de escribir. LRU acotada con TTL como red de seguridad.
+#
+# - Lectura: UpdateContext.load_user pide aquí el User; en un acierto se
+#   reconstruye desde la instantánea y se adjunta a la Session sin SELECT
+#   (las escrituras posteriores generan el UPDATE normal).
+# - Escritura (write-through): hooks de la Session. Todo commit que cree,
+#   modifique o borre un User (respuestas del onboarding, reset, semana
+#   actual, plan activo…) actualiza o invalida su entrada al confirmarse;
+#   un rollback no toca la caché.
+# - Varios workers: cada cambio se anuncia por un canal de invalidación.
+#   En Postgres es LISTEN/NOTIFY (el NOTIFY va dentro de la transacción, así
+#   que solo llega si hay commit); si no, un bus en proceso que sirve de
+#   sustituto para pruebas y despliegues de un solo worker.
+# - Los UPDATE masivos (recalc_nutrition.py) no pasan por el ORM: deben
+#   llamar a invalidate_all(session) antes del commit.
+
+import os, copy, time, uuid, asyncio
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+import logs
+import metrics
+from db import ASYNC_DATABASE_URL, User
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "1") == "1"
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "600"))
+# auto → postgres si la base de datos es Postgres; local → bus en proceso; off
+USER_CACHE_CHANNEL = os.getenv("USER_CACHE_CHANNEL", "auto")
+USER_CACHE_NOTIFY_CHANNEL = os.getenv("USER_CACHE_NOTIFY_CHANNEL", "user_cache")
+
+ALL = "*"
+NODE_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+_COLUMNS = tuple(c.key for c in User.__mapper__.column_attrs)
+_NULL_ON_INSERT = {c.key for c in User.__mapper__.column_attrs if c.columns[0].server_default is None}
+# pg_notify admite hasta 8000 bytes de payload
+_NOTIFY_BATCH = 400
+
+USER_CACHE_LOOKUPS = metrics.counter(
+    "user_cache_lookups_total", "Búsquedas en la caché de usuarios (hit | miss | expired)", ("result",))
+USER_CACHE_INVALIDATIONS = metrics.counter(
+    "user_cache_invalidations_total", "Entradas invalidadas (local = commit propio, remote = otro worker)",
+    ("source",))
+USER_CACHE_ENTRIES = metrics.gauge("user_cache_entries", "Usuarios en la caché")
+
+
+def snapshot(u: User, inserted: bool = False) -> Optional[dict]:
+    # Copia de las columnas; None si alguna no está cargada (no se cachea).
+    # En un INSERT las columnas que no se asignaron quedan sin cargar, pero
+    # son NULL si no tienen valor por defecto en el servidor.
+    unloaded = inspect(u).unloaded.intersection(_COLUMNS)
+    if unloaded and not (inserted and unloaded <= _NULL_ON_INSERT):
+        return None
+    values = {k: None for k in unloaded}
+    for k in _COLUMNS:
+        if k not in unloaded:
+            v = getattr(u, k)
+            values[k] = copy.deepcopy(dict(v) if isinstance(v, dict) else v)
+    return values
+
+
+class UserCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # Sube con cada invalidación: una lectura de la base de datos que
+        # empezó antes no debe guardarse (podría ser anterior al cambio)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.writes = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, chat_id: str, now: Optional[float] = None) -> Optional[dict]:
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            self.misses += 1
+            USER_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        expires_at, values = entry
+        if (now or time.monotonic()) > expires_at:
+            del self._entries[chat_id]
+            self.expired += 1
+            USER_CACHE_LOOKUPS.labels("expired").inc()
+            return None
+        self._entries.move_to_end(chat_id)
+        self.hits += 1
+        USER_CACHE_LOOKUPS.labels("hit").inc()
+        return values
+
+    def put(self, chat_id: str, values: dict, generation: Optional[int] = None, now: Optional[float] = None):
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[chat_id] = ((now or time.monotonic()) + self.ttl, values)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def write(self, chat_id: str, values: dict):
+        # Write-through tras un commit: sustituye la entrada y descarta las
+        # lecturas de la base de datos que estuvieran en curso
+        self.generation += 1
+        self.writes += 1
+        self.put(chat_id, values)
+
+    def invalidate(self, chat_id: str):
+        self.generation += 1
+        if chat_id == ALL:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+        elif self._entries.pop(chat_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.expired
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "db_reads_avoided": self.hits,
+            "evicted": self.evicted,
+            "writes": self.writes,
+            "invalidations": self.invalidations,
+        }
+
+
+cache = UserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+USER_CACHE_ENTRIES.set_function(lambda: len(cache))
+
+
+# ---------- lectura ----------
+def attach(session, values: dict) -> User:
+    # User persistente en la Session a partir de una instantánea, sin SELECT
+    sync = getattr(session, "sync_session", session)
+    existing = sync.identity_map.get(sync.identity_key(User, values["id"]))
+    if existing is not None:
+        return existing
+    u = User(**copy.deepcopy(values))
+    make_transient_to_detached(u)
+    sync.add(u)
+    return u
+
+
+async def load(session, chat_id: int | str) -> Optional[User]:
+    chat_id = str(chat_id)
+    if USER_CACHE_ENABLED:
+        values = cache.get(chat_id)
+        if values is not None:
+            return attach(session, values)
+    generation = cache.generation
+    result = await session.execute(select(User).where(User.chat_id == chat_id))
+    u = result.scalars().first()
+    if u is not None and USER_CACHE_ENABLED:
+        values = snapshot(u)
+        if values is not None:
+            cache.put(chat_id, values, generation)
+    return u
+
+
+# ---------- canales de invalidación ----------
+def make_listener(target: UserCache, node_id: str) -> Callable[[str], None]:
+    # Payload "<nodo>:<chat_id>,<chat_id>…" ("*" = todos); los propios se ignoran
+    def on_message(payload: str):
+        node, _, keys = payload.partition(":")
+        if node == node_id:
+            return
+        for key in keys.split(","):
+            if key:
+                target.invalidate(key)
+                USER_CACHE_INVALIDATIONS.labels("remote").inc()
+    return on_message
+
+
+class LocalBus:
+    # Sustituto en proceso de LISTEN/NOTIFY: entrega a todos los suscritos
+    def __init__(self):
+        self._subscribers: list[Callable[[str], None]] = []
+
+    def subscribe(self, fn: Callable[[str], None]):
+        self._subscribers.append(fn)
+
+    def unsubscribe(self, fn: Callable[[str], None]):
+        if fn in self._subscribers:
+            self._subscribers.remove(fn)
+
+    def publish(self, payload: str):
+        for fn in list(self._subscribers):
+            fn(payload)
+
+
+local_bus = LocalBus()
+
+
+class LocalChannel:
+    name = "local"
+
+    def __init__(self, bus: LocalBus = local_bus):
+        self.bus = bus
+        self._listener: Optional[Callable[[str], None]] = None
+
+    def in_transaction(self, session: Session, keys: list[str]):
+        pass
+
+    def after_commit(self, keys: list[str]):
+        self.bus.publish(f"{NODE_ID}:{','.join(keys)}")
+
+    async def start(self, on_message: Callable[[str], None]):
+        self._listener = on_message
+        self.bus.subscribe(on_message)
+
+    async def stop(self):
+        if self._listener is not None:
+            self.bus.unsubscribe(self._listener)
+            self._listener = None
+
+
+class PostgresChannel:
+    # NOTIFY dentro de la transacción del cambio; LISTEN en una conexión
+    # asyncpg propia que se reabre si se cae (y entonces se vacía la caché:
+    # pudo perderse algún aviso mientras tanto)
+    name = "postgres"
+
+    def __init__(self, dsn: str, channel: str, retry_seconds: float = 5.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.retry_seconds = retry_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def in_transaction(self, session: Session, keys: list[str]):
+        conn = session.connection()
+        for i in range(0, len(keys), _NOTIFY_BATCH):
+            payload = f"{NODE_ID}:{','.join(keys[i:i + _NOTIFY_BATCH])}"
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload})
+
+    def after_commit(self, keys: list[str]):
+        pass
+
+    async def start(self, on_message: Callable[[str], None]):
+        self._task = asyncio.create_task(self._listen(on_message), name="user-cache-listen")
+
+    async def _listen(self, on_message: Callable[[str], None]):
+        import asyncpg
+
+        def handler(conn, pid, channel, payload):
+            on_message(payload)
+
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                await conn.add_listener(self.channel, handler)
+                on_message(f"listen:{ALL}")
+                while not conn.is_closed():
+                    await asyncio.sleep(self.retry_seconds)
+            except asyncio.CancelledError:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+                raise
+            except Exception as e:
+                logs.warn("user_cache_listen_failed", e)
+            await asyncio.sleep(self.retry_seconds)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def _make_channel():
+    kind = USER_CACHE_CHANNEL
+    if kind == "auto":
+        kind = "postgres" if ASYNC_DATABASE_URL.startswith("postgresql") else "local"
+    if kind == "postgres":
+        return PostgresChannel(ASYNC_DATABASE_URL.replace("+asyncpg", "", 1), USER_CACHE_NOTIFY_CHANNEL)
+    if kind == "local":
+        return LocalChannel()
+    return None
+
+
+channel = _make_channel()
+
+
+async def start():
+    if USER_CACHE_ENABLED and channel is not None:
+        await channel.start(make_listener(cache, NODE_ID))
+
+
+async def stop():
+    if channel is not None:
+        await channel.stop()
+
+
+# ---------- write-through (hooks de la Session) ----------
+def _announce(session: Session, keys: list[str]):
+    # Una vez por transacción y clave
+    sent = session.info.setdefault("user_cache_announced", set())
+    new = [k for k in keys if k not in sent]
+    if new and channel is not None:
+        sent.update(new)
+        channel.in_transaction(session, new)
+
+
+def invalidate_all(session: Session):
+    # Para UPDATE/DELETE masivos sobre users: se vacía al confirmar el commit
+    session = getattr(session, "sync_session", session)
+    session.info.setdefault("user_cache_changed", {})[ALL] = None
+    _announce(session, [ALL])
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    # new/dirty/deleted aún reflejan lo que se acaba de escribir
+    # (chat_id → (User, insertado) o None si se borró)
+    changed = {}
+    for obj in session.dirty:
+        if isinstance(obj, User) and obj.chat_id:
+            changed[str(obj.chat_id)] = (obj, False)
+    for obj in session.new:
+        if isinstance(obj, User) and obj.chat_id:
+            changed[str(obj.chat_id)] = (obj, True)
+    for obj in session.deleted:
+        if isinstance(obj, User) and obj.chat_id:
+            changed[str(obj.chat_id)] = None
+    if changed:
+        pending = session.info.setdefault("user_cache_changed", {})
+        for chat_id, entry in changed.items():
+            # Un User insertado en un flush anterior de la misma transacción sigue siéndolo
+            if entry is not None and pending.get(chat_id) is not None and pending[chat_id][1]:
+                entry = (entry[0], True)
+            pending[chat_id] = entry
+        _announce(session, list(changed))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    changed = session.info.pop("user_cache_changed", None)
+    session.info.pop("user_cache_announced", None)
+    if not changed:
+        return
+    for chat_id, entry in changed.items():
+        values = None
+        if entry is not None and not inspect(entry[0]).deleted:
+            values = snapshot(*entry)
+        if values is not None and USER_CACHE_ENABLED:
+            cache.write(chat_id, values)
+        else:
+            cache.invalidate(chat_id)
+            USER_CACHE_INVALIDATIONS.labels("local").inc()
+    if channel is not None:
+        channel.after_commit(list(changed))
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("user_cache_changed", None)
+    session.info.pop("user_cache_announced", None)
+
+
+def stats() -> dict:
+    return {
+        "enabled": USER_CACHE_ENABLED,
+        "channel": channel.name if channel is not None else None,
+        **cache.stats(),
+    }